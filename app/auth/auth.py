@@ -1,8 +1,12 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+import os
+import time
+import uuid
+from app.db.conexaopg import pg_connection_manager
 #from decouple import config
 
 #Configurações Basicas
@@ -10,19 +14,20 @@ SECRET_KEY = "a2e4b0e1b9e3f8c7a9e1c5b4e2a3c0b1" #config("SECRET_KEY")
 ALGORITHM = "HS256" #config("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440 #int(config("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
-#Contexto de criptografia da Senha
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Refresh token: validade e duração dos access tokens emitidos a partir dele
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+TIPO_REFRESH = "refresh"
+
+# Quantidade máxima de tokens já verificados mantidos em memória
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "10000"))
+
+#Hash e verificação de senha: verificar_senha/gerar_hash_senha em senhas.py (rodam fora do event loop)
 
 # Recurso para autenticação com token (OAuth2)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Funções auxiliares
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,10 +39,91 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_refresh_token(data: dict, expires_delta: timedelta = None):
+    """Refresh token assinado, identificado por um jti para permitir a revogação"""
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    to_encode.update({"exp": expire, "tipo": TIPO_REFRESH, "jti": uuid.uuid4().hex})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+# Refresh tokens revogados (logout e rotação): ficam na tbrefresh_revogado, compartilhada entre
+# os workers e preservada entre reinícios. _refresh_revogados (jti -> exp) só evita ir ao banco
+# de novo para um jti que este processo já sabe revogado; o jti só importa até o token expirar,
+# depois disso a própria assinatura já o recusa.
+_refresh_revogados = {}
+
+INSERT_REVOGADO = """
+    INSERT INTO tbrefresh_revogado (jti, expira_em) VALUES ($1, to_timestamp($2))
+    ON CONFLICT (jti) DO NOTHING
+"""
+CONSULTA_REVOGADO = "SELECT 1 FROM tbrefresh_revogado WHERE jti = $1"
+DELETE_REVOGADOS_EXPIRADOS = "DELETE FROM tbrefresh_revogado WHERE expira_em <= now()"
+
+def _limpar_revogados():
+    agora = time.time()
+    for jti in [jti for jti, exp in _refresh_revogados.items() if exp <= agora]:
+        del _refresh_revogados[jti]
+
+async def revogar_refresh_token(payload: dict) -> bool:
+    """Revoga o refresh token; False se ele já estava revogado (outro request chegou antes)"""
+    _limpar_revogados()
+    async with pg_connection_manager() as conn:
+        async with conn.transaction():
+            await conn.execute(DELETE_REVOGADOS_EXPIRADOS)
+            status_insert = await conn.execute(INSERT_REVOGADO, payload["jti"], payload["exp"])
+    _refresh_revogados[payload["jti"]] = payload["exp"]
+    return status_insert.endswith(" 1")
+
+async def decode_refresh_token(token: str):
+    """Valida o refresh token (assinatura, validade, tipo e revogação) e retorna as claims"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        detail = "Refresh token expirado" if "expired" in str(e) else "Refresh token inválido"
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+    if payload.get("tipo") != TIPO_REFRESH or not payload.get("jti"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token inválido")
+    revogado = payload["jti"] in _refresh_revogados
+    if not revogado:
+        async with pg_connection_manager() as conn:
+            revogado = await conn.fetchval(CONSULTA_REVOGADO, payload["jti"]) is not None
+        if revogado:
+            _refresh_revogados[payload["jti"]] = payload["exp"]
+    if revogado:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revogado")
+    return payload
+
+# Tokens já verificados: token completo (inclui a assinatura) -> (exp, claims), em ordem LRU
+_tokens_verificados = OrderedDict()
+
+def _claims_em_cache(token: str):
+    item = _tokens_verificados.get(token)
+    if item is None:
+        return None
+    exp, payload = item
+    if exp <= time.time():
+        # Expirado: sai do cache e a validação normal devolve "Token expirado"
+        _tokens_verificados.pop(token, None)
+        return None
+    _tokens_verificados.move_to_end(token)
+    return payload
+
+def _guardar_claims(token: str, payload: dict):
+    exp = payload.get("exp")
+    if not isinstance(exp, (int, float)):
+        return
+    _tokens_verificados[token] = (exp, payload)
+    _tokens_verificados.move_to_end(token)
+    while len(_tokens_verificados) > TOKEN_CACHE_MAX:
+        _tokens_verificados.popitem(last=False)
+
 def decode_access_token(token: str):
+    # Token verificado recentemente: dispensa a verificação HMAC e a leitura das claims
+    payload = _claims_em_cache(token)
+    if payload is not None:
+        return dict(payload)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError as e:
         if "expired" in str(e):  # Verifica se o erro é de expiração
             raise HTTPException(
@@ -51,5 +137,18 @@ def decode_access_token(token: str):
             detail="Token inválido",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+    # Refresh token não serve como access token
+    if payload.get("tipo") == TIPO_REFRESH:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    _guardar_claims(token, payload)
+    return dict(payload)
 
+async def get_token_payload(request: Request, token: str = Depends(oauth2_scheme)) -> dict:
+    """Dependência de autenticação: verifica o token uma vez e guarda as claims em request.state"""
+    payload = decode_access_token(token)
+    request.state.token_payload = payload
+    return payload
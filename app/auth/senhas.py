@@ -0,0 +1,92 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Custo do bcrypt: hashes com custo menor são refeitos no próximo login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Processos dedicados ao bcrypt e limite de operações aguardando (acima dele responde 503)
+SENHA_POOL_WORKERS = int(os.getenv("SENHA_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+SENHA_MAX_PENDENTES = int(os.getenv("SENHA_MAX_PENDENTES", "32"))
+
+#Contexto de criptografia da Senha
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+# Funções executadas nos processos do pool
+def _verificar_e_atualizar(senha: str, hash_senha: str):
+    return pwd_context.verify_and_update(senha, hash_senha)
+
+def _gerar_hash(senha: str) -> str:
+    return pwd_context.hash(senha)
+
+
+_executor = None
+_pendentes = 0
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: os processos não herdam o event loop nem as conexões abertas do worker
+        _executor = ProcessPoolExecutor(
+            max_workers=SENHA_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+async def _executar(func, *args):
+    """Executa a função no pool de processos, recusando com 503 quando há operações demais na fila"""
+    global _executor, _pendentes
+    if _pendentes >= SENHA_MAX_PENDENTES:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado validando senhas, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+    _pendentes += 1
+    executor = None
+    try:
+        executor = _get_executor()
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+    except BrokenProcessPool:
+        # Um processo do pool morreu: descarta o pool para que o próximo uso crie outro
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Falha temporária ao validar a senha, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+    finally:
+        _pendentes -= 1
+
+async def verificar_senha(senha: str, hash_senha: str):
+    """
+    Verifica a senha fora do event loop. Retorna (valida, novo_hash); novo_hash vem
+    preenchido quando o hash guardado usa parâmetros antigos e deve ser substituído.
+    """
+    return await _executar(_verificar_e_atualizar, senha, hash_senha)
+
+async def gerar_hash_senha(senha: str) -> str:
+    """Gera o hash bcrypt da senha fora do event loop"""
+    return await _executar(_gerar_hash, senha)
+
+def shutdown_senhas_executor():
+    """Encerra os processos do pool de senhas (usado no desligamento)"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+import asyncpg
+from sqlalchemy import text
+from dotenv import load_dotenv
+from app.db.conexaopg import PG_USER, PG_PASSWORD, PG_HOST, PG_PORT, PG_DATABASE
+from app.utils.mesesfechados import meses_fechados_kpi
+from app.utils.cachebi import cache_bi_respostas
+
+load_dotenv()
+
+# Tempo de vida (segundos) dos dados de conexão da empresa em memória
+EMPRESAS_CACHE_TTL = float(os.getenv("EMPRESAS_CACHE_TTL", "300"))
+
+# Canal do LISTEN/NOTIFY usado para avisar alterações em tbempresas
+CANAL_EMPRESAS = "tbempresas_alterada"
+
+_cache = {}  # codempresa -> (expira_em, dados)
+_em_andamento = {}  # codempresa -> Future da carga em andamento
+_geracao = 0  # Incrementada a cada invalidação, descarta cargas iniciadas antes dela
+
+async def get_dados_empresa(codempresa, carregar):
+    """Retorna os dados da empresa do cache, carregando com `carregar(codempresa)` se expirado"""
+    chave = str(codempresa)
+    item = _cache.get(chave)
+    if item and item[0] > time.monotonic():
+        return item[1]
+
+    # Requisições simultâneas da mesma empresa aguardam uma única carga
+    carga = _em_andamento.get(chave)
+    if carga is None:
+        carga = asyncio.ensure_future(_carregar_e_guardar(chave, codempresa, carregar))
+        _em_andamento[chave] = carga
+        carga.add_done_callback(lambda _: _em_andamento.pop(chave, None))
+    return await asyncio.shield(carga)
+
+async def _carregar_e_guardar(chave, codempresa, carregar):
+    geracao = _geracao
+    dados = await carregar(codempresa)
+    if geracao == _geracao:
+        _cache[chave] = (time.monotonic() + EMPRESAS_CACHE_TTL, dados)
+    return dados
+
+def invalidar_empresa(codempresa=None):
+    """Remove a empresa (ou todas, se não informada) do cache local"""
+    global _geracao
+    _geracao += 1
+    if codempresa is None:
+        _cache.clear()
+    else:
+        _cache.pop(str(codempresa), None)
+
+async def notificar_alteracao_empresa(db, codempresa):
+    """Envia o NOTIFY de alteração da empresa na sessão informada (entregue no commit)"""
+    await db.execute(text("SELECT pg_notify(:canal, :codempresa)"),
+                     {"canal": CANAL_EMPRESAS, "codempresa": str(codempresa)})
+
+def _on_notificacao(conn, pid, canal, payload):
+    invalidar_empresa(payload or None)
+    # O mesmo aviso descarta os meses fechados do kpi_mes_ano (ex.: correção em mês antigo)
+    # e as respostas do BI em cache (ex.: limites de consultas ou banco da empresa alterados)
+    meses_fechados_kpi.invalidar_empresa(payload or None)
+    cache_bi_respostas.invalidar_empresa(payload or None)
+
+
+class EmpresasListener:
+    """Escuta o canal de alterações de tbempresas e invalida os caches deste worker"""
+
+    def __init__(self, reconectar_apos: float = 5.0):
+        self.reconectar_apos = reconectar_apos
+        self._tarefa = None
+        self._parar = asyncio.Event()
+
+    async def start(self):
+        self._parar = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def stop(self):
+        self._parar.set()
+        if self._tarefa:
+            await self._tarefa
+            self._tarefa = None
+
+    async def _executar(self):
+        while not self._parar.is_set():
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    user=PG_USER,
+                    password=PG_PASSWORD,
+                    database=PG_DATABASE,
+                    host=PG_HOST,
+                    port=int(PG_PORT)
+                )
+                encerrada = asyncio.Event()
+                conn.add_termination_listener(lambda _: encerrada.set())
+                await conn.add_listener(CANAL_EMPRESAS, _on_notificacao)
+
+                # Notificações podem ter sido perdidas enquanto estava desconectado
+                invalidar_empresa()
+                meses_fechados_kpi.invalidar_empresa()
+                cache_bi_respostas.invalidar_empresa()
+
+                parar = asyncio.create_task(self._parar.wait())
+                perdida = asyncio.create_task(encerrada.wait())
+                await asyncio.wait({parar, perdida}, return_when=asyncio.FIRST_COMPLETED)
+                parar.cancel()
+                perdida.cancel()
+            except Exception as e:
+                print(f"Erro no listener de {CANAL_EMPRESAS}: {e}")
+            finally:
+                if conn and not conn.is_closed():
+                    await conn.close()
+
+            if not self._parar.is_set():
+                try:
+                    await asyncio.wait_for(self._parar.wait(), self.reconectar_apos)
+                except asyncio.TimeoutError:
+                    pass
+
+empresas_listener = EmpresasListener()
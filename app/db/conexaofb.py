@@ -1,10 +1,37 @@
 import firebird.driver as fb
 from fastapi import HTTPException
-from contextlib import contextmanager
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from dotenv import load_dotenv
+import asyncio
+import functools
+import os
+import threading
+import time
+from app.utils.filtrosbi import ListaTemporaria, INSERT_LISTA_TEMPORARIA
+
+load_dotenv()
 
 USER = "SYSDBA"
 PASSWORD = "masterkey"
 
+# Configurações do pool de conexões Firebird (por empresa); FB_POOL_MIN conexões são abertas
+# quando o pool é criado e mantidas mesmo ociosas
+FB_POOL_MIN = int(os.getenv("FB_POOL_MIN", "1"))
+FB_POOL_MAX = int(os.getenv("FB_POOL_MAX", "5"))
+FB_POOL_IDLE_TIMEOUT = float(os.getenv("FB_POOL_IDLE_TIMEOUT", "300"))  # segundos
+FB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("FB_POOL_CHECKOUT_TIMEOUT", "30"))  # segundos
+
+# Statements preparados mantidos por conexão do pool (LRU pelo texto SQL); 0 = desativado
+FB_STMT_CACHE_MAX = int(os.getenv("FB_STMT_CACHE_MAX", "32"))
+
+# Threads dedicadas às chamadas bloqueantes do driver Firebird
+FB_EXECUTOR_MAX_WORKERS = int(os.getenv("FB_EXECUTOR_MAX_WORKERS", "16"))
+
+# Consulta usada para validar a conexão antes de entregá-la
+QUERY_LIVENESS = "SELECT 1 FROM RDB$DATABASE"
+
 def get_firebird_connection(HOST: str, PORT: int, DATABASE: str):
     """Função para conectar ao Firebird"""
     try:
@@ -17,21 +44,462 @@ def get_firebird_connection(HOST: str, PORT: int, DATABASE: str):
     except Exception as e:
         raise HTTPException(status_code=501, detail=f"Erro ao conectar ao Firebird: {str(e)}")
 
+
+class _ConexaoPool:
+    """
+    Conexão Firebird mantida pelo pool, com os tempos de criação e último uso e os
+    statements já preparados nela (vivem enquanto a conexão estiver no pool)
+    """
+
+    def __init__(self, conn, pool=None):
+        self.conn = conn
+        self.pool = pool
+        self.criada_em = time.monotonic()
+        self.ultimo_uso = self.criada_em
+        self.statements = OrderedDict()  # texto SQL -> Statement
+        self.listas = set()  # ids das ListaTemporaria já gravadas na transação corrente
+
+    def preparar(self, cursor, query: str):
+        """Statement preparado da query (do cache da conexão ou preparado agora)"""
+        stmt = self.statements.get(query)
+        if stmt is not None:
+            self.statements.move_to_end(query)
+            if self.pool:
+                self.pool._registrar_statement(True, 0.0)
+            return stmt
+
+        inicio = time.perf_counter()
+        stmt = cursor.prepare(query)
+        if self.pool:
+            self.pool._registrar_statement(False, time.perf_counter() - inicio)
+        self.statements[query] = stmt
+        while len(self.statements) > FB_STMT_CACHE_MAX:
+            _, removido = self.statements.popitem(last=False)
+            try:
+                removido.free()
+            except Exception:
+                pass
+        return stmt
+
+    def descartar_statement(self, query: str):
+        stmt = self.statements.pop(query, None)
+        if stmt is not None:
+            try:
+                stmt.free()
+            except Exception:
+                pass
+
+    def fechar(self):
+        statements, self.statements = list(self.statements.values()), OrderedDict()
+        try:
+            for stmt in statements:
+                stmt.free()
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class FirebirdPool:
+    """Pool de conexões para um banco Firebird (ipbd, portabd, caminhobd)"""
+
+    def __init__(self, HOST: str, PORT: int, DATABASE: str,
+                 min_size: int = FB_POOL_MIN, max_size: int = FB_POOL_MAX,
+                 idle_timeout: float = FB_POOL_IDLE_TIMEOUT):
+        self.HOST = HOST
+        self.PORT = PORT
+        self.DATABASE = DATABASE
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+
+        self._livres = []  # Conexões ociosas (a mais recente no final)
+        self._em_uso = 0
+        self._cond = threading.Condition()
+        self._fechado = False  # Depois do close as conexões devolvidas são fechadas
+
+        # Estatísticas
+        self.criadas = 0
+        self.descartadas = 0
+        self.checkouts = 0
+        self.falhas_liveness = 0
+        self.esperas = 0
+        self.statements_hits = 0
+        self.statements_misses = 0
+        self.tempo_prepare = 0.0  # segundos gastos preparando statements
+
+    def _registrar_statement(self, hit: bool, tempo: float):
+        with self._cond:
+            if hit:
+                self.statements_hits += 1
+            else:
+                self.statements_misses += 1
+                self.tempo_prepare += tempo
+
+    def _total(self):
+        return len(self._livres) + self._em_uso
+
+    def _evict_idle(self):
+        """Fecha conexões ociosas além do mínimo (chamado com o lock adquirido)"""
+        agora = time.monotonic()
+        expiradas = []
+        while self._livres and self._total() > self.min_size:
+            # A mais antiga fica no início da lista
+            if agora - self._livres[0].ultimo_uso < self.idle_timeout:
+                break
+            expiradas.append(self._livres.pop(0))
+        return expiradas
+
+    def _descartar(self, item: _ConexaoPool):
+        item.fechar()
+        with self._cond:
+            self.descartadas += 1
+
+    def _conexao_viva(self, item: _ConexaoPool) -> bool:
+        """Executa o probe de liveness na conexão"""
+        cur = None
+        try:
+            cur = item.conn.cursor()
+            cur.execute(QUERY_LIVENESS)
+            cur.fetchone()
+            item.conn.commit()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cur:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+
+    def acquire(self, timeout: float = FB_POOL_CHECKOUT_TIMEOUT) -> _ConexaoPool:
+        """Obtém uma conexão do pool, abrindo uma nova se houver espaço"""
+        limite = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                expiradas = self._evict_idle()
+                item = None
+                criar = False
+                while item is None and not criar:
+                    if self._livres:
+                        item = self._livres.pop()
+                    elif self._total() < self.max_size:
+                        criar = True
+                    else:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            raise HTTPException(
+                                status_code=503,
+                                detail="Tempo esgotado aguardando conexão Firebird disponível"
+                            )
+                        self.esperas += 1
+                        self._cond.wait(restante)
+                self._em_uso += 1
+                self.checkouts += 1
+
+            for expirada in expiradas:
+                self._descartar(expirada)
+
+            if criar:
+                try:
+                    conn = get_firebird_connection(self.HOST, self.PORT, self.DATABASE)
+                except Exception:
+                    self._liberar_vaga()
+                    raise
+                with self._cond:
+                    self.criadas += 1
+                return _ConexaoPool(conn, self)
+
+            # Conexão reaproveitada: valida antes de entregar
+            if self._conexao_viva(item):
+                return item
+
+            with self._cond:
+                self.falhas_liveness += 1
+            self._descartar(item)
+            self._liberar_vaga()
+
+    def aquecer(self):
+        """Abre conexões até min_size, para que as primeiras consultas não paguem o connect"""
+        while True:
+            with self._cond:
+                if self._fechado or self._total() >= min(self.min_size, self.max_size):
+                    return
+                self._em_uso += 1  # Reserva a vaga enquanto conecta
+            try:
+                conn = get_firebird_connection(self.HOST, self.PORT, self.DATABASE)
+            except Exception as e:
+                self._liberar_vaga()
+                print(f"Erro ao abrir as conexões iniciais do Firebird {self.HOST}:{self.DATABASE}: {e}")
+                return
+            with self._cond:
+                self.criadas += 1
+            self.release(_ConexaoPool(conn, self))
+
+    def _liberar_vaga(self):
+        with self._cond:
+            self._em_uso -= 1
+            self._cond.notify()
+
+    def release(self, item: _ConexaoPool, descartar: bool = False):
+        """Devolve a conexão ao pool (ou a descarta se estiver inválida)"""
+        if descartar or item.conn.is_closed():
+            self._descartar(item)
+            self._liberar_vaga()
+            return
+
+        item.ultimo_uso = time.monotonic()
+        with self._cond:
+            fechado = self._fechado
+            if not fechado:
+                self._em_uso -= 1
+                self._livres.append(item)
+                self._cond.notify()
+        if fechado:
+            self._descartar(item)
+            self._liberar_vaga()
+
+    def close(self):
+        """Fecha todas as conexões ociosas do pool (as em uso são fechadas ao serem devolvidas)"""
+        with self._cond:
+            self._fechado = True
+            livres, self._livres = self._livres, []
+        for item in livres:
+            self._descartar(item)
+
+    def stats(self) -> dict:
+        with self._cond:
+            preparados = self.statements_misses
+            return {
+                "host": self.HOST,
+                "porta": self.PORT,
+                "banco": self.DATABASE,
+                "min": self.min_size,
+                "max": self.max_size,
+                "livres": len(self._livres),
+                "em_uso": self._em_uso,
+                "criadas": self.criadas,
+                "descartadas": self.descartadas,
+                "checkouts": self.checkouts,
+                "falhas_liveness": self.falhas_liveness,
+                "esperas": self.esperas,
+                # Statements preparados nas conexões livres
+                "statements": sum(len(item.statements) for item in self._livres),
+                "statements_hits": self.statements_hits,
+                "statements_misses": preparados,
+                "prepare_medio_ms": (self.tempo_prepare / preparados) * 1000 if preparados else 0.0,
+            }
+
+
+# Pools por banco Firebird, chaveados por (ipbd, portabd, caminhobd)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_firebird_pool(HOST: str, PORT: int, DATABASE: str) -> FirebirdPool:
+    """Retorna (criando se necessário) o pool do banco informado"""
+    chave = (HOST, str(PORT), DATABASE)
+    with _pools_lock:
+        pool = _pools.get(chave)
+        if pool is not None:
+            return pool
+        pool = FirebirdPool(HOST, PORT, DATABASE)
+        _pools[chave] = pool
+    # Pool novo: abre as min_size conexões em segundo plano, sem atrasar quem o criou
+    try:
+        _executor.submit(pool.aquecer)
+    except RuntimeError:
+        pass  # Executor já encerrado (desligamento)
+    return pool
+
+def get_firebird_pool_stats() -> list:
+    """Estatísticas de todos os pools Firebird ativos"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+def close_firebird_pools():
+    """Fecha as conexões ociosas de todos os pools (usado no desligamento)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
 @contextmanager
 def firebird_connection_manager(HOST: str, PORT: int, DATABASE: str):
     """Context manager para gerenciar conexões Firebird automaticamente"""
-    conn = None
+    pool = get_firebird_pool(HOST, PORT, DATABASE)
+    item = pool.acquire()
     cursor = None
+    sucesso = False
     try:
-        conn = get_firebird_connection(HOST, PORT, DATABASE)
-        cursor = conn.cursor()
-        yield conn, cursor
+        cursor = item.conn.cursor()
+        yield item.conn, cursor
+        sucesso = True
     except Exception as e:
-        if conn:
-            conn.rollback()
         raise HTTPException(status_code=501, detail=f"Erro na operação Firebird: {str(e)}")
     finally:
-        if cursor:
+        _finalizar_uso(pool, item, cursor, sucesso)
+
+def _finalizar_uso(pool: FirebirdPool, item: _ConexaoPool, cursor, sucesso: bool):
+    """Fecha o cursor, encerra a transação e devolve a conexão ao pool"""
+    descartar = False
+    if cursor:
+        try:
             cursor.close()
-        if conn:
-            conn.close()
\ No newline at end of file
+        except Exception:
+            descartar = True
+    # Encerra a transação para que o próximo uso enxergue dados atualizados
+    if not _encerrar_transacao(item.conn, commit=sucesso):
+        descartar = True
+    # O fim da transação limpa a TMP_BI_FILTRO (ON COMMIT DELETE ROWS)
+    item.listas.clear()
+    pool.release(item, descartar=descartar)
+
+def _encerrar_transacao(conn, commit: bool) -> bool:
+    """Finaliza a transação corrente; retorna False se a conexão ficou inutilizável"""
+    try:
+        if commit:
+            conn.commit()
+        else:
+            conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+# Executor limitado para as chamadas bloqueantes do driver (connect/execute/fetch)
+_executor = ThreadPoolExecutor(max_workers=FB_EXECUTOR_MAX_WORKERS, thread_name_prefix="firebird")
+
+def _submeter(func, *args, **kwargs):
+    return _executor.submit(functools.partial(func, *args, **kwargs))
+
+async def run_in_firebird_executor(func, *args, **kwargs):
+    """Executa uma função bloqueante no executor Firebird sem travar o event loop"""
+    return await asyncio.wrap_future(_submeter(func, *args, **kwargs))
+
+def shutdown_firebird_executor():
+    """Encerra o executor Firebird aguardando as chamadas em andamento"""
+    _executor.shutdown(wait=True, cancel_futures=True)
+
+
+def plano_consulta(cursor, query: str, detalhado: bool = False) -> str:
+    """Plano de execução escolhido pelo Firebird para a query (só prepara, não executa)"""
+    stmt = cursor.prepare(query)
+    try:
+        return stmt.detailed_plan if detalhado else stmt.plan
+    finally:
+        stmt.free()
+
+def _carregar_listas(cursor, params, carregadas: set, item: _ConexaoPool = None):
+    """
+    Grava na TMP_BI_FILTRO as ListaTemporaria de `params` ainda não gravadas na transação
+    e retorna os parâmetros com o id de cada lista no lugar dela
+    """
+    if not params or not any(isinstance(p, ListaTemporaria) for p in params):
+        return params
+    resultado = []
+    for p in params:
+        if isinstance(p, ListaTemporaria):
+            if p.id not in carregadas:
+                insert = INSERT_LISTA_TEMPORARIA
+                if item is not None and FB_STMT_CACHE_MAX > 0:
+                    insert = item.preparar(cursor, INSERT_LISTA_TEMPORARIA)
+                cursor.executemany(insert, p.linhas())
+                carregadas.add(p.id)
+            p = p.id
+        resultado.append(p)
+    return resultado
+
+def _executar_direto(cursor, query, params, carregadas: set):
+    return cursor.execute(query, _carregar_listas(cursor, params, carregadas))
+
+def _executar_preparado(item: _ConexaoPool, cursor, query, params):
+    # Fecha o resultado anterior antes de preparar: a LRU pode liberar o statement dele
+    cursor.close()
+    params = _carregar_listas(cursor, params, item.listas, item)
+    stmt = item.preparar(cursor, query)
+    try:
+        return cursor.execute(stmt, params)
+    except Exception:
+        # Statement invalidado (ex.: view alterada): prepara de novo na próxima vez
+        item.descartar_statement(query)
+        raise
+
+
+class AsyncFirebirdCursor:
+    """
+    Cursor Firebird com execute/fetch aguardáveis, executados no executor dedicado.
+    Com a conexão do pool, o execute reaproveita os statements já preparados nela.
+    """
+
+    def __init__(self, cursor, item: _ConexaoPool = None):
+        self._cursor = cursor
+        self._item = item
+        self._pendente = None  # Última chamada enviada ao executor
+        self._listas = set()  # ListaTemporaria gravadas, quando não há conexão do pool
+
+    async def _executar(self, func, *args):
+        self._pendente = _submeter(func, *args)
+        return await asyncio.wrap_future(self._pendente)
+
+    async def execute(self, query, params=None):
+        if self._item is not None and FB_STMT_CACHE_MAX > 0:
+            await self._executar(_executar_preparado, self._item, self._cursor, query, params)
+        else:
+            carregadas = self._item.listas if self._item is not None else self._listas
+            await self._executar(_executar_direto, self._cursor, query, params, carregadas)
+        return self
+
+    async def plano(self, query, detalhado: bool = False) -> str:
+        return await self._executar(plano_consulta, self._cursor, query, detalhado)
+
+    async def fetchone(self):
+        return await self._executar(self._cursor.fetchone)
+
+    async def fetchmany(self, size: int = None):
+        return await self._executar(self._cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._executar(self._cursor.fetchall)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+def _finalizar_uso_async(pool: FirebirdPool, item: _ConexaoPool, cursor, sucesso: bool, pendente):
+    # Se a requisição foi cancelada, aguarda a chamada em andamento antes de devolver a conexão
+    if pendente is not None and not pendente.cancel():
+        wait_futures([pendente])
+    _finalizar_uso(pool, item, cursor, sucesso)
+
+def _devolver_checkout(pool: FirebirdPool, checkout):
+    if not checkout.cancelled() and checkout.exception() is None:
+        pool.release(checkout.result())
+
+@asynccontextmanager
+async def firebird_async_connection_manager(HOST: str, PORT: int, DATABASE: str):
+    """Versão assíncrona do firebird_connection_manager: (conn, AsyncFirebirdCursor)"""
+    pool = get_firebird_pool(HOST, PORT, DATABASE)
+    checkout = _submeter(pool.acquire)
+    try:
+        item = await asyncio.wrap_future(checkout)
+    except asyncio.CancelledError:
+        # Requisição cancelada durante a espera: devolve a conexão assim que for obtida
+        checkout.add_done_callback(functools.partial(_devolver_checkout, pool))
+        raise
+    cursor = None
+    async_cursor = None
+    sucesso = False
+    try:
+        cursor = await run_in_firebird_executor(item.conn.cursor)
+        async_cursor = AsyncFirebirdCursor(cursor, item)
+        yield item.conn, async_cursor
+        sucesso = True
+    except Exception as e:
+        raise HTTPException(status_code=501, detail=f"Erro na operação Firebird: {str(e)}")
+    finally:
+        pendente = async_cursor._pendente if async_cursor else None
+        await asyncio.shield(asyncio.wrap_future(
+            _submeter(_finalizar_uso_async, pool, item, cursor, sucesso, pendente)
+        ))
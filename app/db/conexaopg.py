@@ -3,7 +3,9 @@ from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 from fastapi import HTTPException
+import asyncio
 import asyncpg
+import time
 from contextlib import asynccontextmanager
 
 load_dotenv()
@@ -28,12 +30,29 @@ missing_vars = [var for var, value in required_vars.items() if not value]
 if missing_vars:
     raise ValueError(f"Variáveis de ambiente obrigatórias não definidas: {', '.join(missing_vars)}")
 
+# Configurações do pool de conexões PostgreSQL
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "100"))
+PG_CONN_MAX_LIFETIME = float(os.getenv("PG_CONN_MAX_LIFETIME", "1800"))  # segundos
+PG_CONN_MAX_INACTIVE = float(os.getenv("PG_CONN_MAX_INACTIVE", "300"))  # segundos
+PG_POOL_CLOSE_TIMEOUT = float(os.getenv("PG_POOL_CLOSE_TIMEOUT", "10"))  # segundos
+PG_ECHO = os.getenv("PG_ECHO", "true").lower() == "true"
+
 # Constrói a URL de conexão
 DB_URL = f"postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DATABASE}"
 
 
 #Cria a Engine
-engine = create_async_engine(DB_URL, echo=True)
+engine = create_async_engine(
+    DB_URL,
+    echo=PG_ECHO,
+    pool_size=PG_POOL_MIN_SIZE,
+    max_overflow=max(PG_POOL_MAX_SIZE - PG_POOL_MIN_SIZE, 0),
+    pool_recycle=PG_CONN_MAX_LIFETIME,
+    pool_pre_ping=True,
+    connect_args={"prepared_statement_cache_size": PG_STATEMENT_CACHE_SIZE},
+)
 
 # Criação do SessionMaker
 async_session = sessionmaker(
@@ -46,17 +65,71 @@ async def get_db():
     async with async_session() as session:
         yield session
 
-# Conexão simples com PostgreSQL
+# Conexão asyncpg que guarda o momento de criação (para o tempo de vida máximo)
+class ConexaoPG(asyncpg.Connection):
+    __slots__ = ('_criada_em',)
+
+async def _init_conexao(conn):
+    conn._criada_em = time.monotonic()
+
+# Pool asyncpg compartilhado, criado no lifespan da aplicação
+pg_pool = None
+_pg_pool_lock = asyncio.Lock()
+
+async def init_pg_pool():
+    """Cria o pool asyncpg compartilhado (chamado na inicialização da aplicação)"""
+    global pg_pool
+    async with _pg_pool_lock:
+        if pg_pool is None:
+            pg_pool = await asyncpg.create_pool(
+                user=PG_USER,
+                password=PG_PASSWORD,
+                database=PG_DATABASE,
+                host=PG_HOST,
+                port=int(PG_PORT),
+                min_size=PG_POOL_MIN_SIZE,
+                max_size=PG_POOL_MAX_SIZE,
+                statement_cache_size=PG_STATEMENT_CACHE_SIZE,
+                max_inactive_connection_lifetime=PG_CONN_MAX_INACTIVE,
+                connection_class=ConexaoPG,
+                init=_init_conexao,
+            )
+    return pg_pool
+
+async def close_pg_pool():
+    """Fecha o pool aguardando as conexões em uso serem devolvidas"""
+    global pg_pool
+    async with _pg_pool_lock:
+        pool, pg_pool = pg_pool, None
+    if pool is None:
+        return
+    try:
+        await asyncio.wait_for(pool.close(), PG_POOL_CLOSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool.terminate()
+
+async def get_pg_pool():
+    """Retorna o pool compartilhado (criando-o se a aplicação ainda não o iniciou)"""
+    if pg_pool is None:
+        return await init_pg_pool()
+    return pg_pool
+
+async def release_pg_connection(conn):
+    """Devolve a conexão ao pool, fechando-a se passou do tempo de vida máximo"""
+    try:
+        if time.monotonic() - conn._criada_em > PG_CONN_MAX_LIFETIME:
+            await conn.close()
+    except Exception:
+        pass  # Conexão já encerrada; o pool cria outra no próximo acquire
+    finally:
+        if pg_pool is not None:
+            await pg_pool.release(conn)
+
+# Conexão simples com PostgreSQL (devolver com release_pg_connection)
 async def get_pg_connection():
     try:
-        conn = await asyncpg.connect(
-            user=PG_USER,    
-            password=PG_PASSWORD,
-            database=PG_DATABASE,
-            host=PG_HOST,
-            port=int(PG_PORT)
-        )
-        return conn
+        pool = await get_pg_pool()
+        return await pool.acquire()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao conectar ao PostgreSQL: {str(e)}")
 
@@ -66,16 +139,10 @@ async def pg_connection_manager():
     """Context manager para gerenciar conexões PostgreSQL automaticamente"""
     conn = None
     try:
-        conn = await asyncpg.connect(
-            user=PG_USER,    
-            password=PG_PASSWORD,
-            database=PG_DATABASE,
-            host=PG_HOST,
-            port=int(PG_PORT)
-        )
+        conn = await (await get_pg_pool()).acquire()
         yield conn
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na operação PostgreSQL: {str(e)}")
     finally:
         if conn:
-            await conn.close()    
+            await release_pg_connection(conn)
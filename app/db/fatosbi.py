@@ -0,0 +1,449 @@
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
+from app.db.conexaopg import get_pg_pool, release_pg_connection, pg_connection_manager
+from app.db.conexaofb import firebird_async_connection_manager
+from app.db.snapshotbi import snapshots_bi, valores_filtro
+from app.utils.bulkhead import get_bulkhead
+
+load_dotenv()
+
+# Origem dos dados dos kpi_* e big_numbers: "firebird" (padrão) ou "postgres" (tbbi_fato_diario).
+# No modo postgres, empresas sem sincronização recente continuam consultando o Firebird.
+BI_FONTE_DADOS = os.getenv("BI_FONTE_DADOS", "firebird").lower()
+
+# Sincronização Firebird -> tbbi_fato_diario
+BI_SYNC_INTERVALO = float(os.getenv("BI_SYNC_INTERVALO", "300"))  # segundos entre as rodadas
+BI_SYNC_ANOS = int(os.getenv("BI_SYNC_ANOS", "3"))  # anos completos lidos na carga inicial, além do atual
+BI_SYNC_REPROCESSAR_DIAS = int(os.getenv("BI_SYNC_REPROCESSAR_DIAS", "7"))  # dias relidos antes da marca d'água
+BI_SYNC_RELEITURA = float(os.getenv("BI_SYNC_RELEITURA", "86400"))  # segundos entre as releituras da janela inteira
+BI_SYNC_LOTE = int(os.getenv("BI_SYNC_LOTE", "2000"))  # linhas por fetchmany/COPY
+BI_SYNC_MAX_ATRASO = float(os.getenv("BI_SYNC_MAX_ATRASO", "3600"))  # segundos; mais antiga volta ao Firebird
+
+# Chave (classe) das travas consultivas da sincronização: uma por empresa entre todos os workers
+TRAVA_SINCRONIZACAO = 18
+
+# Linhas lidas do Firebird antes da troca na tbbi_fato_diario (tabela temporária da sessão)
+TABELA_TEMPORARIA = "tmp_bi_fato_diario"
+
+ORIGEM_CONHECIMENTOS = "C"
+ORIGEM_FATURAS = "F"
+
+COLUNAS_FATOS = (
+    "codempresa", "origem", "data",
+    "codfilial", "filial", "codcliente", "cliente", "codcid", "cidade", "coduf", "regiao", "codpro", "produto",
+    "volume", "embarques", "faturados", "custos", "pedagios", "faturamento",
+)
+
+# Agregação diária lida do Firebird, nas colunas de COLUNAS_FATOS a partir de "data"
+CONSULTAS_SINCRONIZACAO = {
+    ORIGEM_CONHECIMENTOS: """
+        SELECT
+            dataemissao,
+            codfilial,
+            MAX(filial),
+            codcliente,
+            MAX(cliente),
+            codcid,
+            cidade,
+            coduf,
+            regiao,
+            codpro,
+            CAST(NULL AS VARCHAR(1)),
+            COALESCE(SUM(pesofrete_ton), 0),
+            COALESCE(SUM(embarque), 0),
+            COALESCE(SUM(faturado), 0),
+            COALESCE(SUM(vlrcusto), 0),
+            COALESCE(SUM(vlrpedagio), 0),
+            0
+        FROM
+            VWFRCTRC_BI
+        WHERE
+            dataemissao >= ?
+        GROUP BY
+            dataemissao, codfilial, codcliente, codcid, cidade, coduf, regiao, codpro
+    """,
+    ORIGEM_FATURAS: """
+        SELECT
+            datarecbto,
+            codfilial,
+            MAX(filial),
+            codcliente,
+            MAX(cliente),
+            codcid,
+            cidade,
+            coduf,
+            regiao,
+            codpro,
+            MAX(produto),
+            0,
+            0,
+            0,
+            0,
+            0,
+            COALESCE(SUM(vlrrecbto), 0)
+        FROM
+            VWFACTRC_BI
+        WHERE
+            datarecbto >= ?
+        GROUP BY
+            datarecbto, codfilial, codcliente, codcid, cidade, coduf, regiao, codpro
+    """,
+}
+
+MESES = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+         "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+
+
+def _registro(codempresa: int, origem: str, row) -> tuple:
+    data = row[0]
+    if isinstance(data, datetime):
+        data = data.date()
+    # Textos CHAR do Firebird vêm completados com brancos; no PostgreSQL eles contam na comparação
+    return (codempresa, origem, data) + tuple(v.rstrip() if isinstance(v, str) else v for v in row[1:])
+
+async def sincronizar_empresa(empresa) -> bool:
+    """
+    Atualiza os fatos diários da empresa a partir da marca d'água de cada origem,
+    relendo os últimos BI_SYNC_REPROCESSAR_DIAS (lançamentos atrasados) e, a cada
+    BI_SYNC_RELEITURA, a janela inteira (cancelamentos e correções mais antigas).
+    Retorna False se outro worker já está sincronizando a empresa.
+    """
+    codempresa = int(empresa["codempresa"])
+    pool = await get_pg_pool()
+    conn = await pool.acquire()
+    try:
+        # Trava de sessão: a leitura do Firebird acontece fora de transação no PostgreSQL
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", TRAVA_SINCRONIZACAO, codempresa):
+            return False
+        try:
+            await _sincronizar_origens(conn, empresa, codempresa)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1, $2)", TRAVA_SINCRONIZACAO, codempresa)
+        _fonte_empresas.pop(str(codempresa), None)
+        return True
+    finally:
+        await release_pg_connection(conn)
+
+async def _sincronizar_origens(conn, empresa, codempresa: int):
+    """
+    Lê cada origem do Firebird para a tabela temporária da sessão e só então troca o
+    período relido na tbbi_fato_diario, em uma transação curta
+    """
+    hoje = date.today()
+    marcas = {
+        row["origem"]: (row["sincronizado_ate"], row["reler"])
+        for row in await conn.fetch(
+            """
+            SELECT origem, sincronizado_ate,
+                   relido_em IS NULL OR relido_em < now() - make_interval(secs => $2) AS reler
+            FROM tbbi_sincronizacao WHERE codempresa = $1
+            """,
+            codempresa, BI_SYNC_RELEITURA,
+        )
+    }
+    await conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {TABELA_TEMPORARIA} (LIKE tbbi_fato_diario)")
+    colunas = ", ".join(COLUNAS_FATOS)
+
+    # Ocupa uma vaga do bulkhead da empresa, como as consultas do BI
+    bulkhead = get_bulkhead(codempresa, empresa["maxconsultasbd"], empresa["maxfilabd"])
+    async with bulkhead.reservar():
+        async with firebird_async_connection_manager(empresa["ipbd"], empresa["portabd"], empresa["caminhobd"]) as (con, cur):
+            for origem, query in CONSULTAS_SINCRONIZACAO.items():
+                marca, reler = marcas.get(origem, (None, True))
+                if marca and not reler:
+                    desde = marca - timedelta(days=BI_SYNC_REPROCESSAR_DIAS)
+                else:
+                    desde = date(hoje.year - BI_SYNC_ANOS, 1, 1)
+
+                await conn.execute(f"TRUNCATE {TABELA_TEMPORARIA}")
+                await cur.execute(query, (desde,))
+                linhas = 0
+                while True:
+                    rows = await cur.fetchmany(BI_SYNC_LOTE)
+                    if not rows:
+                        break
+                    await conn.copy_records_to_table(
+                        TABELA_TEMPORARIA,
+                        records=[_registro(codempresa, origem, row) for row in rows],
+                        columns=COLUNAS_FATOS,
+                    )
+                    linhas += len(rows)
+
+                # Sem diferença no período relido, a tabela de fatos e a versão dos dados ficam como estão
+                alterada = await conn.fetchval(
+                    f"""
+                    SELECT EXISTS (
+                        (SELECT {colunas} FROM tbbi_fato_diario WHERE codempresa = $1 AND origem = $2 AND data >= $3
+                         EXCEPT ALL SELECT {colunas} FROM {TABELA_TEMPORARIA})
+                        UNION ALL
+                        (SELECT {colunas} FROM {TABELA_TEMPORARIA}
+                         EXCEPT ALL SELECT {colunas} FROM tbbi_fato_diario WHERE codempresa = $1 AND origem = $2 AND data >= $3)
+                    )
+                    """,
+                    codempresa, origem, desde,
+                )
+
+                async with conn.transaction():
+                    if alterada:
+                        await conn.execute(
+                            "DELETE FROM tbbi_fato_diario WHERE codempresa = $1 AND origem = $2 AND data >= $3",
+                            codempresa, origem, desde,
+                        )
+                        await conn.execute(f"INSERT INTO tbbi_fato_diario ({colunas}) SELECT {colunas} FROM {TABELA_TEMPORARIA}")
+                    await conn.execute(
+                        """
+                        INSERT INTO tbbi_sincronizacao (codempresa, origem, sincronizado_ate, linhas, atualizado_em, relido_em, versao_dados)
+                        VALUES ($1, $2, $3, $4, now(), CASE WHEN $5 THEN now() END, CASE WHEN $6 THEN 1 ELSE 0 END)
+                        ON CONFLICT (codempresa, origem) DO UPDATE
+                        SET sincronizado_ate = EXCLUDED.sincronizado_ate,
+                            linhas = EXCLUDED.linhas,
+                            atualizado_em = EXCLUDED.atualizado_em,
+                            relido_em = COALESCE(EXCLUDED.relido_em, tbbi_sincronizacao.relido_em),
+                            versao_dados = tbbi_sincronizacao.versao_dados + EXCLUDED.versao_dados
+                        """,
+                        codempresa, origem, hoje, linhas, reler, alterada,
+                    )
+            await conn.execute(f"TRUNCATE {TABELA_TEMPORARIA}")
+
+
+class SincronizadorBI:
+    """Tarefa de fundo que sincroniza periodicamente as empresas com tbempresas.sincronizabi"""
+
+    def __init__(self, intervalo: float = BI_SYNC_INTERVALO):
+        self.intervalo = intervalo
+        self._tarefa = None
+        self._parar = asyncio.Event()
+
+        # Estatísticas
+        self.rodadas = 0
+        self.sincronizadas = 0
+        self.falhas = 0
+
+    async def start(self):
+        self._parar = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def stop(self):
+        self._parar.set()
+        if self._tarefa:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+
+    async def _executar(self):
+        while not self._parar.is_set():
+            try:
+                await self.sincronizar_todas()
+            except Exception as e:
+                print(f"Erro ao listar as empresas para sincronização do BI: {e}")
+
+            try:
+                await asyncio.wait_for(self._parar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sincronizar_todas(self):
+        async with pg_connection_manager() as conn:
+            empresas = await conn.fetch(
+                "SELECT codempresa, ipbd, portabd, caminhobd, maxconsultasbd, maxfilabd FROM tbempresas WHERE sincronizabi"
+            )
+        self.rodadas += 1
+        for empresa in empresas:
+            if self._parar.is_set():
+                break
+            try:
+                if await sincronizar_empresa(empresa):
+                    self.sincronizadas += 1
+            except Exception as e:
+                self.falhas += 1
+                print(f"Erro ao sincronizar o BI da empresa {empresa['codempresa']}: {e}")
+
+sincronizador_bi = SincronizadorBI()
+
+
+# Empresas aptas a responder pelo PostgreSQL: codempresa -> (expira_em, apta)
+_fonte_empresas = {}
+FONTE_CACHE_TTL = 30  # segundos
+
+async def usar_fatos_bi(codempresa) -> bool:
+    """True se o modo postgres está ativo e a empresa tem as duas origens sincronizadas recentemente"""
+    if BI_FONTE_DADOS != "postgres":
+        return False
+    chave = str(codempresa)
+    item = _fonte_empresas.get(chave)
+    if item and item[0] > time.monotonic():
+        return item[1]
+    async with pg_connection_manager() as conn:
+        sincronizadas = await conn.fetchval(
+            """
+            SELECT COUNT(*) FROM tbbi_sincronizacao
+            WHERE codempresa = $1 AND atualizado_em >= now() - make_interval(secs => $2)
+            """,
+            int(codempresa), BI_SYNC_MAX_ATRASO,
+        )
+    apta = sincronizadas >= len(CONSULTAS_SINCRONIZACAO)
+    _fonte_empresas[chave] = (time.monotonic() + FONTE_CACHE_TTL, apta)
+    return apta
+
+
+# Consultas sobre tbbi_fato_diario. Cada uma devolve as linhas no mesmo formato da
+# consulta Firebird equivalente do BIRouter, para que o tratamento do resultado seja o mesmo.
+
+# Expressão de cada filtro do FiltrosBI na tabela de fatos
+EXPRESSOES_FILTRO = {
+    "codfilial": "codfilial",
+    "codcliente": "codcliente",
+    "codcid": "codcid",
+    "regiao": "regiao",
+    "codpro": "codpro",
+    "ano": "EXTRACT(YEAR FROM data)::int",
+    "mes": "EXTRACT(MONTH FROM data)::int",
+    "dia": "EXTRACT(DAY FROM data)::int",
+}
+
+def _filtros(consulta, campos, params: list) -> str:
+    """Filtros `campo = ANY($n)` para os campos informados (os mesmos da consulta Firebird)"""
+    sql = ""
+    for campo in campos:
+        valores = valores_filtro(getattr(consulta, campo))
+        if not valores:
+            continue
+        params.append(valores)
+        sql += f" AND {EXPRESSOES_FILTRO[campo]} = ANY(${len(params)})"
+    return sql
+
+async def _consultar(query: str, params: list):
+    async with pg_connection_manager() as conn:
+        return await conn.fetch(query, *params)
+
+# Agrupamentos dos kpi por dimensão: (colunas do SELECT/GROUP BY, filtros aplicados, colunas no snapshot)
+DIMENSOES_KPI = {
+    "filial": (
+        "codfilial, filial",
+        ("codfilial", "codcliente", "codcid", "regiao", "codpro", "ano", "mes", "dia"),
+        ("codfilial", "filial"),
+    ),
+    "regiao": (
+        "regiao",
+        ("codfilial", "codcliente", "codcid", "regiao", "codpro", "ano", "mes", "dia"),
+        ("regiao",),
+    ),
+    "cidade": (
+        "codcid, cidade || '-' || coduf",
+        ("codfilial", "codcid", "regiao", "ano", "mes", "dia"),
+        ("codcid", "cidade_uf"),
+    ),
+}
+
+async def kpi_dimensao_fatos(codempresa, dimensao: str, consulta, data_inicio: date, data_fim: date):
+    """Linhas (dimensão..., volume, embarques, faturamento) ordenadas pelo faturamento"""
+    colunas, campos, colunas_snapshot = DIMENSOES_KPI[dimensao]
+    snapshot = snapshots_bi.obter(codempresa)
+    if snapshot is not None:
+        return snapshot.agrupar(snapshot.mascara(consulta, campos, data_inicio, data_fim), colunas_snapshot)
+
+    params = [int(codempresa), data_inicio, data_fim]
+    filtros = _filtros(consulta, campos, params)
+    query = f"""
+        SELECT
+            {colunas},
+            SUM(volume),
+            SUM(embarques),
+            SUM(faturamento)
+        FROM tbbi_fato_diario
+        WHERE codempresa = $1 AND data >= $2 AND data <= $3{filtros}
+        GROUP BY {colunas}
+        ORDER BY SUM(faturamento) DESC
+    """
+    return await _consultar(query, params)
+
+# Rankings de faturamento (só faturas): (colunas do SELECT/GROUP BY, colunas no snapshot)
+RANKINGS_FATURAMENTO = {
+    "cliente": ("codcliente, cliente", ("codcliente", "cliente")),
+    "produto": ("codpro, produto", ("codpro", "produto")),
+}
+CAMPOS_RANKING = ("codfilial", "codcliente", "regiao", "codpro")
+
+async def ranking_faturamento_fatos(codempresa, dimensao: str, consulta, data_inicio: date, data_fim: date):
+    """Linhas (código, nome, faturamento) ordenadas pelo faturamento"""
+    colunas, colunas_snapshot = RANKINGS_FATURAMENTO[dimensao]
+    snapshot = snapshots_bi.obter(codempresa)
+    if snapshot is not None:
+        mascara = snapshot.mascara(consulta, CAMPOS_RANKING, data_inicio, data_fim, somente_faturas=True)
+        return snapshot.agrupar(mascara, colunas_snapshot, medidas=("faturamento",))
+
+    params = [int(codempresa), ORIGEM_FATURAS, data_inicio, data_fim]
+    filtros = _filtros(consulta, CAMPOS_RANKING, params)
+    query = f"""
+        SELECT
+            {colunas},
+            SUM(faturamento)
+        FROM tbbi_fato_diario
+        WHERE codempresa = $1 AND origem = $2 AND data >= $3 AND data <= $4{filtros}
+        GROUP BY {colunas}
+        ORDER BY SUM(faturamento) DESC
+    """
+    return await _consultar(query, params)
+
+async def kpi_mes_ano_fatos(codempresa, consulta, inicio_janela: date):
+    """Linhas (ano, mes_numero, mes, volume, embarques, faturamento) desde o início da janela"""
+    params = [int(codempresa), inicio_janela]
+    filtros = _filtros(consulta, ("codfilial", "codcid", "regiao", "dia"), params)
+    query = f"""
+        SELECT
+            EXTRACT(YEAR FROM data)::int,
+            EXTRACT(MONTH FROM data)::int,
+            SUM(volume),
+            SUM(embarques),
+            SUM(faturamento)
+        FROM tbbi_fato_diario
+        WHERE codempresa = $1 AND data >= $2{filtros}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+    return [(row[0], row[1], MESES[row[1] - 1]) + tuple(row[2:]) for row in await _consultar(query, params)]
+
+async def kpi_dia_mes_fatos(codempresa, consulta, inicio_mes: date, fim_mes: date):
+    """Linhas (dia, volume, embarques, faturamento) do mês informado"""
+    params = [int(codempresa), inicio_mes, fim_mes]
+    filtros = _filtros(consulta, ("codfilial", "codcid", "regiao", "ano", "mes", "dia"), params)
+    query = f"""
+        SELECT
+            EXTRACT(DAY FROM data)::int,
+            SUM(volume),
+            SUM(embarques),
+            SUM(faturamento)
+        FROM tbbi_fato_diario
+        WHERE codempresa = $1 AND data >= $2 AND data <= $3{filtros}
+        GROUP BY 1
+        ORDER BY 1
+    """
+    return await _consultar(query, params)
+
+async def big_numbers_fatos(codempresa, consulta, periodos: list):
+    """
+    Linha única no formato da consulta Firebird de big_numbers: faturamento, custos,
+    pedágios, volumes, embarques e faturados do período atual e do de comparação.
+    """
+    params = [int(codempresa)] + list(periodos)
+    filtros = _filtros(consulta, ("codfilial", "codcliente", "codcid", "regiao", "codpro", "ano", "mes", "dia"), params)
+    medidas = ("faturamento", "custos", "pedagios", "volume", "embarques", "faturados")
+    colunas = ",\n            ".join(
+        f"SUM({medida}) FILTER (WHERE data >= $2 AND data <= $3),\n"
+        f"            SUM({medida}) FILTER (WHERE data >= $4 AND data <= $5)"
+        for medida in medidas
+    )
+    query = f"""
+        SELECT
+            {colunas}
+        FROM tbbi_fato_diario
+        WHERE codempresa = $1 AND ((data >= $2 AND data <= $3) OR (data >= $4 AND data <= $5)){filtros}
+    """
+    rows = await _consultar(query, params)
+    return rows[0] if rows else None
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import asyncpg
+from asyncpg.exceptions._base import DataError as ErroConversaoCliente
+from dotenv import load_dotenv
+from app.db.conexaopg import get_pg_pool, release_pg_connection
+
+load_dotenv()
+
+# Configurações da gravação em lote da auditoria
+AUDITORIA_FILA_MAX = int(os.getenv("AUDITORIA_FILA_MAX", "10000"))  # registros aguardando gravação
+AUDITORIA_LOTE_MAX = int(os.getenv("AUDITORIA_LOTE_MAX", "500"))  # registros por COPY
+AUDITORIA_INTERVALO_FLUSH = float(os.getenv("AUDITORIA_INTERVALO_FLUSH", "1"))  # segundos
+AUDITORIA_TIMEOUT_DESLIGAMENTO = float(os.getenv("AUDITORIA_TIMEOUT_DESLIGAMENTO", "10"))  # segundos
+AUDITORIA_ESPERA_REENVIO = float(os.getenv("AUDITORIA_ESPERA_REENVIO", "2"))  # segundos antes de regravar um lote
+
+TABELA_AUDITORIA = "tbauditoria"
+COLUNAS_AUDITORIA = (
+    "usuario",
+    "codempresa",
+    "ip_address",
+    "metodo",
+    "endpoint",
+    "params",
+    "body_request",
+    "body_response",
+    "status_code",
+    "user_agent",
+    "duracao_ms",
+    "bytes_resposta",
+    "hash_resposta",
+)
+# Colunas JSON são enviadas ao COPY já serializadas
+COLUNAS_JSON = {"params", "body_request", "body_response"}
+
+# Falhas causadas pelo conteúdo de algum registro (o lote é regravado um a um). As demais
+# (conexão, servidor indisponível) são tratadas como passageiras: o lote é regravado uma vez.
+ERROS_DE_DADOS = (
+    asyncpg.exceptions.DataError,
+    asyncpg.exceptions.IntegrityConstraintViolationError,
+    ErroConversaoCliente,
+    TypeError,
+    ValueError,
+)
+
+
+class AuditoriaWriter:
+    """Acumula os registros de auditoria em memória e grava em lotes (COPY) em segundo plano"""
+
+    def __init__(self, max_fila: int = AUDITORIA_FILA_MAX, lote_max: int = AUDITORIA_LOTE_MAX,
+                 intervalo: float = AUDITORIA_INTERVALO_FLUSH):
+        self.lote_max = max(lote_max, 1)
+        self.intervalo = intervalo
+        self._fila = asyncio.Queue(maxsize=max_fila)
+        self._tarefa = None
+        self._parar = asyncio.Event()
+
+        # Estatísticas
+        self.gravados = 0
+        self.descartados = 0
+        self.lotes = 0
+        self.falhas = 0
+        self.perdidos = 0  # registros que não puderam ser gravados
+
+    def registrar(self, registro: dict) -> bool:
+        """Enfileira o registro sem aguardar; com a fila cheia ele é descartado"""
+        try:
+            self._fila.put_nowait(registro)
+            return True
+        except asyncio.QueueFull:
+            self.descartados += 1
+            if self.descartados == 1 or self.descartados % 1000 == 0:
+                print(f"Fila de auditoria cheia: {self.descartados} registros descartados")
+            return False
+
+    async def start(self):
+        self._parar = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def stop(self, timeout: float = AUDITORIA_TIMEOUT_DESLIGAMENTO):
+        """Para a tarefa após gravar o que ainda estiver na fila"""
+        self._parar.set()
+        if self._tarefa:
+            try:
+                await asyncio.wait_for(self._tarefa, timeout)
+            except asyncio.TimeoutError:
+                print(f"Auditoria: desligamento com {self._fila.qsize()} registros não gravados")
+            self._tarefa = None
+
+    async def _executar(self):
+        while not (self._parar.is_set() and self._fila.empty()):
+            lote = await self._coletar_lote()
+            if lote:
+                await self._gravar(lote)
+
+    async def _coletar_lote(self) -> list:
+        """Junta registros até completar o lote ou passar o intervalo desde o primeiro"""
+        loop = asyncio.get_running_loop()
+        lote = []
+        limite = loop.time() + self.intervalo
+        while len(lote) < self.lote_max:
+            if not self._fila.empty():
+                lote.append(self._fila.get_nowait())
+                continue
+            if self._parar.is_set():
+                break
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _gravar(self, lote: list):
+        registros = [
+            tuple(
+                json.dumps(registro.get(coluna), ensure_ascii=False, default=str) if coluna in COLUNAS_JSON
+                else registro.get(coluna)
+                for coluna in COLUNAS_AUDITORIA
+            )
+            for registro in lote
+        ]
+        try:
+            await self._copiar(registros)
+        except ERROS_DE_DADOS as e:
+            print(f"Erro de dados no lote de auditoria ({len(registros)} registros), gravando um a um: {e}")
+            await self._gravar_um_a_um(registros)
+            return
+        except Exception as e:
+            # Falha passageira (ex.: queda de conexão): uma nova tentativa após a espera
+            print(f"Erro ao gravar lote de auditoria ({len(registros)} registros), nova tentativa: {e}")
+            try:
+                await asyncio.wait_for(self._parar.wait(), AUDITORIA_ESPERA_REENVIO)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._copiar(registros)
+            except ERROS_DE_DADOS:
+                await self._gravar_um_a_um(registros)
+                return
+            except Exception as e:
+                self._falhou(registros, e)
+                return
+        self.lotes += 1
+
+    async def _copiar(self, registros: list):
+        pool = await get_pg_pool()
+        conn = await pool.acquire()
+        try:
+            await conn.copy_records_to_table(TABELA_AUDITORIA, records=registros, columns=COLUNAS_AUDITORIA)
+        finally:
+            await release_pg_connection(conn)
+        self.gravados += len(registros)
+
+    async def _gravar_um_a_um(self, registros: list):
+        """Regrava o lote registro a registro; só os registros com erro de dados são perdidos"""
+        for indice, registro in enumerate(registros):
+            try:
+                await self._copiar([registro])
+            except ERROS_DE_DADOS as e:
+                self._falhou([registro], e)
+            except Exception as e:
+                # A conexão caiu no meio: o restante do lote é perdido
+                self._falhou(registros[indice:], e)
+                return
+        self.lotes += 1
+
+    def _falhou(self, registros: list, erro):
+        self.falhas += 1
+        self.perdidos += len(registros)
+        print(f"Erro ao gravar auditoria ({len(registros)} registros descartados): {erro}")
+
+    def stats(self) -> dict:
+        return {
+            "na_fila": self._fila.qsize(),
+            "gravados": self.gravados,
+            "descartados": self.descartados,
+            "lotes": self.lotes,
+            "falhas": self.falhas,
+            "perdidos": self.perdidos,
+        }
+
+auditoria_writer = AuditoriaWriter()
@@ -0,0 +1,4 @@
+-- Limites de consultas Firebird simultâneas por empresa no BI.
+-- Valores nulos usam os padrões BI_MAX_CONSULTAS / BI_MAX_FILA.
+ALTER TABLE tbempresas ADD COLUMN IF NOT EXISTS maxconsultasbd INTEGER;
+ALTER TABLE tbempresas ADD COLUMN IF NOT EXISTS maxfilabd INTEGER;
@@ -0,0 +1,17 @@
+-- Notifica os workers da API quando tbempresas é alterada fora da API,
+-- para que o cache de dados de conexão seja invalidado (canal tbempresas_alterada).
+CREATE OR REPLACE FUNCTION fn_notifica_tbempresas() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tbempresas_alterada', OLD.codempresa::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('tbempresas_alterada', NEW.codempresa::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tg_notifica_tbempresas ON tbempresas;
+CREATE TRIGGER tg_notifica_tbempresas
+    AFTER INSERT OR UPDATE OR DELETE ON tbempresas
+    FOR EACH ROW EXECUTE FUNCTION fn_notifica_tbempresas();
@@ -0,0 +1,5 @@
+-- Métricas da auditoria: o body completo não é mais gravado, apenas um prefixo limitado
+-- (AUDITORIA_CAPTURA_MAX), o tamanho e o hash da resposta e o tempo da requisição.
+ALTER TABLE tbauditoria ADD COLUMN IF NOT EXISTS duracao_ms DOUBLE PRECISION;
+ALTER TABLE tbauditoria ADD COLUMN IF NOT EXISTS bytes_resposta INTEGER;
+ALTER TABLE tbauditoria ADD COLUMN IF NOT EXISTS hash_resposta VARCHAR(64);
@@ -0,0 +1,43 @@
+-- Fatos diários do BI sincronizados do Firebird de cada empresa (app/db/fatosbi.py).
+-- Granularidade: (dia, codfilial, codcliente, codcid, regiao, codpro) por origem:
+--   'C' = conhecimentos (VWFRCTRC_BI, pela dataemissao)
+--   'F' = faturas recebidas (VWFACTRC_BI, pela datarecbto)
+-- Os nomes (filial, cliente, cidade, produto) acompanham os códigos para os agrupamentos.
+
+-- Empresas cujos dados de BI são sincronizados para o PostgreSQL
+ALTER TABLE tbempresas ADD COLUMN IF NOT EXISTS sincronizabi BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS tbbi_fato_diario (
+    codempresa  INTEGER NOT NULL,
+    origem      CHAR(1) NOT NULL,
+    data        DATE NOT NULL,
+    codfilial   INTEGER,
+    filial      TEXT,
+    codcliente  TEXT,
+    cliente     TEXT,
+    codcid      INTEGER,
+    cidade      TEXT,
+    coduf       TEXT,
+    regiao      TEXT,
+    codpro      INTEGER,
+    produto     TEXT,
+    volume      NUMERIC NOT NULL DEFAULT 0,
+    embarques   INTEGER NOT NULL DEFAULT 0,
+    faturados   INTEGER NOT NULL DEFAULT 0,
+    custos      NUMERIC NOT NULL DEFAULT 0,
+    pedagios    NUMERIC NOT NULL DEFAULT 0,
+    faturamento NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS ix_tbbi_fato_diario_data ON tbbi_fato_diario (codempresa, data);
+CREATE INDEX IF NOT EXISTS ix_tbbi_fato_diario_origem ON tbbi_fato_diario (codempresa, origem, data);
+
+-- Marca d'água da sincronização: dados completos até sincronizado_ate (inclusive)
+CREATE TABLE IF NOT EXISTS tbbi_sincronizacao (
+    codempresa       INTEGER NOT NULL,
+    origem           CHAR(1) NOT NULL,
+    sincronizado_ate DATE NOT NULL,
+    linhas           INTEGER NOT NULL DEFAULT 0,
+    atualizado_em    TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (codempresa, origem)
+);
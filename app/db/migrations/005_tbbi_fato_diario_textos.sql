@@ -0,0 +1,17 @@
+-- Remove os brancos à direita dos textos já sincronizados (CHAR do Firebird, ex.: regiao
+-- de VWTBCID_BI). A sincronização passou a gravá-los sem os brancos (app/db/fatosbi.py).
+UPDATE tbbi_fato_diario
+SET filial  = rtrim(filial),
+    cliente = rtrim(cliente),
+    cidade  = rtrim(cidade),
+    coduf   = rtrim(coduf),
+    regiao  = rtrim(regiao),
+    produto = rtrim(produto),
+    codcliente = rtrim(codcliente)
+WHERE filial  <> rtrim(filial)
+   OR cliente <> rtrim(cliente)
+   OR cidade  <> rtrim(cidade)
+   OR coduf   <> rtrim(coduf)
+   OR regiao  <> rtrim(regiao)
+   OR produto <> rtrim(produto)
+   OR codcliente <> rtrim(codcliente);
@@ -0,0 +1,4 @@
+-- Última releitura completa da janela sincronizada (BI_SYNC_RELEITURA em app/db/fatosbi.py):
+-- alterações anteriores a BI_SYNC_REPROCESSAR_DIAS, como um CTRC cancelado semanas depois,
+-- só chegam à tbbi_fato_diario nessas releituras.
+ALTER TABLE tbbi_sincronizacao ADD COLUMN IF NOT EXISTS relido_em TIMESTAMPTZ;
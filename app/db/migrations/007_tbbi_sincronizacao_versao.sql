@@ -0,0 +1,4 @@
+-- Versão dos dados de cada origem: incrementada só quando a sincronização altera linhas da
+-- tbbi_fato_diario. Os snapshots do BI (app/db/snapshotbi.py) recarregam quando a soma muda;
+-- atualizado_em continua mudando a cada rodada (sinal de atraso da sincronização).
+ALTER TABLE tbbi_sincronizacao ADD COLUMN IF NOT EXISTS versao_dados BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,9 @@
+-- Refresh tokens revogados (logout e rotação no /refresh): compartilhada por todos os workers
+-- e preservada entre reinícios. A linha só é necessária até o token expirar (expira_em);
+-- depois disso a própria assinatura já o recusa e app/auth/auth.py apaga a linha.
+CREATE TABLE IF NOT EXISTS tbrefresh_revogado (
+    jti VARCHAR(32) PRIMARY KEY,
+    expira_em TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_tbrefresh_revogado_expira_em ON tbrefresh_revogado (expira_em);
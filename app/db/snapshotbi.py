@@ -0,0 +1,443 @@
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from dotenv import load_dotenv
+from app.db.conexaopg import pg_connection_manager
+
+load_dotenv()
+
+# Cópia colunar em memória (NumPy) dos fatos diários de cada empresa ativa
+BI_SNAPSHOT_ATIVO = os.getenv("BI_SNAPSHOT_ATIVO", "1") not in ("0", "false", "False")
+BI_SNAPSHOT_INTERVALO = float(os.getenv("BI_SNAPSHOT_INTERVALO", "60"))  # segundos entre as verificações de versão
+BI_SNAPSHOT_INATIVIDADE = float(os.getenv("BI_SNAPSHOT_INATIVIDADE", "1800"))  # segundos sem uso até descartar
+BI_SNAPSHOT_MAX_LINHAS = int(os.getenv("BI_SNAPSHOT_MAX_LINHAS", "2000000"))  # acima disso a empresa fica no PostgreSQL
+# Diretório das cópias em disco (mapeadas em memória pelos workers); vazio = não persiste
+BI_SNAPSHOT_DIR = os.getenv("BI_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "bi_snapshots"))
+
+# Segundos que uma geração substituída continua em disco para os workers que ainda a estão abrindo
+BI_SNAPSHOT_RETENCAO = float(os.getenv("BI_SNAPSHOT_RETENCAO", "300"))
+
+# Versão do formato em disco; manifestos de outra versão são ignorados
+FORMATO_SNAPSHOT = 2
+MANIFESTO = "manifest.json"
+TRAVA = "salvar.lock"
+
+# Colunas de texto/código guardadas com codificação por dicionário
+DIMENSOES_SNAPSHOT = ("codfilial", "filial", "codcliente", "cliente", "codcid", "cidade_uf", "regiao", "codpro", "produto")
+MEDIDAS_SNAPSHOT = ("volume", "embarques", "faturamento")
+
+CONSULTA_SNAPSHOT = """
+    SELECT
+        data,
+        origem = 'F',
+        codfilial,
+        filial,
+        codcliente,
+        cliente,
+        codcid,
+        cidade || '-' || coduf,
+        regiao,
+        codpro,
+        produto,
+        volume::float8,
+        embarques::float8,
+        faturamento::float8
+    FROM tbbi_fato_diario
+    WHERE codempresa = $1
+"""
+
+# Versão dos dados da empresa: só avança quando a sincronização altera linhas da tbbi_fato_diario
+# (atualizado_em muda a cada rodada e continua sendo o sinal de atraso do usar_fatos_bi)
+CONSULTA_VERSAO = "SELECT COALESCE(SUM(versao_dados), 0)::bigint FROM tbbi_sincronizacao WHERE codempresa = $1"
+
+
+def valores_filtro(valor) -> list:
+    """
+    Valores de um filtro do FiltrosBI em lista, sem os brancos à direita dos textos: o Firebird
+    os ignora ao comparar (regiao vem de um CASE com literais CHAR), o PostgreSQL não
+    """
+    if valor is None:
+        return []
+    valores = valor if isinstance(valor, list) else [valor]
+    return [v.rstrip() if isinstance(v, str) else v for v in valores]
+
+
+class _Dimensao:
+    """Coluna codificada por dicionário: códigos int32 por linha + lista de valores distintos"""
+    __slots__ = ("codigos", "valores", "indice")
+
+    def __init__(self, codigos: np.ndarray, valores: list):
+        self.codigos = codigos
+        self.valores = valores
+        self.indice = {valor: codigo for codigo, valor in enumerate(valores)}
+
+    @classmethod
+    def codificar(cls, valores_linhas):
+        indice = {}
+        codigos = np.fromiter(
+            (indice.setdefault(valor, len(indice)) for valor in valores_linhas),
+            dtype=np.int32, count=len(valores_linhas),
+        )
+        return cls(codigos, list(indice))
+
+    def mascara(self, valores) -> np.ndarray:
+        codigos = [self.indice[valor] for valor in valores if valor in self.indice]
+        return np.isin(self.codigos, codigos)
+
+
+def _manifesto(diretorio: str) -> dict:
+    """Manifesto atual do diretório ({} se não houver um legível do formato atual)"""
+    try:
+        with open(os.path.join(diretorio, MANIFESTO), encoding="utf-8") as arquivo:
+            manifesto = json.load(arquivo)
+    except (OSError, ValueError):
+        return {}
+    return manifesto if manifesto.get("formato") == FORMATO_SNAPSHOT else {}
+
+def _remover_geracoes_antigas(diretorio: str, atual: str):
+    """
+    Remove as gerações substituídas (mtime = momento da troca) há mais de BI_SNAPSHOT_RETENCAO: um worker pode ter acabado
+    de ler o manifesto anterior e ainda estar abrindo os arquivos dele. Quem já mapeou continua
+    lendo as páginas (o Linux as mantém até o último munmap).
+    """
+    limite = time.time() - BI_SNAPSHOT_RETENCAO
+    for nome in os.listdir(diretorio):
+        pasta = os.path.join(diretorio, nome)
+        if nome == atual or not nome.startswith("g") or not os.path.isdir(pasta):
+            continue
+        try:
+            if os.path.getmtime(pasta) < limite:
+                shutil.rmtree(pasta, ignore_errors=True)
+        except OSError:
+            pass
+
+
+class SnapshotEmpresa:
+    """Fatos diários de uma empresa em colunas NumPy, com filtros e agrupamentos vetorizados"""
+
+    def __init__(self, versao, data: np.ndarray, fatura: np.ndarray, dimensoes: dict, medidas: dict, partes: dict):
+        self.versao = versao
+        self.linhas = len(data)
+        self.data = data
+        self.fatura = fatura
+        self.dimensoes = dimensoes
+        self.medidas = medidas
+        self.partes = partes  # ano, mês e dia já extraídos para os filtros de data
+
+    @classmethod
+    def de_linhas(cls, rows, versao):
+        """Monta as colunas a partir das linhas da CONSULTA_SNAPSHOT"""
+        colunas = list(zip(*rows)) if rows else [()] * (2 + len(DIMENSOES_SNAPSHOT) + len(MEDIDAS_SNAPSHOT))
+        data = np.array(colunas[0], dtype="datetime64[D]")
+        dimensoes = {
+            nome: _Dimensao.codificar(colunas[2 + i]) for i, nome in enumerate(DIMENSOES_SNAPSHOT)
+        }
+        inicio_medidas = 2 + len(DIMENSOES_SNAPSHOT)
+        medidas = {
+            nome: np.array(colunas[inicio_medidas + i], dtype=np.float64) for i, nome in enumerate(MEDIDAS_SNAPSHOT)
+        }
+        meses = data.astype("datetime64[M]")
+        partes = {
+            "ano": data.astype("datetime64[Y]").astype(np.int32) + 1970,
+            "mes": meses.astype(np.int32) % 12 + 1,
+            "dia": (data - meses).astype(np.int32) + 1,
+        }
+        return cls(versao, data, np.array(colunas[1], dtype=bool), dimensoes, medidas, partes)
+
+    def salvar(self, diretorio: str):
+        """
+        Grava as colunas em uma nova geração (.npy de largura fixa + dicionários em JSON)
+        e troca o manifesto de forma atômica; os workers que já mapearam a geração
+        anterior continuam lendo os seus arquivos. A gravação é serializada entre os
+        processos por uma trava no diretório, e uma versão já gravada não é gravada de novo.
+        """
+        os.makedirs(diretorio, exist_ok=True)
+        trava = os.open(os.path.join(diretorio, TRAVA), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            anterior = _manifesto(diretorio)
+            if anterior and anterior["versao"] == self.versao:
+                return
+            geracao = self._gravar_geracao(diretorio)
+            if anterior:
+                # A retenção da geração substituída conta a partir de agora
+                try:
+                    os.utime(os.path.join(diretorio, anterior["geracao"]))
+                except OSError:
+                    pass
+            _remover_geracoes_antigas(diretorio, geracao)
+        finally:
+            os.close(trava)
+
+    def _gravar_geracao(self, diretorio: str) -> str:
+        geracao = f"g{time.time_ns()}-{os.getpid()}"
+        pasta = os.path.join(diretorio, geracao)
+        os.makedirs(pasta)
+
+        try:
+            colunas = {"data": self.data, "fatura": self.fatura}
+            colunas.update({f"medida_{nome}": coluna for nome, coluna in self.medidas.items()})
+            colunas.update({f"parte_{nome}": coluna for nome, coluna in self.partes.items()})
+            colunas.update({f"dimensao_{nome}": dimensao.codigos for nome, dimensao in self.dimensoes.items()})
+            for nome, coluna in colunas.items():
+                np.save(os.path.join(pasta, f"{nome}.npy"), coluna, allow_pickle=False)
+            with open(os.path.join(pasta, "dicionarios.json"), "w", encoding="utf-8") as arquivo:
+                json.dump({nome: dimensao.valores for nome, dimensao in self.dimensoes.items()}, arquivo, ensure_ascii=False)
+
+            manifesto = {
+                "formato": FORMATO_SNAPSHOT,
+                "geracao": geracao,
+                "versao": self.versao,
+                "linhas": self.linhas,
+                "colunas": sorted(colunas),
+            }
+            temporario = os.path.join(diretorio, f"{MANIFESTO}.{geracao}")
+            with open(temporario, "w", encoding="utf-8") as arquivo:
+                json.dump(manifesto, arquivo)
+            os.replace(temporario, os.path.join(diretorio, MANIFESTO))
+        except Exception:
+            shutil.rmtree(pasta, ignore_errors=True)
+            raise
+        return geracao
+
+    @classmethod
+    def abrir(cls, diretorio: str):
+        """Mapeia (somente leitura) a geração indicada no manifesto, ou None se não houver uma válida"""
+        try:
+            with open(os.path.join(diretorio, MANIFESTO), encoding="utf-8") as arquivo:
+                manifesto = json.load(arquivo)
+            if manifesto.get("formato") != FORMATO_SNAPSHOT:
+                return None
+            pasta = os.path.join(diretorio, manifesto["geracao"])
+            colunas = {
+                nome: np.load(os.path.join(pasta, f"{nome}.npy"), mmap_mode="r", allow_pickle=False)
+                for nome in manifesto["colunas"]
+            }
+            with open(os.path.join(pasta, "dicionarios.json"), encoding="utf-8") as arquivo:
+                dicionarios = json.load(arquivo)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Snapshot do BI em {diretorio} ignorado: {e}")
+            return None
+
+        return cls(
+            manifesto["versao"],
+            colunas["data"],
+            colunas["fatura"],
+            {nome: _Dimensao(colunas[f"dimensao_{nome}"], dicionarios[nome]) for nome in DIMENSOES_SNAPSHOT},
+            {nome: colunas[f"medida_{nome}"] for nome in MEDIDAS_SNAPSHOT},
+            {nome: colunas[f"parte_{nome}"] for nome in ("ano", "mes", "dia")},
+        )
+
+    def mascara(self, consulta, campos, data_inicio, data_fim, somente_faturas: bool = False) -> np.ndarray:
+        """Linhas do período que atendem aos filtros do FiltrosBI nos campos informados"""
+        mascara = (self.data >= np.datetime64(data_inicio, "D")) & (self.data <= np.datetime64(data_fim, "D"))
+        if somente_faturas:
+            mascara &= self.fatura
+        for campo in campos:
+            valores = valores_filtro(getattr(consulta, campo))
+            if not valores:
+                continue
+            if campo in self.partes:
+                mascara &= np.isin(self.partes[campo], valores)
+            else:
+                mascara &= self.dimensoes[campo].mascara(valores)
+        return mascara
+
+    def agrupar(self, mascara: np.ndarray, colunas, medidas=MEDIDAS_SNAPSHOT) -> list:
+        """
+        Soma as medidas por combinação das colunas nas linhas da máscara. Linhas no formato
+        (colunas..., medidas...) em ordem decrescente da última medida.
+        """
+        linhas = np.flatnonzero(mascara)
+        if not linhas.size:
+            return []
+        dimensoes = [self.dimensoes[coluna] for coluna in colunas]
+
+        # Chave única do grupo combinando os códigos das colunas
+        chave = np.zeros(linhas.size, dtype=np.int64)
+        for dimensao in dimensoes:
+            chave = chave * len(dimensao.valores) + dimensao.codigos[linhas]
+        grupos, inverso = np.unique(chave, return_inverse=True)
+
+        somas = [
+            np.bincount(inverso, weights=self.medidas[medida][linhas], minlength=grupos.size)
+            for medida in medidas
+        ]
+        # Uma linha de cada grupo para recuperar os valores das colunas
+        exemplo = np.empty(grupos.size, dtype=np.int64)
+        exemplo[inverso] = linhas
+
+        ordem = np.argsort(-somas[-1], kind="stable")
+        return [
+            tuple(dimensao.valores[dimensao.codigos[exemplo[g]]] for dimensao in dimensoes)
+            + tuple(float(soma[g]) for soma in somas)
+            for g in ordem
+        ]
+
+
+async def carregar_snapshot(codempresa: int):
+    """Lê os fatos da empresa e a versão da sincronização na mesma transação"""
+    async with pg_connection_manager() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            versao = await conn.fetchval(CONSULTA_VERSAO, codempresa)
+            linhas = await conn.fetchval("SELECT COUNT(*) FROM tbbi_fato_diario WHERE codempresa = $1", codempresa)
+            if linhas > BI_SNAPSHOT_MAX_LINHAS:
+                print(f"Snapshot do BI da empresa {codempresa} não criado: {linhas} linhas")
+                return None
+            rows = await conn.fetch(CONSULTA_SNAPSHOT, codempresa)
+    # A conversão para colunas roda fora do event loop
+    return await asyncio.to_thread(SnapshotEmpresa.de_linhas, rows, versao)
+
+async def _versao_atual(codempresa: int):
+    async with pg_connection_manager() as conn:
+        return await conn.fetchval(CONSULTA_VERSAO, codempresa)
+
+
+class SnapshotsBI:
+    """
+    Snapshots das empresas em uso. O primeiro acesso agenda a carga e é atendido pelo
+    PostgreSQL; uma tarefa de fundo recarrega os snapshots quando a sincronização
+    avança e descarta os das empresas sem uso. Com BI_SNAPSHOT_DIR, cada carga é gravada
+    em disco e os demais workers (ou o próximo processo) só mapeiam os arquivos.
+    """
+
+    def __init__(
+        self,
+        intervalo: float = BI_SNAPSHOT_INTERVALO,
+        inatividade: float = BI_SNAPSHOT_INATIVIDADE,
+        diretorio: str = BI_SNAPSHOT_DIR,
+    ):
+        self.intervalo = intervalo
+        self.inatividade = inatividade
+        self.diretorio = diretorio
+        self._snapshots = {}  # codempresa -> SnapshotEmpresa
+        self._ultimo_uso = {}  # codempresa -> monotonic
+        self._carregando = {}  # codempresa -> Task da carga
+        self._tarefa = None
+        self._parar = asyncio.Event()
+
+        # Estatísticas
+        self.cargas = 0
+        self.mapeados = 0
+        self.falhas = 0
+
+    def obter(self, codempresa):
+        """Snapshot pronto da empresa, ou None (agendando a carga) se ainda não existe"""
+        if not BI_SNAPSHOT_ATIVO:
+            return None
+        chave = str(codempresa)
+        self._ultimo_uso[chave] = time.monotonic()
+        snapshot = self._snapshots.get(chave)
+        if snapshot is None:
+            self._agendar_carga(chave)
+        return snapshot
+
+    def _agendar_carga(self, chave):
+        if chave in self._carregando:
+            return
+        tarefa = asyncio.ensure_future(self._carregar(chave))
+        self._carregando[chave] = tarefa
+        tarefa.add_done_callback(lambda _: self._carregando.pop(chave, None))
+
+    async def _carregar(self, chave):
+        try:
+            snapshot = await self._abrir_do_disco(chave)
+            if snapshot is None:
+                snapshot = await carregar_snapshot(int(chave))
+                if snapshot is None:
+                    return
+                self.cargas += 1
+                snapshot = await self._gravar_no_disco(chave, snapshot)
+            self._snapshots[chave] = snapshot
+        except Exception as e:
+            self.falhas += 1
+            print(f"Erro ao carregar o snapshot do BI da empresa {chave}: {e}")
+
+    def _diretorio(self, chave):
+        return os.path.join(self.diretorio, chave) if self.diretorio else None
+
+    async def _abrir_do_disco(self, chave):
+        """Cópia em disco gravada por este ou outro worker, se estiver na versão atual da sincronização"""
+        diretorio = self._diretorio(chave)
+        if diretorio is None or not os.path.exists(os.path.join(diretorio, MANIFESTO)):
+            return None
+        snapshot = await asyncio.to_thread(SnapshotEmpresa.abrir, diretorio)
+        if snapshot is None or snapshot.versao != await _versao_atual(int(chave)):
+            return None
+        self.mapeados += 1
+        return snapshot
+
+    async def _gravar_no_disco(self, chave, snapshot):
+        """Persiste o snapshot e passa a usar a versão mapeada (páginas compartilhadas entre os workers)"""
+        diretorio = self._diretorio(chave)
+        if diretorio is None:
+            return snapshot
+        try:
+            await asyncio.to_thread(snapshot.salvar, diretorio)
+            mapeado = await asyncio.to_thread(SnapshotEmpresa.abrir, diretorio)
+        except Exception as e:
+            print(f"Erro ao gravar o snapshot do BI da empresa {chave}: {e}")
+            return snapshot
+        return mapeado if mapeado is not None and mapeado.versao == snapshot.versao else snapshot
+
+    def descartar(self, codempresa=None):
+        """Remove o snapshot da empresa (ou todos, se não informada)"""
+        if codempresa is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(str(codempresa), None)
+
+    async def start(self):
+        self._parar = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def stop(self):
+        self._parar.set()
+        if self._tarefa:
+            await self._tarefa
+            self._tarefa = None
+        for tarefa in list(self._carregando.values()):
+            tarefa.cancel()
+
+    async def _executar(self):
+        while not self._parar.is_set():
+            try:
+                await asyncio.wait_for(self._parar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            if self._parar.is_set():
+                break
+            await self.atualizar()
+
+    async def atualizar(self):
+        """Descarta os snapshots sem uso e recarrega os que ficaram atrás da sincronização"""
+        agora = time.monotonic()
+        for chave in list(self._snapshots):
+            if agora - self._ultimo_uso.get(chave, 0) > self.inatividade:
+                del self._snapshots[chave]
+                self._ultimo_uso.pop(chave, None)
+                continue
+            try:
+                versao = await _versao_atual(int(chave))
+            except Exception as e:
+                print(f"Erro ao verificar a versão do snapshot do BI da empresa {chave}: {e}")
+                continue
+            if versao != self._snapshots[chave].versao:
+                self._agendar_carga(chave)
+
+    def stats(self) -> dict:
+        return {
+            "empresas": len(self._snapshots),
+            "linhas": sum(snapshot.linhas for snapshot in self._snapshots.values()),
+            "carregando": len(self._carregando),
+            "cargas": self.cargas,
+            "mapeados": self.mapeados,
+            "falhas": self.falhas,
+        }
+
+snapshots_bi = SnapshotsBI()
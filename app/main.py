@@ -1,10 +1,40 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routers import usuarioRouter
 from app.routers import empresaRouter
 from app.routers import loginRouter
 from app.middleware.auditoria import AuditoriaMiddleware
 from app.routers import BIRouter
+from app.db.cacheempresas import empresas_listener
+from app.db.filaauditoria import auditoria_writer
+from app.db.fatosbi import sincronizador_bi
+from app.db.snapshotbi import snapshots_bi
+from app.db.conexaofb import close_firebird_pools, shutdown_firebird_executor
+from app.db.conexaopg import init_pg_pool, close_pg_pool, engine
+from app.auth.senhas import shutdown_senhas_executor
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Inicialização: pool PostgreSQL, escuta de alterações de tbempresas, gravação da auditoria
+    # e sincronização dos fatos diários do BI (com a atualização dos snapshots em memória)
+    await init_pg_pool()
+    await empresas_listener.start()
+    await auditoria_writer.start()
+    await sincronizador_bi.start()
+    await snapshots_bi.start()
+    yield
+    # Desligamento: grava a auditoria pendente e drena as conexões antes de encerrar o worker
+    await snapshots_bi.stop()
+    await sincronizador_bi.stop()
+    await empresas_listener.stop()
+    await auditoria_writer.stop()
+    await close_pg_pool()
+    await engine.dispose()
+    close_firebird_pools()
+    # Aguarda as chamadas Firebird em andamento (as conexões delas são fechadas ao serem devolvidas)
+    shutdown_firebird_executor()
+    shutdown_senhas_executor()
 
 app = FastAPI(
     docs_url="/docs",
@@ -14,6 +44,7 @@ app = FastAPI(
     description="API para integração do BI-FreteFácil Softcenter",
     version="1.0.0",
     root_path="/sftlogin",  # Define o prefixo base para toda a API
+    lifespan=lifespan,
 )
 
 
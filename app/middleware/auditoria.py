@@ -1,112 +1,169 @@
-from json import loads, dumps
-from app.db.conexaopg import get_db
+import hashlib
 import json
-from app.models.auditModel import LoginAudit
-from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request, Response, Depends
+import os
+import time
+from urllib.parse import parse_qsl
+from starlette.datastructures import Headers
 from jose import jwt, JWTError, ExpiredSignatureError
+from dotenv import load_dotenv
 from app.auth.auth import SECRET_KEY, ALGORITHM
-from starlette.responses import JSONResponse, StreamingResponse
-from typing import Any
+from app.db.filaauditoria import auditoria_writer
+
+load_dotenv()
+
+# Quantidade máxima de bytes do body guardada na auditoria (o restante só entra no hash)
+AUDITORIA_CAPTURA_MAX = int(os.getenv("AUDITORIA_CAPTURA_MAX", "4096"))
+
+# Política de captura dos bodies por endpoint: (prefixo do caminho, requisição, resposta).
+# Vale a primeira regra cujo prefixo casar; sem regra, os dois bodies são capturados.
+POLITICAS_CAPTURA = [
+    ("/login", False, True),  # O body da requisição tem a senha; a resposta traz o token emitido
+    ("/refresh", False, True),  # O body da requisição tem o refresh token
+    ("/logout", False, True),
+    ("/bi/tabela_", True, False),  # Tabelas grandes (e em streaming): só tamanho e hash
+]
+
+def politica_captura(endpoint: str):
+    """Retorna (capturar_requisicao, capturar_resposta) para o endpoint"""
+    for prefixo, requisicao, resposta in POLITICAS_CAPTURA:
+        if endpoint.startswith(prefixo):
+            return requisicao, resposta
+    return True, True
+
+
+class _CapturaBody:
+    """Acompanha um body em partes: prefixo limitado, total de bytes e hash SHA-256"""
+
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.prefixo = bytearray()
+        self.total = 0
+        self._hash = hashlib.sha256()
+
+    def adicionar(self, parte: bytes):
+        if not parte:
+            return
+        self.total += len(parte)
+        self._hash.update(parte)
+        falta = self.limite - len(self.prefixo)
+        if falta > 0:
+            self.prefixo += parte[:falta]
+
+    @property
+    def hash(self) -> str:
+        return self._hash.hexdigest()
+
+    def conteudo(self, somente_json: bool = False):
+        """Body guardado: JSON se veio completo e válido; senão o prefixo em texto"""
+        if not self.prefixo:
+            return None
+        if len(self.prefixo) == self.total:
+            try:
+                return json.loads(self.prefixo)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        if somente_json:
+            return None
+        return bytes(self.prefixo).decode("utf-8", errors="replace")
+
+
+def _dados_token(token: str):
+    """Retorna (usuario, codempresa) do token JWT, aceitando token expirado (usado quando o
+    endpoint não passou pela dependência de autenticação ou o token foi recusado)"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+        print("Token expirado")
+    except JWTError as e:
+        print(f"Erro ao decodificar o token: {e}")
+        return None, None
+    return payload.get("nomeusuario"), payload.get("empresa")
+
+
+class AuditoriaMiddleware:
+    """
+    Middleware ASGI de auditoria: repassa requisição e resposta sem acumulá-las,
+    guardando apenas um prefixo limitado dos bodies, o tamanho e o hash da resposta
+    e o tempo total da requisição.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        endpoint = scope["path"]
+        capturar_requisicao, capturar_resposta = politica_captura(endpoint)
+        body_requisicao = _CapturaBody(AUDITORIA_CAPTURA_MAX if capturar_requisicao else 0)
+        body_resposta = _CapturaBody(AUDITORIA_CAPTURA_MAX if capturar_resposta else 0)
+        status_code = 500  # Se a aplicação falhar antes de responder
+
+        # request.state fica em scope["state"]: a dependência de autenticação guarda as claims ali
+        scope.setdefault("state", {})
+
+        async def receive_auditado():
+            message = await receive()
+            if message["type"] == "http.request":
+                body_requisicao.adicionar(message.get("body", b""))
+            return message
+
+        async def send_auditado(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_resposta.adicionar(message.get("body", b""))
+            await send(message)
 
-class AuditoriaMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Obtém a sessão do banco
-        db: AsyncSession = await get_db().__anext__()
+        try:
+            await self.app(scope, receive_auditado, send_auditado)
+        finally:
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            self._registrar(scope, endpoint, status_code, duracao_ms, body_requisicao, body_resposta)
 
-        # Captura informações da requisição
-        ip_address = request.client.host  # Captura o IP da Requisição
-        user_agent = request.headers.get("User-Agent") # Obtém o User-Agent para saber o tipo do cliente
+    def _registrar(self, scope, endpoint, status_code, duracao_ms, body_requisicao, body_resposta):
+        headers = Headers(scope=scope)
+        client = scope.get("client")
 
-        token = request.headers.get("Authorization")
         usuario = None
         codEmpresa = None
-
-        if token and token.startswith("Bearer "):
-            try:
-                token = token.split(" ")[1]
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                usuario = payload.get("nomeusuario")
-                codEmpresa = payload.get("empresa")
-            except ExpiredSignatureError:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
-                usuario = payload.get("nomeusuario")
-                codEmpresa = payload.get("empresa")
-                print("Token expirado")    
-            except JWTError as e:
-                print(f"Erro ao decodificar o token: {e}")
-
-        metodo = request.method
-        endpoint = str(request.url.path)
-        params = dict(request.query_params)  # Query params da URL
-
-        # Captura o body da requisição (caso exista)
-        try:
-            body_request = await request.json()
-        except Exception:
-            body_request = None  # Se não tiver body, define como None
-
-        # Chama a API e captura a resposta
-        response = await call_next(request)
-        status_code = response.status_code
-
-        # Captura o body da resposta corretamente
-        response_body = b""
-        async for chunk in response.body_iterator:
-            response_body += chunk
-
-        body_response = response_body.decode("utf-8")
-
-        # Remove quebras de linha indesejadas e espaços extras
-        body_response = body_response.replace("\\n", "").strip()
-
-        # Se for JSON, convertemos para um dicionário
-        try:
-            body_response = json.loads(body_response)  # Se for JSON válido, converte para dict
-        except (json.JSONDecodeError, TypeError):
-            pass  # Se já for dict ou não for JSON, mantém como está
-
-        # Captura o token do corpo da resposta se o endpoint for /login
-        if endpoint == "/login":
-            try:
-                if isinstance(body_response, dict):  # Se for dict, pega o token diretamente
-                    tokenRet = body_response.get("access_token")
-                    if tokenRet:
-                        payload = jwt.decode(tokenRet, SECRET_KEY, algorithms=[ALGORITHM])
-                        usuario = payload.get("nomeusuario")
-                        codEmpresa = payload.get("empresa")
-            except JWTError as e:
-                print(f"Erro ao decodificar o token retornado: {e}")
-
-        # Cria o log de auditoria
-        log = LoginAudit(
-            usuario=usuario,
-            codempresa=codEmpresa,
-            metodo=metodo,
-            endpoint=endpoint,
-            params=params,
-            body_request=body_request,
-            body_response=body_response, 
-            status_code=status_code,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
-
-        # Adiciona o log ao banco de dados
-        db.add(log)
-        await db.commit()
-
-        # Ajuste no retorno da API (StreamingResponse)
-        # Se response_body for um dicionário, convertemos para string JSON
-        if isinstance(response_body, dict):  
-            response_body = json.dumps(response_body, ensure_ascii=False)
-
-         # Retorna a resposta original
-        return StreamingResponse(
-            iter([response_body]),  
-            status_code=status_code,
-            headers=dict(response.headers),
-            media_type=response.media_type
-        )
-       
\ No newline at end of file
+        payload = scope["state"].get("token_payload")
+        token = headers.get("Authorization")
+        if payload is not None:
+            # Token já verificado na requisição pela dependência get_token_payload
+            usuario, codEmpresa = payload.get("nomeusuario"), payload.get("empresa")
+        elif token and token.startswith("Bearer "):
+            usuario, codEmpresa = _dados_token(token.split(" ")[1])
+
+        body_response = body_resposta.conteudo()
+
+        # Captura o token do corpo da resposta se o endpoint for /login ou /refresh
+        if endpoint in ("/login", "/refresh") and isinstance(body_response, dict):
+            tokenRet = body_response.get("access_token")
+            if tokenRet:
+                usuario, codEmpresa = _dados_token(tokenRet)
+            # O refresh token vale por dias: não fica gravado na auditoria
+            if body_response.get("refresh_token"):
+                body_response["refresh_token"] = None
+
+        # Enfileira o log de auditoria; a gravação é feita em lote em segundo plano
+        auditoria_writer.registrar({
+            "usuario": usuario,
+            "codempresa": codEmpresa,
+            "metodo": scope["method"],
+            "endpoint": endpoint,
+            "params": dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)),
+            "body_request": body_requisicao.conteudo(somente_json=True),
+            "body_response": body_response,
+            "status_code": status_code,
+            "ip_address": client[0] if client else None,
+            "user_agent": headers.get("User-Agent") or "",  # Coluna NOT NULL: um registro nulo derrubaria o lote inteiro
+            "duracao_ms": duracao_ms,
+            "bytes_resposta": body_resposta.total,
+            "hash_resposta": body_resposta.hash,
+        })
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, JSON, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -17,4 +17,7 @@ class LoginAudit(Base):
     body_request = Column(JSON, nullable=True)  # Corpo da requisição
     body_response = Column(JSON, nullable=True)  # Resposta da API
     status_code = Column(Integer, nullable=False)  # Status HTTP
-    user_agent =Column(String, nullable=False) #Aplicação de onde esta sendo enviado a Requisição
\ No newline at end of file
+    user_agent =Column(String, nullable=False) #Aplicação de onde esta sendo enviado a Requisição
+    duracao_ms = Column(Float, nullable=True)  # Tempo total da requisição
+    bytes_resposta = Column(Integer, nullable=True)  # Tamanho do body da resposta
+    hash_resposta = Column(String, nullable=True)  # SHA-256 do body da resposta
\ No newline at end of file
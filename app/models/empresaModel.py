@@ -15,6 +15,8 @@ class tbempresa(Base):
     ipbd = Column(String)
     caminhobd = Column(String)
     ativa = Column(String)
+    maxconsultasbd = Column(Integer)  # Consultas Firebird simultâneas no BI (nulo = padrão)
+    maxfilabd = Column(Integer)  # Consultas aguardando na fila do BI (nulo = padrão)
     #datadesativacao = Column(Date)
     #datacadastro = Column(Date)
     
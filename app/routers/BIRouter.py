@@ -1,18 +1,37 @@
 from urllib.request import Request
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
 from typing import List
-from fastapi.security import OAuth2PasswordBearer 
 from app.db.conexaopg import pg_connection_manager
-from app.db.conexaofb import firebird_connection_manager
-from app.auth.auth import decode_access_token
+from app.db.cacheempresas import get_dados_empresa
+from app.db.conexaofb import firebird_async_connection_manager, get_firebird_pool
+from app.utils.bulkhead import get_bulkhead, get_bulkhead_stats
+from app.utils.streaming import formato_streaming, resposta_streaming
+from app.utils.cachebi import cache_bi, cache_bi_respostas, chave_filtros
+from app.utils.filtrosbi import (
+    compilar_filtros,
+    COLUNAS_FACTRC,
+    COLUNAS_FRCTRC,
+    COLUNAS_CRTIT,
+    COLUNAS_CPTIT,
+)
+from app.db.fatosbi import (
+    usar_fatos_bi,
+    kpi_dimensao_fatos,
+    ranking_faturamento_fatos,
+    kpi_mes_ano_fatos,
+    kpi_dia_mes_fatos,
+    big_numbers_fatos,
+)
+from app.utils.mesesfechados import meses_fechados_kpi, corte_meses_fechados, mes_da_linha
+from app.utils.keyset import limite_pagina, paginar, ordem_keyset, agrupamento, fatiar_pagina, HEADER_PROXIMO_CURSOR
+from contextlib import asynccontextmanager, AsyncExitStack
+from app.auth.auth import get_token_payload
 from app.schemas.BIschemas import *
 
 router = APIRouter()
 
-# Recurso para autenticação com token (OAuth2)
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
 # Função helper para normalizar filtros (converter valor único em lista)
 def normalize_filter(value):
     if value is None:
@@ -21,238 +40,284 @@ def normalize_filter(value):
         return value
     return [value]
 
-# Função para obter os dados de conexão do Firebird
+# Função para obter os dados de conexão do Firebird (mantidos em cache por empresa)
 async def get_firebird_connection_data(idempresa: int):
+    return await get_dados_empresa(idempresa, _carregar_firebird_connection_data)
+
+async def _carregar_firebird_connection_data(idempresa: int):
     async with pg_connection_manager() as conn:
         # Recupera as informações de conexão do Firebird
         row = await conn.fetchrow(
-            "select t.ipbd, t.portabd, t.caminhobd from tbempresas t where t.codempresa = $1", int(idempresa)
+            "select t.ipbd, t.portabd, t.caminhobd, t.maxconsultasbd, t.maxfilabd from tbempresas t where t.codempresa = $1", int(idempresa)
         )
         if not row:
             raise HTTPException(status_code=404, detail="Configuração de conexão não encontrada")
         return dict(row)
 
-@router.post("/bi/big_numbers", tags=["BI"], response_model=List[BigNumbers], status_code=status.HTTP_200_OK)
-async def get_big_numbers(
-    request: Request,
-    consulta: FiltrosBI,
-    token: str = Depends(oauth2_scheme)
+# Calcula o período de comparação dos big numbers a partir do período consultado
+def calcular_periodo_comparacao(data_inicio: date, data_fim: date, comparacao: str = None):
+    if comparacao == "periodo_anterior":
+        dias = (data_fim - data_inicio).days + 1
+        return data_inicio - timedelta(days=dias), data_fim - timedelta(days=dias)
+    if comparacao == "mes_anterior":
+        return data_inicio - relativedelta(months=1), data_fim - relativedelta(months=1)
+    # Padrão: mesmo período do ano anterior
+    return data_inicio - timedelta(days=365), data_fim - timedelta(days=365)
+
+# Primeiro e último dia do mês atual
+def periodo_mes_atual():
+    inicio = date.today().replace(day=1)
+    return inicio, inicio + relativedelta(months=1) - timedelta(days=1)
+
+# Limites [início, fim) do mês atual, comparados direto com as colunas de data das views
+# (ano_x/mes_numero são colunas calculadas e obrigam o Firebird a ler a view inteira)
+def limites_mes_atual():
+    inicio = date.today().replace(day=1)
+    return inicio, inicio + relativedelta(months=1)
+
+# Linhas (data, valores...) agrupadas por data no Firebird -> (dia, somas...) na ordem dos dias
+def somar_por_dia(rows):
+    dias = {}
+    for data, *valores in rows:
+        soma = dias.setdefault(data.day, [0] * len(valores))
+        for i, valor in enumerate(valores):
+            soma[i] += valor or 0
+    return [(dia, *dias[dia]) for dia in sorted(dias)]
+
+# Context manager da conexão Firebird da empresa, limitado pelo bulkhead da empresa
+@asynccontextmanager
+async def firebird_empresa_connection_manager(idempresa):
+    conn_data = await get_firebird_connection_data(idempresa)
+    bulkhead = get_bulkhead(idempresa, conn_data.get('maxconsultasbd'), conn_data.get('maxfilabd'))
+
+    async with bulkhead.reservar():
+        async with firebird_async_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
+            yield con, cur
+
+# Executa a consulta na conexão da empresa e devolve as linhas em streaming (NDJSON/CSV),
+# lendo o cursor em lotes; a conexão e a vaga do bulkhead ficam reservadas até o fim do envio.
+# Com `pagina` = (limite, endpoint, chaves), lê só a página e envia o cursor da próxima no header
+async def stream_consulta_empresa(idempresa, query, params, linha, modelo, formato, pagina=None):
+    pilha = AsyncExitStack()
+    con, cur = await pilha.enter_async_context(firebird_empresa_connection_manager(idempresa))
+    linhas = None
+    headers = None
+    try:
+        await cur.execute(query, tuple(params))
+        if pagina:
+            limite, endpoint, chaves = pagina
+            linhas, proximo = fatiar_pagina(await cur.fetchmany(limite + 1), limite, endpoint, chaves)
+            if proximo:
+                headers = {HEADER_PROXIMO_CURSOR: proximo}
+    except BaseException as e:
+        if not await pilha.__aexit__(type(e), e, e.__traceback__):
+            raise
+
+    # Mesma serialização da resposta JSON (validada pelo response_model)
+    def converter(row):
+        return modelo.model_validate(linha(row)).model_dump(mode="json")
+
+    return resposta_streaming(pilha, cur, converter, formato, list(modelo.model_fields),
+                              linhas=linhas, headers=headers)
+
+@router.get("/bi/monitor", tags=["BI"], response_model=MonitorBI, status_code=status.HTTP_200_OK)
+async def get_monitor(
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
-    Consulta big numbers usando POST com schema de entrada.
-    Permite consultas mais complexas no futuro.
+        Consulta a fila de consultas e o pool de conexões Firebird da empresa.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
-    
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        params = [data_inicio, data_fim]
 
-        # Consulta do ano anterior
-        data_fim_ano_anterior = (consulta.data_fim - timedelta(days=365)) if consulta.data_fim else (date.today() - timedelta(days=365))
-        data_inicio_ano_anterior = (consulta.data_inicio - timedelta(days=365)) if consulta.data_inicio else (data_fim_ano_anterior - timedelta(days=30))
-
-        params_ano_anterior = [data_inicio_ano_anterior, data_fim_ano_anterior]
-
-
-        query_factrc = """
-            SELECT
-	            SUM(vlrrecbto)
-            FROM
-	            vwfactrc_bi
-            WHERE
-                datarecbto >= ?
-                AND datarecbto <= ?
-        """
-
-
-        query_frctrc = """
-            SELECT
-                SUM(vlrcusto),
-                SUM(vlrpedagio),
-                SUM(pesofrete_ton),
-                SUM(embarque),
-                SUM(faturado)
-            FROM
-                vwfrctrc_bi
-            WHERE
-                dataemissao >= ?
-                AND dataemissao <= ?
-        """
-
-        # Normalizar filtros e aplicar
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-
-        # Filtros por código (prioridade)
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            query_factrc += f" AND codfilial IN ({placeholders_filial})"
-            query_frctrc += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-            params_ano_anterior.extend(codfilial)
-
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            query_factrc += f" AND codcliente IN ({placeholders_cliente})"
-            query_frctrc += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-            params_ano_anterior.extend(codcliente)
-
-
-        # Filtro por cidade
-        codcid = normalize_filter(consulta.codcid)
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            query_factrc += f" AND codcid IN ({placeholders_codcid})"
-            query_frctrc += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-            params_ano_anterior.extend(codcid)
-
-        regiao = normalize_filter(consulta.regiao)
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            query_factrc += f" AND regiao IN ({placeholders_regiao})"
-            query_frctrc += f" AND regiao IN ({placeholders_regiao})"
-            params.extend(regiao)
-            params_ano_anterior.extend(regiao)
-
-        codpro = normalize_filter(consulta.codpro)
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            query_factrc += f" AND codpro IN ({placeholders_codpro})"
-            query_frctrc += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-            params_ano_anterior.extend(codpro)
-
-        ano = normalize_filter(consulta.ano)
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            query_factrc += f" AND ano_recbto IN ({placeholders_ano})"
-            query_frctrc += f" AND ano_emissao IN ({placeholders_ano})"
-            params.extend(ano)
-            params_ano_anterior.extend(ano)
-
-        mes = normalize_filter(consulta.mes)
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            query_factrc += f" AND mes_numero IN ({placeholders_mes})"
-            query_frctrc += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
-            params_ano_anterior.extend(mes)
-
-        dia = normalize_filter(consulta.dia)
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            query_factrc += f" AND dia_recbto IN ({placeholders_dia})"
-            query_frctrc += f" AND dia_emissao IN ({placeholders_dia})"
-            params.extend(dia)
-            params_ano_anterior.extend(dia)
-
-        cur.execute(query_factrc, tuple(params))
-        resultado_factrc = cur.fetchall()
-        faturamento = float(resultado_factrc[0][0]) if resultado_factrc and resultado_factrc[0][0] is not None else 0.0
-
-        cur.execute(query_factrc, tuple(params_ano_anterior))
-        resultado_factrc_ano_anterior = cur.fetchall()
-        faturamento_ano_anterior = float(resultado_factrc_ano_anterior[0][0]) if resultado_factrc_ano_anterior and resultado_factrc_ano_anterior[0][0] is not None else 0.0
-        
-        cur.execute(query_frctrc, tuple(params))
-        resultado = cur.fetchall()
-        custos = float(resultado[0][0]) if resultado and resultado[0][0] is not None else 0.0
-        pedagios = float(resultado[0][1]) if resultado and resultado[0][1] is not None else 0.0
-        volumes = float(resultado[0][2]) if resultado and resultado[0][2] is not None else 0.0
-        embarques = int(resultado[0][3]) if resultado and resultado[0][3] is not None else 0
-        faturados = int(resultado[0][4]) if resultado and resultado[0][4] is not None else 0
-
-        cur.execute(query_frctrc, tuple(params_ano_anterior))
-        resultado_frctrc_ano_anterior = cur.fetchall()
-        custos_ano_anterior = float(resultado_frctrc_ano_anterior[0][0]) if resultado_frctrc_ano_anterior and resultado_frctrc_ano_anterior[0][0] is not None else 0.0
-        pedagios_ano_anterior = float(resultado_frctrc_ano_anterior[0][1]) if resultado_frctrc_ano_anterior and resultado_frctrc_ano_anterior[0][1] is not None else 0.0
-        volumes_ano_anterior = float(resultado_frctrc_ano_anterior[0][2]) if resultado_frctrc_ano_anterior and resultado_frctrc_ano_anterior[0][2] is not None else 0.0
-        embarques_ano_anterior = int(resultado_frctrc_ano_anterior[0][3]) if resultado_frctrc_ano_anterior and resultado_frctrc_ano_anterior[0][3] is not None else 0
-        faturados_ano_anterior = int(resultado_frctrc_ano_anterior[0][4]) if resultado_frctrc_ano_anterior and resultado_frctrc_ano_anterior[0][4] is not None else 0
-               
-        # Combina os resultados
-        dados = [
-            {
-                "faturamento": faturamento,
-                "faturamento_ano_anterior": ((faturamento / faturamento_ano_anterior) -1) * 100 if faturamento_ano_anterior != 0 else 0.0,
-                "volumes": volumes,
-                "volumes_ano_anterior": ((volumes / volumes_ano_anterior) -1) * 100 if volumes_ano_anterior != 0 else 0.0,
-                "embarques": embarques,
-                "embarques_ano_anterior": ((embarques / embarques_ano_anterior) -1) * 100 if embarques_ano_anterior != 0 else 0.0,
-                "ticket_medio": (faturamento / faturados) if faturados != 0 else 0.0,
-                "ticket_medio_ano_anterior": (((faturamento / faturados) / (faturamento_ano_anterior / faturados_ano_anterior)) -1) * 100 if faturados != 0 and faturados_ano_anterior != 0 and faturamento_ano_anterior != 0 else 0.0,
-                "custos": custos,
-                "custos_ano_anterior": ((custos / custos_ano_anterior) -1) * 100 if custos_ano_anterior != 0 else 0.0,
-                "pedagios": pedagios,
-                "pedagios_ano_anterior": ((pedagios / pedagios_ano_anterior) -1) * 100 if pedagios_ano_anterior != 0 else 0.0,
-                "margem": ((faturamento - custos) / faturamento) * 100 if faturamento != 0 else 0.0,
-                "margem_ano_anterior": ((((faturamento - custos) / faturamento) / ((faturamento_ano_anterior - custos_ano_anterior) / faturamento_ano_anterior)) -1 ) * 100 if faturamento != 0 and faturamento_ano_anterior != 0 else 0.0,
-            }
-        ]
+    conn_data = await get_firebird_connection_data(idempresa)
+    pool = get_firebird_pool(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd'])
+    fila = get_bulkhead_stats(idempresa)
 
-        # Para BI: sempre retorna dados, mesmo que zerados
-        if not dados:
-            # Retorna estrutura com zeros para BI
-            dados = [
-                {
-                    "faturamento": 0.0,
-                    "faturamento_ano_anterior": 0.0,
-                    "volumes": 0.0,
-                    "volumes_ano_anterior": 0.0,
-                    "embarques": 0,
-                    "embarques_ano_anterior": 0.0,
-                    "ticket_medio": 0.0,
-                    "ticket_medio_ano_anterior": 0.0,
-                    "custos": 0.0,
-                    "custos_ano_anterior": 0.0,
-                    "pedagios": 0.0,
-                    "pedagios_ano_anterior": 0.0,
-                    "margem": 0.0,
-                    "margem_ano_anterior": 0.0,
-                }
-            ]
-        
-        return dados
+    return {
+        "fila": fila[0] if fila else None,
+        "pool": pool.stats(),
+        "cache": cache_bi_respostas.stats(),
+    }
 
-@router.post('/bi/kpi_mes_ano', tags=["BI"], response_model=KPIMesAno, status_code=status.HTTP_200_OK)
-async def get_kpi_mes_ano(
+@router.post("/bi/big_numbers", tags=["BI"], response_model=List[BigNumbers], status_code=status.HTTP_200_OK)
+@cache_bi(List[BigNumbers])
+async def get_big_numbers(
+    request: Request,
     consulta: FiltrosBI,
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
+
     """
-    Consulta Grafico mês e ano de kpi usando POST com schema de entrada.
+    Consulta big numbers usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-        query = """
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+    # Período de comparação (ano anterior por padrão)
+    data_inicio_ano_anterior, data_fim_ano_anterior = calcular_periodo_comparacao(data_inicio, data_fim, consulta.comparacao)
+    periodos = [data_inicio, data_fim, data_inicio_ano_anterior, data_fim_ano_anterior]
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        resultado = await big_numbers_fatos(idempresa, consulta, periodos)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            # Uma única leitura de cada view: as linhas dos dois períodos são marcadas
+            # com as flags "atual" e "anterior" e somadas com agregação condicional
+            query = """
+                SELECT
+                    fat.faturamento,
+                    fat.faturamento_anterior,
+                    ctrc.custos,
+                    ctrc.custos_anterior,
+                    ctrc.pedagios,
+                    ctrc.pedagios_anterior,
+                    ctrc.volumes,
+                    ctrc.volumes_anterior,
+                    ctrc.embarques,
+                    ctrc.embarques_anterior,
+                    ctrc.faturados,
+                    ctrc.faturados_anterior
+                FROM
+                    (
+                    SELECT
+                        SUM(vlrrecbto * atual) AS faturamento,
+                        SUM(vlrrecbto * anterior) AS faturamento_anterior
+                    FROM
+                        (
+                        SELECT
+                            vlrrecbto,
+                            CASE WHEN datarecbto >= ? AND datarecbto <= ? THEN 1 ELSE 0 END AS atual,
+                            CASE WHEN datarecbto >= ? AND datarecbto <= ? THEN 1 ELSE 0 END AS anterior
+                        FROM
+                            vwfactrc_bi
+                        WHERE
+                            ((datarecbto >= ? AND datarecbto <= ?) OR (datarecbto >= ? AND datarecbto <= ?)){filtros_factrc}
+                        ) f
+                    ) fat
+                CROSS JOIN
+                    (
+                    SELECT
+                        SUM(vlrcusto * atual) AS custos,
+                        SUM(vlrcusto * anterior) AS custos_anterior,
+                        SUM(vlrpedagio * atual) AS pedagios,
+                        SUM(vlrpedagio * anterior) AS pedagios_anterior,
+                        SUM(pesofrete_ton * atual) AS volumes,
+                        SUM(pesofrete_ton * anterior) AS volumes_anterior,
+                        SUM(embarque * atual) AS embarques,
+                        SUM(embarque * anterior) AS embarques_anterior,
+                        SUM(faturado * atual) AS faturados,
+                        SUM(faturado * anterior) AS faturados_anterior
+                    FROM
+                        (
+                        SELECT
+                            vlrcusto,
+                            vlrpedagio,
+                            pesofrete_ton,
+                            embarque,
+                            faturado,
+                            CASE WHEN dataemissao >= ? AND dataemissao <= ? THEN 1 ELSE 0 END AS atual,
+                            CASE WHEN dataemissao >= ? AND dataemissao <= ? THEN 1 ELSE 0 END AS anterior
+                        FROM
+                            vwfrctrc_bi
+                        WHERE
+                            ((dataemissao >= ? AND dataemissao <= ?) OR (dataemissao >= ? AND dataemissao <= ?)){filtros_frctrc}
+                        ) c
+                    ) ctrc
+            """
+
+            # Mesmos filtros nas duas views, cada uma com as suas colunas de data
+            filtros_factrc, params_filtros = compilar_filtros(consulta, COLUNAS_FACTRC)
+            filtros_frctrc, _ = compilar_filtros(consulta, COLUNAS_FRCTRC)
+
+            query = query.format(filtros_factrc=filtros_factrc, filtros_frctrc=filtros_frctrc)
+
+            # Flags (atual/anterior) + intervalo do WHERE, para cada view
+            params = periodos + periodos + params_filtros + periodos + periodos + params_filtros
+
+            await cur.execute(query, tuple(params))
+            resultado = await cur.fetchone()
+    valores = [float(valor) if valor is not None else 0.0 for valor in resultado] if resultado else [0.0] * 12
+
+    faturamento, faturamento_ano_anterior = valores[0], valores[1]
+    custos, custos_ano_anterior = valores[2], valores[3]
+    pedagios, pedagios_ano_anterior = valores[4], valores[5]
+    volumes, volumes_ano_anterior = valores[6], valores[7]
+    embarques, embarques_ano_anterior = int(valores[8]), int(valores[9])
+    faturados, faturados_ano_anterior = int(valores[10]), int(valores[11])
+           
+    # Combina os resultados
+    dados = [
+        {
+            "faturamento": faturamento,
+            "faturamento_ano_anterior": ((faturamento / faturamento_ano_anterior) -1) * 100 if faturamento_ano_anterior != 0 else 0.0,
+            "volumes": volumes,
+            "volumes_ano_anterior": ((volumes / volumes_ano_anterior) -1) * 100 if volumes_ano_anterior != 0 else 0.0,
+            "embarques": embarques,
+            "embarques_ano_anterior": ((embarques / embarques_ano_anterior) -1) * 100 if embarques_ano_anterior != 0 else 0.0,
+            "ticket_medio": (faturamento / faturados) if faturados != 0 else 0.0,
+            "ticket_medio_ano_anterior": (((faturamento / faturados) / (faturamento_ano_anterior / faturados_ano_anterior)) -1) * 100 if faturados != 0 and faturados_ano_anterior != 0 and faturamento_ano_anterior != 0 else 0.0,
+            "custos": custos,
+            "custos_ano_anterior": ((custos / custos_ano_anterior) -1) * 100 if custos_ano_anterior != 0 else 0.0,
+            "pedagios": pedagios,
+            "pedagios_ano_anterior": ((pedagios / pedagios_ano_anterior) -1) * 100 if pedagios_ano_anterior != 0 else 0.0,
+            "margem": ((faturamento - custos) / faturamento) * 100 if faturamento != 0 else 0.0,
+            "margem_ano_anterior": ((((faturamento - custos) / faturamento) / ((faturamento_ano_anterior - custos_ano_anterior) / faturamento_ano_anterior)) -1 ) * 100 if faturamento != 0 and faturamento_ano_anterior != 0 else 0.0,
+        }
+    ]
+
+    # Para BI: sempre retorna dados, mesmo que zerados
+    if not dados:
+        # Retorna estrutura com zeros para BI
+        dados = [
+            {
+                "faturamento": 0.0,
+                "faturamento_ano_anterior": 0.0,
+                "volumes": 0.0,
+                "volumes_ano_anterior": 0.0,
+                "embarques": 0,
+                "embarques_ano_anterior": 0.0,
+                "ticket_medio": 0.0,
+                "ticket_medio_ano_anterior": 0.0,
+                "custos": 0.0,
+                "custos_ano_anterior": 0.0,
+                "pedagios": 0.0,
+                "pedagios_ano_anterior": 0.0,
+                "margem": 0.0,
+                "margem_ano_anterior": 0.0,
+            }
+        ]
+    
+    return dados
+
+# Consulta de kpi_mes_ano. Com `desde`, lê só os meses a partir dessa data (os anteriores
+# vêm dos meses fechados guardados); ano e mês são filtrados depois, sobre o resultado.
+# O período é comparado com dataemissao/datarecbto, que têm índice.
+# Os demais filtros vão para dentro de cada ramo do UNION ALL, nas colunas da própria view
+def montar_query_kpi_mes_ano(consulta: FiltrosBI, desde: date = None, inicio_janela: date = None):
+    campos = ("codfilial", "codcid", "regiao", "dia")
+    # Janela de 3 anos (o atual e os 2 anteriores) comparada com a própria coluna de data
+    inicio = inicio_janela or date(date.today().year - 2, 1, 1)
+    if desde:
+        inicio = max(inicio, desde)
+
+    params = [inicio]
+    filtros_frctrc, _ = compilar_filtros(consulta, COLUNAS_FRCTRC, campos, params=params)
+    params.append(inicio)
+    filtros_factrc, _ = compilar_filtros(consulta, COLUNAS_FACTRC, campos, params=params)
+
+    query = f"""
                 SELECT
                     ano,
                     mes_numero,
@@ -266,35 +331,26 @@ async def get_kpi_mes_ano(
                         ano_emissao AS ano,
                         mes_emissao AS mes,
                         mes_numero,
-                        dia_emissao AS dia,
                         pesofrete_ton AS volume,
                         embarque AS embarque,
-                        0 AS faturamento,
-                        codfilial,
-                        codcid,
-                        regiao
+                        0 AS faturamento
                     FROM
                         VWFRCTRC_BI
                     WHERE
-                        ano_emissao >= EXTRACT(YEAR FROM CURRENT_TIMESTAMP) - 2
+                        dataemissao >= ?{filtros_frctrc}
                 UNION ALL
                     SELECT
                         ano_recbto AS ano,
                         mes_recbto AS mes,
                         mes_numero,
-                        dia_recbto AS dia,
                         0 AS volume,
                         0 AS embarque,
-                        vlrrecbto AS faturamento,
-                        codfilial,
-                        codcid,
-                        regiao
+                        vlrrecbto AS faturamento
                     FROM
                         VWFACTRC_BI
                     WHERE
-                        ano_recbto >= EXTRACT(YEAR FROM CURRENT_TIMESTAMP) - 2
+                        datarecbto >= ?{filtros_factrc}
                 ) dados
-                WHERE 1=1
                 GROUP BY
                     ano,
                     mes,
@@ -303,1077 +359,624 @@ async def get_kpi_mes_ano(
                     ano,
                     mes_numero
         """
+    return query, params
 
-        params = []
+@router.post('/bi/kpi_mes_ano', tags=["BI"], response_model=KPIMesAno, status_code=status.HTTP_200_OK)
+@cache_bi(KPIMesAno)
+async def get_kpi_mes_ano(
+    consulta: FiltrosBI,
+    payload: dict = Depends(get_token_payload)
+):
+    """
+    Consulta Grafico mês e ano de kpi usando POST com schema de entrada.
+    Permite consultas mais complexas no futuro.
+    """
+    idempresa = payload.get("empresa")
 
-        # Aplicar filtros no WHERE externo (após o UNION)
-        filtros_externos = ""
+    if not idempresa:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
+    
+    # Meses fechados já agregados para a empresa e os filtros (ano e mês são aplicados no resultado)
+    chave = (str(idempresa), chave_filtros(consulta, excluir=("ano", "mes")))
+    hoje = date.today()
+    corte = corte_meses_fechados(hoje)
+    inicio_janela = date(hoje.year - 2, 1, 1)
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        fechados = {}
+        rows = await kpi_mes_ano_fatos(idempresa, consulta, inicio_janela)
+    else:
+        fechados, desde = meses_fechados_kpi.obter(chave, corte)
+
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_kpi_mes_ano(consulta, desde, inicio_janela)
+
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+        meses_fechados_kpi.guardar(chave, corte, fechados, rows, inicio_janela)
+
+    # Meses fechados + meses consultados ao vivo, na ordem de ano e mês
+    linhas = {mes: row for mes, row in fechados.items() if mes >= (inicio_janela.year, inicio_janela.month)}
+    sem_mes = []
+    for row in rows:
+        mes = mes_da_linha(row)
+        if mes is None:
+            sem_mes.append(row)
+        else:
+            linhas[mes] = row
+    linhas = [linhas[mes] for mes in sorted(linhas)] + sem_mes
+
+    ano_filtro = normalize_filter(consulta.ano)
+    mes_filtro = normalize_filter(consulta.mes)
+
+    # Dicionário para armazenar os dados organizados por ano e mês
+    dados = {}
+    
+    for row in linhas:
+        if ano_filtro or mes_filtro:
+            mes = mes_da_linha(row)
+            if mes is None or (ano_filtro and mes[0] not in ano_filtro) or (mes_filtro and mes[1] not in mes_filtro):
+                continue
+
+        ano = str(int(row[0])) if row[0] is not None else "0"
+        mes_numero = str(int(row[1])) if row[1] is not None else "0"
+        mes = str(row[2]) if row[2] is not None else "Indefinido"
+        volume = float(row[3]) if row[3] is not None else 0.0
+        embarques = int(row[4]) if row[4] is not None else 0
+        faturamento = float(row[5]) if row[5] is not None else 0.0
         
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcid = normalize_filter(consulta.codcid)
-        regiao = normalize_filter(consulta.regiao)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cidade
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            filtros_externos += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        ano = normalize_filter(consulta.ano)
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            filtros_externos += f" AND ano IN ({placeholders_ano})"
-            params.extend(ano)
-
-        mes = normalize_filter(consulta.mes)
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            filtros_externos += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
+        # Inicializa o ano se não existir
+        if ano not in dados:
+            dados[ano] = {}
         
-        dia = normalize_filter(consulta.dia)
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            filtros_externos += f" AND dia IN ({placeholders_dia})"
-            params.extend(dia)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE 1=1",
-            f"WHERE 1=1{filtros_externos}"
+        # Adiciona os dados do mês
+        dados[ano][mes_numero] = DadosMesAno(
+            mes=mes,
+            volume=volume,
+            embarques=embarques,
+            faturamento=faturamento
         )
 
-        cur.execute(query, tuple(params))
+    if not dados:
+        # Para BI: retorna estrutura vazia em vez de erro 404
+        return {}
+    
+    return dados
 
-        # Dicionário para armazenar os dados organizados por ano e mês
-        dados = {}
-        
-        for row in cur.fetchall():
-            ano = str(int(row[0])) if row[0] is not None else "0"
-            mes_numero = str(int(row[1])) if row[1] is not None else "0"
-            mes = str(row[2]) if row[2] is not None else "Indefinido"
-            volume = float(row[3]) if row[3] is not None else 0.0
-            embarques = int(row[4]) if row[4] is not None else 0
-            faturamento = float(row[5]) if row[5] is not None else 0.0
-            
-            # Inicializa o ano se não existir
-            if ano not in dados:
-                dados[ano] = {}
-            
-            # Adiciona os dados do mês
-            dados[ano][mes_numero] = DadosMesAno(
-                mes=mes,
-                volume=volume,
-                embarques=embarques,
-                faturamento=faturamento
-            )
+# Consulta do kpi_dia_mes_atual: período [inicio, fim) e filtros dentro de cada ramo do
+# UNION ALL, nas colunas da própria view. Agrupa pela data; o dia sai de somar_por_dia
+def montar_query_kpi_dia_mes_atual(consulta: FiltrosBI, inicio: date, fim: date):
+    campos = ("codfilial", "codcid", "regiao", "ano", "mes", "dia")
 
-        if not dados:
-            # Para BI: retorna estrutura vazia em vez de erro 404
-            return {}
-        
-        return dados
+    params = [inicio, fim]
+    filtros_frctrc, _ = compilar_filtros(consulta, COLUNAS_FRCTRC, campos, params=params)
+    params.extend([inicio, fim])
+    filtros_factrc, _ = compilar_filtros(consulta, COLUNAS_FACTRC, campos, params=params)
+
+    query = f"""
+                    SELECT
+                        data,
+                        SUM(volume),
+                        SUM(embarques),
+                        SUM(faturamento)
+                    FROM
+                        (
+                        SELECT
+                            dataemissao AS data,
+                            pesofrete_ton AS volume,
+                            embarque AS embarques,
+                            0 AS faturamento
+                        FROM
+                            VWFRCTRC_BI
+                        WHERE
+                            dataemissao >= ? AND dataemissao < ?{filtros_frctrc}
+                    UNION ALL
+                        SELECT
+                            datarecbto AS data,
+                            0 AS volume,
+                            0 AS embarques,
+                            vlrrecbto AS faturamento
+                        FROM
+                            VWFACTRC_BI
+                        WHERE
+                            datarecbto >= ? AND datarecbto < ?{filtros_factrc}
+                    ) dados
+                    GROUP BY
+                        data
+            """
+    return query, params
 
 @router.post('/bi/kpi_dia_mes_atual', tags=["BI"], response_model=KPIDiaMesAtual, status_code=status.HTTP_200_OK)
+@cache_bi(KPIDiaMesAtual, ttl=60)
 async def get_kpi_dia_mes_atual(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
     """
     Consulta Grafico dia e mes atual de kpi usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await kpi_dia_mes_fatos(idempresa, consulta, *periodo_mes_atual())
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_kpi_dia_mes_atual(consulta, *limites_mes_atual())
+            await cur.execute(query, tuple(params))
+            rows = somar_por_dia(await cur.fetchall())
+
+    # Dicionário para armazenar os dados organizados por dia
+    dados = {}
+
+    for row in rows:
+        dia = str(int(row[0])) if row[0] is not None else "0"
+        volume = float(row[1]) if row[1] is not None else 0.0
+        embarques = int(row[2]) if row[2] is not None else 0
+        faturamento = float(row[3]) if row[3] is not None else 0.0
+        
+        # Adiciona os dados do dia
+        dados[dia] = DadosDiaMesAtual(
+            volume=volume,
+            embarques=embarques,
+            faturamento=faturamento
+        )
 
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-        query = """
+    if not dados:
+        return {}
+    
+    return dados
+
+# kpi por dimensão: (colunas do SELECT/GROUP BY externo, colunas lidas em cada view, filtros aplicados)
+DIMENSOES_KPI_FIREBIRD = {
+    "filial": (
+        "codfilial, filial",
+        "codfilial, filial",
+        ("codfilial", "codcliente", "codcid", "regiao", "codpro", "ano", "mes", "dia"),
+    ),
+    "regiao": (
+        "regiao",
+        "regiao",
+        ("codfilial", "codcliente", "codcid", "regiao", "codpro", "ano", "mes", "dia"),
+    ),
+    "cidade": (
+        "codcid, cidade || '-' || coduf",
+        "codcid, cidade, coduf",
+        ("codfilial", "codcid", "regiao", "ano", "mes", "dia"),
+    ),
+}
+
+# Consulta dos kpi_filial/regiao/cidade. Período e filtros vão para dentro de cada ramo do
+# UNION ALL, nas colunas da própria view (sem CAST), para o Firebird usar os índices
+# antes de juntar as duas views. Retorna (query, params)
+def montar_query_kpi_dimensao(consulta: FiltrosBI, dimensao: str, data_inicio: date, data_fim: date):
+    colunas, colunas_views, campos = DIMENSOES_KPI_FIREBIRD[dimensao]
+
+    params = [data_inicio, data_fim]
+    filtros_factrc, _ = compilar_filtros(consulta, COLUNAS_FACTRC, campos, params=params)
+    params.extend([data_inicio, data_fim])
+    filtros_frctrc, _ = compilar_filtros(consulta, COLUNAS_FRCTRC, campos, params=params)
+
+    query = f"""
+            SELECT
+                {colunas},
+                SUM(volume),
+                SUM(embarques),
+                SUM(faturamento)
+            FROM
+                (
                 SELECT
-                    dia,
-                    SUM(volume),
-                    SUM(embarques),
-                    SUM(faturamento)
+                    {colunas_views},
+                    0 AS volume,
+                    0 AS embarques,
+                    vlrrecbto AS faturamento
                 FROM
-                    (
-                    SELECT
-                        dia_emissao AS dia,
-                        pesofrete_ton AS volume,
-                        embarque AS embarques,
-                        0 AS faturamento,
-                        codfilial,
-                        codcid,
-                        regiao,
-                        mes_numero,
-                        ano_emissao AS ano
+                    VWFACTRC_BI
+                WHERE
+                    datarecbto >= ? AND datarecbto <= ?{filtros_factrc}
+            UNION ALL
+                SELECT
+                    {colunas_views},
+                    pesofrete_ton AS volume,
+                    embarque AS embarques,
+                    0 AS faturamento
                 FROM
                     VWFRCTRC_BI
                 WHERE
-                    ano_emissao = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                    AND mes_numero = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
-                UNION ALL
-                    SELECT
-                        dia_recbto AS dia,
-                        0 AS volume,
-                        0 AS embarques,
-                        vlrrecbto AS faturamento,
-                        codfilial,
-                        codcid,
-                        regiao,
-                        mes_numero,
-                        ano_recbto AS ano
-                    FROM
-                        VWFACTRC_BI
-                    WHERE
-                        ano_recbto = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                        AND mes_numero = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
-                ) dados
-                WHERE 1=1
-                GROUP BY
-                    dia
-                ORDER BY
-                    dia
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (após o UNION) - igual kpi_mes_ano
-        filtros_externos = ""
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcid = normalize_filter(consulta.codcid)
-        regiao = normalize_filter(consulta.regiao)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cidade
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            filtros_externos += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        ano = normalize_filter(consulta.ano)
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            filtros_externos += f" AND ano IN ({placeholders_ano})"
-            params.extend(ano)
-
-        mes = normalize_filter(consulta.mes)
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            filtros_externos += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
-
-        dia = normalize_filter(consulta.dia)
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            filtros_externos += f" AND dia IN ({placeholders_dia})"
-            params.extend(dia)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE 1=1",
-            f"WHERE 1=1{filtros_externos}"
-        )
-
-        cur.execute(query, tuple(params))
-
-        # Dicionário para armazenar os dados organizados por dia
-        dados = {}
-
-        for row in cur.fetchall():
-            dia = str(int(row[0])) if row[0] is not None else "0"
-            volume = float(row[1]) if row[1] is not None else 0.0
-            embarques = int(row[2]) if row[2] is not None else 0
-            faturamento = float(row[3]) if row[3] is not None else 0.0
-            
-            # Adiciona os dados do dia
-            dados[dia] = DadosDiaMesAtual(
-                volume=volume,
-                embarques=embarques,
-                faturamento=faturamento
-            )
-
-        if not dados:
-            return {}
-        
-        return dados
+                    dataemissao >= ? AND dataemissao <= ?{filtros_frctrc}
+            ) dados
+            GROUP BY
+                {colunas}
+            ORDER BY SUM(faturamento) DESC
+            """
+    return query, params
 
 @router.post("/bi/kpi_filial", tags=["BI"], response_model=KPIFilial, status_code=status.HTTP_200_OK)
+@cache_bi(KPIFilial)
 async def get_kpi_filial(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta kpi filial usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-        SELECT
-            codfilial,
-            filial,
-            SUM(volume),
-            SUM(embarques),
-            SUM(faturamento)
-        FROM
-            (
-            SELECT
-                filial,
-                0 AS volume,
-                0 AS embarques,
-                vlrrecbto AS faturamento,
-                codfilial,
-                codcliente,
-                codcid,
-                regiao,
-                codpro,
-                datarecbto AS data_operacao,
-                dia_recbto AS dia,
-                mes_numero,
-                ano_recbto AS ano
-            FROM
-                VWFACTRC_BI
-        UNION ALL
-            SELECT
-                filial,
-                pesofrete_ton AS volume,
-                embarque AS embarques,
-                0 AS faturamento,
-                codfilial,
-                codcliente,
-                codcid,
-                regiao,
-                codpro,
-                dataemissao AS data_operacao,
-                dia_emissao AS dia,
-                mes_numero,
-                ano_emissao AS ano
-            FROM
-                VWFRCTRC_BI
-        ) dados
-        WHERE data_operacao >= ? AND data_operacao <= ?
-        GROUP BY
-            codfilial,
-            filial
-        ORDER BY SUM(faturamento) DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await kpi_dimensao_fatos(idempresa, "filial", consulta, data_inicio, data_fim)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_kpi_dimensao(consulta, "filial", data_inicio, data_fim)
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+    # Dicionário para armazenar os dados organizados por filial
+    dados = {}
+
+    for row in rows:
+        codfilial = str(row[0]) if row[0] is not None else None
+        filial = str(row[1]) if row[1] is not None else None
+        volume = float(row[2]) if row[2] is not None else 0.0
+        embarques = int(row[3]) if row[3] is not None else 0
+        faturamento = float(row[4]) if row[4] is not None else 0.0
         
-        params.extend([data_inicio, data_fim])
-
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-        codcid = normalize_filter(consulta.codcid)
-        regiao = normalize_filter(consulta.regiao)
-        codpro = normalize_filter(consulta.codpro)
-        ano = normalize_filter(consulta.ano)
-        mes = normalize_filter(consulta.mes)
-        dia = normalize_filter(consulta.dia)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-
-        # Aplicar filtros por cidade
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            filtros_externos += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por produto
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            filtros_externos += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-
-        # Aplicar filtros por ano
-
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            filtros_externos += f" AND ano IN ({placeholders_ano})"
-            params.extend(ano)
-
-        # Aplicar filtros por mes
-
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            filtros_externos += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
-
-        # Aplicar filtros por dia
-
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            filtros_externos += f" AND dia IN ({placeholders_dia})"
-            params.extend(dia)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE data_operacao >= ? AND data_operacao <= ?",
-            f"WHERE data_operacao >= ? AND data_operacao <= ?{filtros_externos}"
+        # Adiciona os dados do filial
+        dados[codfilial] = DadosFilial(
+            filial=filial,
+            volume=volume,
+            embarques=embarques,
+            faturamento=faturamento
         )
 
-        cur.execute(query, tuple(params))
-
-        # Dicionário para armazenar os dados organizados por filial
-        dados = {}
-
-        for row in cur.fetchall():
-            codfilial = str(row[0]) if row[0] is not None else None
-            filial = str(row[1]) if row[1] is not None else None
-            volume = float(row[2]) if row[2] is not None else 0.0
-            embarques = int(row[3]) if row[3] is not None else 0
-            faturamento = float(row[4]) if row[4] is not None else 0.0
-            
-            # Adiciona os dados do filial
-            dados[codfilial] = DadosFilial(
-                filial=filial,
-                volume=volume,
-                embarques=embarques,
-                faturamento=faturamento
-            )
-
-        if not dados:
-            return {}
-        
-        return dados
+    if not dados:
+        return {}
+    
+    return dados
 
 @router.post("/bi/kpi_regiao", tags=["BI"], response_model=KPIRegiao, status_code=status.HTTP_200_OK)
+@cache_bi(KPIRegiao)
 async def get_kpi_regiao(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta kpi regiao usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-        SELECT
-            regiao,
-            SUM(volume),
-            SUM(embarques),
-            SUM(faturamento)
-        FROM
-            (
-            SELECT
-                regiao,
-                0 AS volume,
-                0 AS embarques,
-                vlrrecbto AS faturamento,
-                codfilial,
-                codcliente,
-                codcid,
-                codpro,
-                datarecbto AS data_operacao,
-                dia_recbto AS dia,
-                mes_numero,
-                ano_recbto AS ano
-        FROM
-            VWFACTRC_BI
-        UNION ALL
-            SELECT
-                regiao,
-                pesofrete_ton AS volume,
-                embarque AS embarques,
-                0 AS faturamento,
-                codfilial,
-                codcliente,
-                codcid,
-                codpro,
-                dataemissao AS data_operacao,
-                dia_emissao AS dia,
-                mes_numero,
-                ano_emissao AS ano
-            FROM
-                VWFRCTRC_BI
-        ) dados
-        WHERE data_operacao >= ? AND data_operacao <= ?
-        GROUP BY
-            regiao
-        ORDER BY SUM(faturamento) DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await kpi_dimensao_fatos(idempresa, "regiao", consulta, data_inicio, data_fim)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_kpi_dimensao(consulta, "regiao", data_inicio, data_fim)
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+            # Dicionário para armazenar os dados organizados por regiao
+    dados = {}
+
+    for row in rows:
+        regiao = str(row[0]) if row[0] is not None else None
+        volume = float(row[1]) if row[1] is not None else 0.0
+        embarques = int(row[2]) if row[2] is not None else 0
+        faturamento = float(row[3]) if row[3] is not None else 0.0
         
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-        codcid = normalize_filter(consulta.codcid)
-        regiao = normalize_filter(consulta.regiao)
-        codpro = normalize_filter(consulta.codpro)
-        ano = normalize_filter(consulta.ano)
-        mes = normalize_filter(consulta.mes)
-        dia = normalize_filter(consulta.dia)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-
-        # Aplicar filtros por cidade
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            filtros_externos += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por produto
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            filtros_externos += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-
-        # Aplicar filtros por ano
-
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            filtros_externos += f" AND ano IN ({placeholders_ano})"
-            params.extend(ano)
-
-        # Aplicar filtros por mes
-
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            filtros_externos += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
-
-        # Aplicar filtros por dia
-
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            filtros_externos += f" AND dia IN ({placeholders_dia})"
-            params.extend(dia)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE data_operacao >= ? AND data_operacao <= ?",
-            f"WHERE data_operacao >= ? AND data_operacao <= ?{filtros_externos}"
+        # Adiciona os dados do regiao
+        dados[regiao] = DadosRegiao(
+            volume=volume,
+            embarques=embarques,
+            faturamento=faturamento
         )
 
-        cur.execute(query, tuple(params))
-
-                # Dicionário para armazenar os dados organizados por regiao
-        dados = {}
-
-        for row in cur.fetchall():
-            regiao = str(row[0]) if row[0] is not None else None
-            volume = float(row[1]) if row[1] is not None else 0.0
-            embarques = int(row[2]) if row[2] is not None else 0
-            faturamento = float(row[3]) if row[3] is not None else 0.0
-            
-            # Adiciona os dados do regiao
-            dados[regiao] = DadosRegiao(
-                volume=volume,
-                embarques=embarques,
-                faturamento=faturamento
-            )
-
-        if not dados:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
-        
-        return dados
+    if not dados:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
+    
+    return dados
 
 @router.post("/bi/kpi_cidade", tags=["BI"], response_model=KPICidade, status_code=status.HTTP_200_OK)
+@cache_bi(KPICidade)
 async def get_kpi_cidade(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta kpi cidade usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                codcid,
-                cidade || '-' || coduf,
-                SUM(volume),
-                SUM(embarques),
-                SUM(faturamento)
-            FROM
-                (
-                SELECT
-                    cidade,
-                    coduf,
-                    0 AS volume,
-                    0 AS embarques,
-                    vlrrecbto AS faturamento,
-                    codfilial,
-                    codcid,
-                    regiao,
-                    datarecbto AS data_operacao,
-                    dia_recbto AS dia,
-                    mes_numero,
-                    ano_recbto AS ano
-                FROM
-                    VWFACTRC_BI
-            UNION ALL
-                SELECT
-                    cidade,
-                    coduf,
-                    pesofrete_ton AS volume,
-                    embarque AS embarques,
-                    0 AS faturamento,
-                    codfilial,
-                    codcid,
-                    regiao,
-                    dataemissao AS data_operacao,
-                    dia_emissao AS dia,
-                    mes_numero,
-                    ano_emissao AS ano
-                FROM
-                    VWFRCTRC_BI
-            ) dados
-            WHERE data_operacao >= ? AND data_operacao <= ?
-            GROUP BY
-                codcid,
-                cidade || '-' || coduf
-            ORDER BY SUM(faturamento) DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await kpi_dimensao_fatos(idempresa, "cidade", consulta, data_inicio, data_fim)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_kpi_dimensao(consulta, "cidade", data_inicio, data_fim)
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+            # Dicionário para armazenar os dados organizados por cidade
+    dados = {}
+
+    for row in rows:
+        codcid = str(row[0]) if row[0] is not None else None
+        cidade = str(row[1]) if row[1] is not None else None
+        volume = float(row[2]) if row[2] is not None else 0.0
+        embarques = int(row[3]) if row[3] is not None else 0
+        faturamento = float(row[4]) if row[4] is not None else 0.0
         
-        params.extend([data_inicio, data_fim])
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcid = normalize_filter(consulta.codcid)
-        regiao = normalize_filter(consulta.regiao)
-        ano = normalize_filter(consulta.ano)
-        mes = normalize_filter(consulta.mes)
-        dia = normalize_filter(consulta.dia)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cidade
-        if codcid:
-            placeholders_codcid = ', '.join(['?'] * len(codcid))
-            filtros_externos += f" AND codcid IN ({placeholders_codcid})"
-            params.extend(codcid)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por ano
-
-        if ano:
-            placeholders_ano = ', '.join(['?'] * len(ano))
-            filtros_externos += f" AND ano IN ({placeholders_ano})"
-            params.extend(ano)
-
-        # Aplicar filtros por mes
-
-        if mes:
-            placeholders_mes = ', '.join(['?'] * len(mes))
-            filtros_externos += f" AND mes_numero IN ({placeholders_mes})"
-            params.extend(mes)
-
-        # Aplicar filtros por dia
-
-        if dia:
-            placeholders_dia = ', '.join(['?'] * len(dia))
-            filtros_externos += f" AND dia IN ({placeholders_dia})"
-            params.extend(dia)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE data_operacao >= ? AND data_operacao <= ?",
-            f"WHERE data_operacao >= ? AND data_operacao <= ?{filtros_externos}"
+        # Adiciona os dados do cidade
+        dados[codcid] = DadosCidade(
+            cidade=cidade,
+            volume=volume,
+            embarques=embarques,
+            faturamento=faturamento
         )
 
-        cur.execute(query, tuple(params))
+    if not dados:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
+    
+    return dados
 
-                # Dicionário para armazenar os dados organizados por cidade
-        dados = {}
+# Rankings de faturamento no Firebird: dimensão -> colunas do SELECT/GROUP BY
+RANKINGS_FIREBIRD = {
+    "cliente": "codcliente, cliente",
+    "produto": "codpro, produto",
+}
 
-        for row in cur.fetchall():
-            codcid = str(row[0]) if row[0] is not None else None
-            cidade = str(row[1]) if row[1] is not None else None
-            volume = float(row[2]) if row[2] is not None else 0.0
-            embarques = int(row[3]) if row[3] is not None else 0
-            faturamento = float(row[4]) if row[4] is not None else 0.0
-            
-            # Adiciona os dados do cidade
-            dados[codcid] = DadosCidade(
-                cidade=cidade,
-                volume=volume,
-                embarques=embarques,
-                faturamento=faturamento
-            )
+def montar_query_ranking_faturamento(consulta: FiltrosBI, dimensao: str, data_inicio: date, data_fim: date):
+    """Faturamento recebido no período por cliente ou produto. Retorna (query, params)."""
+    colunas = RANKINGS_FIREBIRD[dimensao]
+    params = [data_inicio, data_fim]
+    filtros, _ = compilar_filtros(consulta, COLUNAS_FACTRC, ("codfilial", "codcliente", "regiao", "codpro"), params=params)
 
-        if not dados:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
-        
-        return dados
+    query = f"""
+                SELECT
+                    {colunas},
+                    SUM(vlrrecbto)
+                FROM
+                    VWFACTRC_BI
+                WHERE
+                    datarecbto >= ? AND datarecbto <= ?{filtros}
+                GROUP BY
+                    {colunas}
+                ORDER BY
+                    SUM(vlrrecbto) DESC
+            """
+    return query, params
 
 @router.post("/bi/kpi_cliente", tags=["BI"], response_model=KPICliente, status_code=status.HTTP_200_OK)
+@cache_bi(KPICliente)
 async def get_kpi_cliente(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta kpi cliente usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
-    
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                codcliente,
-                cliente,
-                SUM(vlrrecbto)
-            FROM
-                (
-                SELECT
-                    cliente,
-                    vlrrecbto,
-                    codfilial,
-                    codcliente,
-                    regiao,
-                    codpro,
-                    datarecbto
-                FROM
-                    VWFACTRC_BI
-            ) dados
-            WHERE datarecbto >= ? AND datarecbto <= ?
-            GROUP BY
-                codcliente,
-                cliente
-            ORDER BY
-                SUM(vlrrecbto) DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
+    
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await ranking_faturamento_fatos(idempresa, "cliente", consulta, data_inicio, data_fim)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_ranking_faturamento(consulta, "cliente", data_inicio, data_fim)
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+            # Dicionário para armazenar os dados organizados por cliente
+    dados = {}
+
+    for row in rows:
+        codcliente = str(row[0]) if row[0] is not None else None
+        cliente = str(row[1]) if row[1] is not None else None
+        faturamento = float(row[2]) if row[2] is not None else 0.0
         
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-        regiao = normalize_filter(consulta.regiao)
-        codpro = normalize_filter(consulta.codpro)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por produto
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            filtros_externos += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE datarecbto >= ? AND datarecbto <= ?",
-            f"WHERE datarecbto >= ? AND datarecbto <= ?{filtros_externos}"
+        # Adiciona os dados do cliente
+        dados[codcliente] = DadosCliente(
+            cliente=cliente,
+            faturamento=faturamento
         )
 
-
-        cur.execute(query, tuple(params))
-
-                # Dicionário para armazenar os dados organizados por cliente
-        dados = {}
-
-        for row in cur.fetchall():
-            codcliente = str(row[0]) if row[0] is not None else None
-            cliente = str(row[1]) if row[1] is not None else None
-            faturamento = float(row[2]) if row[2] is not None else 0.0
-            
-            # Adiciona os dados do cliente
-            dados[codcliente] = DadosCliente(
-                cliente=cliente,
-                faturamento=faturamento
-            )
-
-        if not dados:
-            return {}
-        
-        return dados
+    if not dados:
+        return {}
+    
+    return dados
 
 @router.post("/bi/kpi_produto", tags=["BI"], response_model=KPIProduto, status_code=status.HTTP_200_OK)
+@cache_bi(KPIProduto)
 async def get_kpi_produto(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta kpi produto usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                codpro,
-                produto,
-                SUM(vlrrecbto)
-            FROM
-                (
-                SELECT
-                    produto,
-                    vlrrecbto,
-                    codfilial,
-                    codcliente,
-                    regiao,
-                    codpro,
-                    datarecbto
-                FROM
-                    VWFACTRC_BI
-            )
-            WHERE datarecbto >= ? AND datarecbto <= ?
-            GROUP BY
-                codpro,
-                produto
-            ORDER BY
-                SUM(vlrrecbto) DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    # Com a sincronização ativa, a empresa é consultada nos fatos diários do PostgreSQL
+    if await usar_fatos_bi(idempresa):
+        rows = await ranking_faturamento_fatos(idempresa, "produto", consulta, data_inicio, data_fim)
+    else:
+        # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+        async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+            query, params = montar_query_ranking_faturamento(consulta, "produto", data_inicio, data_fim)
+            await cur.execute(query, tuple(params))
+            rows = await cur.fetchall()
+
+            # Dicionário para armazenar os dados organizados por produto
+    dados = {}
+
+    for row in rows:
+        codpro = str(row[0]) if row[0] is not None else None
+        produto = str(row[1]) if row[1] is not None else None
+        faturamento = float(row[2]) if row[2] is not None else 0.0
         
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-        regiao = normalize_filter(consulta.regiao)
-        codpro = normalize_filter(consulta.codpro)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por produto
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            filtros_externos += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE datarecbto >= ? AND datarecbto <= ?",
-            f"WHERE datarecbto >= ? AND datarecbto <= ?{filtros_externos}"
+        # Adiciona os dados do produto
+        dados[codpro] = DadosProduto(
+            produto=produto,
+            faturamento=faturamento
         )
 
-        cur.execute(query, tuple(params))
-
-                # Dicionário para armazenar os dados organizados por produto
-        dados = {}
-
-        for row in cur.fetchall():
-            codpro = str(row[0]) if row[0] is not None else None
-            produto = str(row[1]) if row[1] is not None else None
-            faturamento = float(row[2]) if row[2] is not None else 0.0
-            
-            # Adiciona os dados do produto
-            dados[codpro] = DadosProduto(
-                produto=produto,
-                faturamento=faturamento
-            )
+    if not dados:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
+    
+    return dados
+
+# Ordenação estável da tabela de faturamento (expressão, decrescente, tipo, coluna na linha)
+CHAVES_TABELA_FATURAMENTO = [
+    ("datarecbto", True, date, 2),
+    ("codfilial", False, int, 9),
+    ("anofatura", False, int, 1),
+    ("nrofatura", False, int, 0),
+]
+
+def montar_query_tabela_faturamento(consulta: FiltrosBI):
+    """Monta a consulta da tabela de faturamento. Retorna (query, params)."""
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    params = [data_inicio, data_fim]
+    filtros, _ = compilar_filtros(consulta, COLUNAS_FACTRC, ("codfilial", "codcliente", "regiao", "codpro"), params=params)
+
+    # Paginação por keyset: continua após a última linha da página anterior
+    limite, filtro_pagina, params_pagina = paginar(consulta, "tabela_faturamento", CHAVES_TABELA_FATURAMENTO)
+    filtros += filtro_pagina
+    params.extend(params_pagina)
+
+    query = f"""
+        SELECT
+            nrofatura,
+            anofatura,
+            datarecbto,
+            vlrrecbto,
+            filial,
+            cliente,
+            cidade,
+            coduf,
+            produto,
+            codfilial
+        FROM
+            vwfactrc_bi
+        WHERE datarecbto >= ? AND datarecbto <= ?{filtros}
+    """
 
-        if not dados:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
-        
-        return dados
+    # Uma linha além do limite indica se existe próxima página
+    if limite:
+        query = query.replace("SELECT", "SELECT FIRST ?", 1) + ordem_keyset(CHAVES_TABELA_FATURAMENTO)
+        params.insert(0, limite + 1)
+
+    return query, params
+
+def linha_tabela_faturamento(row) -> dict:
+    return {
+        "nrofatura": str(row[0]) if row[0] is not None else None,
+        "anofatura": str(row[1]) if row[1] is not None else None,
+        "datarecbto": str(row[2]) if row[2] is not None else None,
+        "faturamento": float(row[3]) if row[3] is not None else 0.0,
+        "filial": str(row[4]) if row[4] is not None else None,
+        "cliente": str(row[5]) if row[5] is not None else None,
+        "cidade": str(row[6]) if row[6] is not None else None,
+        "coduf": str(row[7]) if row[7] is not None else None,
+        "produto": str(row[8]) if row[8] is not None else None
+    }
 
 @router.post("/bi/tabela_faturamento", tags=["BI"], response_model=List[TabelaFaturamento], status_code=status.HTTP_200_OK)
 async def get_tabela_faturamento(
+    request: Request,
+    response: Response,
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta tabela de faturamento usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
+    query, params = montar_query_tabela_faturamento(consulta)
+    limite = limite_pagina(consulta)
+    pagina = (limite, "tabela_faturamento", CHAVES_TABELA_FATURAMENTO) if limite else None
 
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                nrofatura,
-                anofatura,
-                datarecbto,
-                vlrrecbto,
-                filial,
-                cliente,
-                cidade,
-                coduf,
-                produto
-            FROM
-                vwfactrc_bi
-            WHERE datarecbto >= ? AND datarecbto <= ?
-        """
+    # Modo streaming (Accept: application/x-ndjson ou text/csv): envia as linhas em lotes
+    formato = formato_streaming(request)
+    if formato:
+        return await stream_consulta_empresa(idempresa, query, params, linha_tabela_faturamento, TabelaFaturamento, formato, pagina)
 
-        params = []
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+        await cur.execute(query, tuple(params))
+        rows = await cur.fetchall()
 
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-        regiao = normalize_filter(consulta.regiao)
-        codpro = normalize_filter(consulta.codpro)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
-
-        # Aplicar filtros por região
-        if regiao:
-            placeholders_regiao = ', '.join(['?'] * len(regiao))
-            filtros_externos += f" AND CAST(regiao AS VARCHAR(50)) IN ({placeholders_regiao})"
-            params.extend(regiao)
-
-        # Aplicar filtros por produto
-        if codpro:
-            placeholders_codpro = ', '.join(['?'] * len(codpro))
-            filtros_externos += f" AND codpro IN ({placeholders_codpro})"
-            params.extend(codpro)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE datarecbto >= ? AND datarecbto <= ?",
-            f"WHERE datarecbto >= ? AND datarecbto <= ?{filtros_externos}"
-        )
+        # Consulta paginada: o cursor da próxima página vai no header da resposta
+        if pagina:
+            rows, proximo = fatiar_pagina(rows, *pagina)
+            if proximo:
+                response.headers[HEADER_PROXIMO_CURSOR] = proximo
 
-        cur.execute(query, tuple(params))
-                     # Combina os resultados
-        dados = [
-            {
-                "nrofatura": str(row[0]) if row[0] is not None else None,
-                "anofatura": str(row[1]) if row[1] is not None else None,
-                "datarecbto": str(row[2]) if row[2] is not None else None,
-                "faturamento": float(row[3]) if row[3] is not None else 0.0,
-                "filial": str(row[4]) if row[4] is not None else None,
-                "cliente": str(row[5]) if row[5] is not None else None,
-                "cidade": str(row[6]) if row[6] is not None else None,
-                "coduf": str(row[7]) if row[7] is not None else None,
-                "produto": str(row[8]) if row[8] is not None else None
-            }
-            for row in cur.fetchall()
-        ]
-              
+        dados = [linha_tabela_faturamento(row) for row in rows]
 
         if not dados:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
@@ -1381,26 +984,22 @@ async def get_tabela_faturamento(
         return dados
 
 @router.get("/bi/filtro_filial", tags=["BI"], response_model=List[FiltroFilial], status_code=status.HTTP_200_OK)
+@cache_bi(List[FiltroFilial], ttl=600)
 async def get_filtro_filial(
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
         Consulta filtro filial usando GET com schema de entrada.
     """
 
-  # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
         query= """
             SELECT
@@ -1410,14 +1009,14 @@ async def get_filtro_filial(
                 TBFIL
         """
 
-        cur.execute(query)
+        await cur.execute(query)
 
         dados = [
             {
                 "codfilial": str(row[0]) if row[0] is not None else None,
                 "filial": str(row[1]) if row[1] is not None else None
             }
-            for row in cur.fetchall()
+            for row in await cur.fetchall()
         ]
               
 
@@ -1427,26 +1026,22 @@ async def get_filtro_filial(
         return dados
 
 @router.get("/bi/filtro_cliente", tags=["BI"], response_model=List[FiltroCliente], status_code=status.HTTP_200_OK)
+@cache_bi(List[FiltroCliente], ttl=600)
 async def get_filtro_cliente(
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
         Consulta filtro cliente usando GET com schema de entrada.
     """
 
-  # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
         query= """
             SELECT
@@ -1456,14 +1051,14 @@ async def get_filtro_cliente(
                 TBCLI
         """
 
-        cur.execute(query)
+        await cur.execute(query)
 
         dados = [
             {
                 "codcliente": str(row[0]) if row[0] is not None else None,
                 "cliente": str(row[1]) if row[1] is not None else None
             }
-            for row in cur.fetchall()
+            for row in await cur.fetchall()
         ]
               
 
@@ -1472,97 +1067,60 @@ async def get_filtro_cliente(
         
         return dados
 
+def montar_query_big_numbers_contas_receber(consulta: FiltrosBI):
+    """
+    Monta a consulta dos big numbers de contas a receber (faturamento, a receber,
+    em atraso e prazo médio) com agregações condicionais em uma única leitura
+    de VWFACTRC_BI. Retorna (query, params).
+    """
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    filtros_adicionais, params_filtros = compilar_filtros(consulta, COLUNAS_CRTIT)
+
+    # FATURAMENTO e PRAZO MÉDIO: período de recebimento
+    # A RECEBER: período de vencimento
+    # EM ATRASO: sem filtro de data (sempre atual)
+    # O WHERE lê apenas as linhas que entram em alguma das medidas
+    query = f"""
+        SELECT
+            COALESCE(SUM(CASE WHEN datarecbto >= ? AND datarecbto <= ? THEN vlrrecbto END), 0) AS faturamento,
+            COALESCE(SUM(CASE WHEN condicao_fatura = 'A Receber'
+                               AND datavencto >= ? AND datavencto <= ? THEN vlrsaldo END), 0) AS a_receber,
+            COALESCE(SUM(CASE WHEN condicao_fatura = 'Em Atraso' THEN vlrsaldo END), 0) AS em_atraso,
+            COALESCE(AVG(CASE WHEN datarecbto >= ? AND datarecbto <= ? THEN dias_recebimento END), 0) AS prazo_medio
+        FROM VWFACTRC_BI
+        WHERE ((datarecbto >= ? AND datarecbto <= ?)
+            OR (condicao_fatura = 'A Receber' AND datavencto >= ? AND datavencto <= ?)
+            OR condicao_fatura = 'Em Atraso'){filtros_adicionais}
+    """
+    periodo = [data_inicio, data_fim]
+    params = periodo * 3 + periodo * 2 + params_filtros
+    return query, params
+
 @router.post("/bi/big_numbers_contas_receber", tags=["BI"], response_model=List[BigNumbersContasReceber], status_code=status.HTTP_200_OK)
+@cache_bi(List[BigNumbersContasReceber])
 async def get_big_numbers_contas_receber(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta big numbers contas receber usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
-        # Normalizar filtros para aplicar em todas as queries
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-
-        # Construir filtros adicionais para aplicar nas queries
-        filtros_adicionais = ""
-        params_filtros = []
-
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_adicionais += f" AND codfilial IN ({placeholders_filial})"
-            params_filtros.extend(codfilial)
-
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_adicionais += f" AND codcliente IN ({placeholders_cliente})"
-            params_filtros.extend(codcliente)
-
-        # 1. FATURAMENTO: Filtrado por período de recebimento
-        query_faturamento = f"""
-            SELECT COALESCE(SUM(vlrrecbto), 0) AS faturamento
-            FROM VWFACTRC_BI
-            WHERE datarecbto >= ? AND datarecbto <= ?{filtros_adicionais}
-        """
-        params_faturamento = [data_inicio, data_fim] + params_filtros
-
-        # 2. A RECEBER: Filtrado por período de vencimento
-        query_a_receber = f"""
-            SELECT COALESCE(SUM(vlrsaldo), 0) AS a_receber
-            FROM VWFACTRC_BI
-            WHERE condicao_fatura = 'A Receber'
-              AND datavencto >= ? AND datavencto <= ?{filtros_adicionais}
-        """
-        params_a_receber = [data_inicio, data_fim] + params_filtros
-
-        # 3. EM ATRASO: SEM filtro de data (sempre atual)
-        query_em_atraso = f"""
-            SELECT COALESCE(SUM(vlrsaldo), 0) AS em_atraso
-            FROM VWFACTRC_BI
-            WHERE condicao_fatura = 'Em Atraso'{filtros_adicionais}
-        """
-        params_em_atraso = params_filtros
-
-        # 4. PRAZO MÉDIO: Filtrado por período de recebimento
-        query_prazo_medio = f"""
-            SELECT COALESCE(AVG(dias_recebimento), 0) AS prazo_medio
-            FROM VWFACTRC_BI
-            WHERE datarecbto >= ? AND datarecbto <= ?
-              AND dias_recebimento IS NOT NULL{filtros_adicionais}
-        """
-        params_prazo_medio = [data_inicio, data_fim] + params_filtros
-
-        # Executar queries separadamente
-        cur.execute(query_faturamento, tuple(params_faturamento))
-        faturamento = cur.fetchone()[0] or 0.0
-
-        cur.execute(query_a_receber, tuple(params_a_receber))
-        a_receber = cur.fetchone()[0] or 0.0
-
-        cur.execute(query_em_atraso, tuple(params_em_atraso))
-        em_atraso = cur.fetchone()[0] or 0.0
-
-        cur.execute(query_prazo_medio, tuple(params_prazo_medio))
-        prazo_medio = cur.fetchone()[0] or 0.0
+        # Todas as medidas em uma única leitura da view
+        query, params = montar_query_big_numbers_contas_receber(consulta)
+        await cur.execute(query, tuple(params))
+        faturamento, a_receber, em_atraso, prazo_medio = [valor or 0.0 for valor in await cur.fetchone()]
 
         # Retornar dados combinados
         dados = [
@@ -1578,98 +1136,65 @@ async def get_big_numbers_contas_receber(
         return dados
 
 @router.post('/bi/recebimentos_dia_mes_atual', tags=["BI"], response_model=RecebimentosDiaMesAtual, status_code=status.HTTP_200_OK)
+@cache_bi(RecebimentosDiaMesAtual, ttl=60)
 async def get_recebimentos_dia_mes_atual(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
     """
     Consulta Grafico dia e mes atual de recebimentos usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-        query = """
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+        inicio, fim = limites_mes_atual()
+        params = [inicio, fim]
+        filtros_recbto, _ = compilar_filtros(consulta, COLUNAS_CRTIT, params=params)
+        params.extend([inicio, fim])
+        filtros_vencto, _ = compilar_filtros(consulta, COLUNAS_CRTIT, params=params)
+
+        # Período comparado com datarecbto/datavencto (com índice); o dia sai de somar_por_dia
+        query = f"""
                     SELECT
-                        dia,
+                        data,
                         SUM(faturamento),
                         SUM(a_receber)
                     FROM
                         (
                         SELECT
-                            dia_recbto AS dia,
+                            datarecbto AS data,
                             vlrrecbto AS faturamento,
-                            0 AS a_receber,
-                            codfilial,
-                            codcliente
+                            0 AS a_receber
                         FROM
                             VWFACTRC_BI
                         WHERE
-                            ano_recbto = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                            AND mes_numero = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
+                            datarecbto >= ? AND datarecbto < ?{filtros_recbto}
                     UNION ALL
                         SELECT
-                            dia_vencto AS dia,
+                            datavencto AS data,
                             0 AS faturamento,
-                            vlrsaldo AS a_receber,
-                            codfilial,
-                            codcliente
+                            vlrsaldo AS a_receber
                         FROM
                             VWFACTRC_BI
                         WHERE
-                            ano_vencto = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                            AND mes_numero_vencto = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
-                            AND condicao_fatura = 'A Receber'
+                            datavencto >= ? AND datavencto < ?
+                            AND condicao_fatura = 'A Receber'{filtros_vencto}
                     ) dados
-                    WHERE 1=1
                     GROUP BY
-                        dia
-                    ORDER BY
-                        dia
+                        data
         """
 
-        params = []
-
-        # Aplicar filtros no WHERE externo (após o UNION) - igual kpi_mes_ano
-        filtros_externos = ""
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_codcliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_codcliente})"
-            params.extend(codcliente)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE 1=1",
-            f"WHERE 1=1{filtros_externos}"
-        )
-
-        cur.execute(query, tuple(params))
+        await cur.execute(query, tuple(params))
 
         # Dicionário para armazenar os dados organizados por dia
         dados = {}
 
-        for row in cur.fetchall():
+        for row in somar_por_dia(await cur.fetchall()):
             dia = str(int(row[0])) if row[0] is not None else "0"
             faturamento = float(row[1]) if row[1] is not None else 0.0
             a_receber = float(row[2]) if row[2] is not None else 0.0
@@ -1685,102 +1210,62 @@ async def get_recebimentos_dia_mes_atual(
         
         return dados
 
+def montar_query_a_receber_cliente(consulta: FiltrosBI):
+    """
+    Monta a consulta do saldo a receber por cliente: títulos a receber no período
+    de vencimento mais todos os títulos em atraso, em uma única leitura de
+    VWFACTRC_BI. Retorna (query, params).
+    """
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    params = [data_inicio, data_fim]
+
+    filtros_adicionais, _ = compilar_filtros(consulta, COLUNAS_CRTIT, params=params)
+
+    query = f"""
+        SELECT
+            codcliente,
+            cliente,
+            SUM(vlrsaldo)
+        FROM
+            VWFACTRC_BI
+        WHERE ((condicao_fatura = 'A Receber' AND datavencto >= ? AND datavencto <= ?)
+            OR condicao_fatura = 'Em Atraso'){filtros_adicionais}
+        GROUP BY
+            codcliente,
+            cliente
+        ORDER BY
+            SUM(vlrsaldo) DESC
+    """
+    return query, params
+
 @router.post("/bi/a_receber_cliente", tags=["BI"], response_model=AReceberCliente, status_code=status.HTTP_200_OK)
+@cache_bi(AReceberCliente)
 async def get_a_receber_cliente(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta a receber cliente usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        # Construir filtros adicionais para aplicar nas queries
-        filtros_adicionais_a_receber = ""
-        filtros_adicionais_em_atraso = ""
-        params_a_receber = [data_inicio, data_fim]
-        params_em_atraso = []
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_adicionais_a_receber += f" AND codfilial IN ({placeholders_filial})"
-            filtros_adicionais_em_atraso += f" AND codfilial IN ({placeholders_filial})"
-            params_a_receber.extend(codfilial)
-            params_em_atraso.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_adicionais_a_receber += f" AND codcliente IN ({placeholders_cliente})"
-            filtros_adicionais_em_atraso += f" AND codcliente IN ({placeholders_cliente})"
-            params_a_receber.extend(codcliente)
-            params_em_atraso.extend(codcliente)
-
-        query= f"""
-            SELECT
-                codcliente,
-                cliente,
-                SUM(vlrsaldo)
-            FROM
-                (
-                SELECT
-                    cliente,
-                    vlrsaldo,
-                    codfilial,
-                    codcliente,
-                    datavencto
-                FROM
-                    VWFACTRC_BI
-                WHERE condicao_fatura = 'A Receber' AND datavencto >= ? AND datavencto <= ?{filtros_adicionais_a_receber}
-            UNION ALL
-                SELECT
-                    cliente,
-                    vlrsaldo,
-                    codfilial,
-                    codcliente,
-                    datavencto
-                FROM
-                    VWFACTRC_BI
-                WHERE condicao_fatura = 'Em Atraso'{filtros_adicionais_em_atraso}
-            ) dados
-            GROUP BY
-                codcliente,
-                cliente
-            ORDER BY
-                SUM(vlrsaldo) DESC
-        """
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
-        params = params_a_receber + params_em_atraso
-
-
-        cur.execute(query, tuple(params))
+        query, params = montar_query_a_receber_cliente(consulta)
+        await cur.execute(query, tuple(params))
 
                 # Dicionário para armazenar os dados organizados por cliente
         dados = {}
 
-        for row in cur.fetchall():
+        for row in await cur.fetchall():
             codcliente = str(row[0]) if row[0] is not None else None
             cliente = str(row[1]) if row[1] is not None else None
             a_receber = float(row[2]) if row[2] is not None else 0.0
@@ -1796,102 +1281,111 @@ async def get_a_receber_cliente(
         
         return dados
 
+# Ordenação estável da tabela de contas a receber: as expressões do GROUP BY (expressão, decrescente, tipo, coluna na linha).
+# Agrupa pelas mesmas expressões com COALESCE do cursor: nulo e '' formam um só grupo, senão duas linhas
+# teriam a mesma chave e o keyset pularia uma delas. O MAX no SELECT mantém nulo quando o grupo só tem nulos.
+CHAVES_TABELA_A_RECEBER = [
+    ("datavencto", True, date, 0),
+    ("COALESCE(cliente, '')", False, str, 1),
+    ("COALESCE(cidade, '')", False, str, 2),
+    ("COALESCE(coduf, '')", False, str, 3),
+    ("COALESCE(produto, '')", False, str, 4),
+    ("COALESCE(conta, '')", False, str, 6),
+]
+
+def montar_query_tabela_a_receber(consulta: FiltrosBI):
+    """Monta a consulta da tabela de contas a receber. Retorna (query, params)."""
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    params = []
+
+    params.extend([data_inicio, data_fim])
+
+    # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
+    filtros_externos, _ = compilar_filtros(consulta, COLUNAS_CRTIT, params=params)
+
+    # Paginação por keyset: continua após a última linha da página anterior
+    # (o predicado usa só colunas do GROUP BY, então pode filtrar antes do agrupamento)
+    limite, filtro_pagina, params_pagina = paginar(consulta, "tabela_a_receber", CHAVES_TABELA_A_RECEBER)
+    filtros_externos += filtro_pagina
+    params.extend(params_pagina)
+
+    query = f"""
+        SELECT
+            datavencto,
+            MAX(cliente),
+            MAX(cidade),
+            MAX(coduf),
+            MAX(produto),
+            SUM(vlrsaldo),
+            MAX(conta)
+        FROM
+            vwfactrc_bi
+        WHERE datavencto >= ? AND datavencto <= ?{filtros_externos}
+        GROUP BY {agrupamento(CHAVES_TABELA_A_RECEBER)}
+        ORDER BY 
+            datavencto DESC
+    """
+
+    # Uma linha além do limite indica se existe próxima página
+    if limite:
+        query = query[:query.index("ORDER BY")] + ordem_keyset(CHAVES_TABELA_A_RECEBER)
+        query = query.replace("SELECT", "SELECT FIRST ?", 1)
+        params.insert(0, limite + 1)
+
+    return query, params
+
+def linha_tabela_a_receber(row) -> dict:
+    return {
+        "datavencto": str(row[0]) if row[0] is not None else None,
+        "cliente": str(row[1]) if row[1] is not None else None,
+        "cidade": str(row[2]) if row[2] is not None else None,
+        "coduf": str(row[3]) if row[3] is not None else None,
+        "produto": str(row[4]) if row[4] is not None else None,
+        "a_receber": float(row[5]) if row[5] is not None else 0.0,
+        "conta": str(row[6]) if row[6] is not None else None
+    }
+
 @router.post("/bi/tabela_a_receber", tags=["BI"], response_model=List[TabelaAReceber], status_code=status.HTTP_200_OK)
 async def get_tabela_a_receber(
+    request: Request,
+    response: Response,
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta tabela de a receber usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                datavencto,
-                cliente,
-                cidade,
-                coduf,
-                produto,
-                SUM(vlrsaldo),
-                conta
-            FROM
-                vwfactrc_bi
-            WHERE datavencto >= ? AND datavencto <= ?
-            GROUP BY 
-                datavencto,
-                cliente,
-                cidade,
-                coduf,
-                produto,
-                conta
-            ORDER BY 
-                datavencto DESC
-        """
+    query, params = montar_query_tabela_a_receber(consulta)
+    limite = limite_pagina(consulta)
+    pagina = (limite, "tabela_a_receber", CHAVES_TABELA_A_RECEBER) if limite else None
 
-        params = []
+    # Modo streaming (Accept: application/x-ndjson ou text/csv): envia as linhas em lotes
+    formato = formato_streaming(request)
+    if formato:
+        return await stream_consulta_empresa(idempresa, query, params, linha_tabela_a_receber, TabelaAReceber, formato, pagina)
 
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
-        
-        # Normalizar filtros
-        codfilial = normalize_filter(consulta.codfilial)
-        codcliente = normalize_filter(consulta.codcliente)
-
-        # Aplicar filtros por filial
-        if codfilial:
-            placeholders_filial = ', '.join(['?'] * len(codfilial))
-            filtros_externos += f" AND codfilial IN ({placeholders_filial})"
-            params.extend(codfilial)
-
-        # Aplicar filtros por cliente
-        if codcliente:
-            placeholders_cliente = ', '.join(['?'] * len(codcliente))
-            filtros_externos += f" AND codcliente IN ({placeholders_cliente})"
-            params.extend(codcliente)
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+        await cur.execute(query, tuple(params))
+        rows = await cur.fetchall()
 
+        # Consulta paginada: o cursor da próxima página vai no header da resposta
+        if pagina:
+            rows, proximo = fatiar_pagina(rows, *pagina)
+            if proximo:
+                response.headers[HEADER_PROXIMO_CURSOR] = proximo
 
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE datavencto >= ? AND datavencto <= ?",
-            f"WHERE datavencto >= ? AND datavencto <= ?{filtros_externos}"
-        )
-
-        cur.execute(query, tuple(params))
-                     # Combina os resultados
-        dados = [
-            {
-                "datavencto": str(row[0]) if row[0] is not None else None,
-                "cliente": str(row[1]) if row[1] is not None else None,
-                "cidade": str(row[2]) if row[2] is not None else None,
-                "coduf": str(row[3]) if row[3] is not None else None,
-                "produto": str(row[4]) if row[4] is not None else None,
-                "a_receber": float(row[5]) if row[5] is not None else 0.0,
-                "conta": str(row[6]) if row[6] is not None else None
-            }
-            for row in cur.fetchall()
-        ]
-              
+        dados = [linha_tabela_a_receber(row) for row in rows]
 
         if not dados:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
@@ -1899,26 +1393,22 @@ async def get_tabela_a_receber(
         return dados
 
 @router.get("/bi/filtro_fornecedor", tags=["BI"], response_model=List[FiltroFornecedor], status_code=status.HTTP_200_OK)
+@cache_bi(List[FiltroFornecedor], ttl=600)
 async def get_filtro_fornecedor(
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
         Consulta filtro fornecedor usando GET com schema de entrada.
     """
 
-  # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
         query= """
             SELECT
@@ -1928,14 +1418,14 @@ async def get_filtro_fornecedor(
                 tbfor
         """
 
-        cur.execute(query)
+        await cur.execute(query)
 
         dados = [
             {
                 "codfornecedor": str(row[0]) if row[0] is not None else None,
                 "fornecedor": str(row[1]) if row[1] is not None else None
             }
-            for row in cur.fetchall()
+            for row in await cur.fetchall()
         ]
               
 
@@ -1945,26 +1435,22 @@ async def get_filtro_fornecedor(
         return dados
 
 @router.get("/bi/filtro_transacao", tags=["BI"], response_model=List[FiltroTransacao], status_code=status.HTTP_200_OK)
+@cache_bi(List[FiltroTransacao], ttl=600)
 async def get_filtro_transacao(
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
         Consulta filtro transacao usando GET com schema de entrada.
     """
 
-  # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
         query= """
             SELECT
@@ -1974,14 +1460,14 @@ async def get_filtro_transacao(
                 tbhis
         """
 
-        cur.execute(query)
+        await cur.execute(query)
 
         dados = [
             {
                 "codtransacao": str(row[0]) if row[0] is not None else None,
                 "transacao": str(row[1]) if row[1] is not None else None
             }
-            for row in cur.fetchall()
+            for row in await cur.fetchall()
         ]
               
 
@@ -1990,87 +1476,58 @@ async def get_filtro_transacao(
         
         return dados
 
+def montar_query_big_numbers_contas_pagar(consulta: FiltrosBI):
+    """
+    Monta a consulta dos big numbers de contas a pagar (pago, a pagar e em atraso)
+    com agregações condicionais em uma única leitura de vwcptit_bi.
+    Retorna (query, params).
+    """
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    filtros_adicionais, params_filtros = compilar_filtros(consulta, COLUNAS_CPTIT)
+
+    # PAGO: período de movimento
+    # A PAGAR: período de vencimento
+    # EM ATRASO: sem filtro de data (sempre atual)
+    query = f"""
+        SELECT
+            COALESCE(SUM(CASE WHEN datamovto >= ? AND datamovto <= ? THEN vlrpago END), 0) AS pago,
+            COALESCE(SUM(CASE WHEN condicao_fatura = 'A Pagar'
+                               AND datavencto >= ? AND datavencto <= ? THEN vlrsaldo END), 0) AS a_pagar,
+            COALESCE(SUM(CASE WHEN condicao_fatura = 'Em Atraso' THEN vlrsaldo END), 0) AS em_atraso
+        FROM vwcptit_bi
+        WHERE ((datamovto >= ? AND datamovto <= ?)
+            OR (condicao_fatura = 'A Pagar' AND datavencto >= ? AND datavencto <= ?)
+            OR condicao_fatura = 'Em Atraso'){filtros_adicionais}
+    """
+    periodo = [data_inicio, data_fim]
+    params = periodo * 2 + periodo * 2 + params_filtros
+    return query, params
+
 @router.post("/bi/big_numbers_contas_pagar", tags=["BI"], response_model=List[BigNumbersContasPagar], status_code=status.HTTP_200_OK)
+@cache_bi(List[BigNumbersContasPagar])
 async def get_big_numbers_contas_pagar(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta big numbers contas pagar usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        # Normalizar filtros para aplicar em todas as queries
-        codfornecedor = normalize_filter(consulta.codfornecedor)
-        codtransacao = normalize_filter(consulta.codtransacao)
-
-        # Construir filtros adicionais para aplicar nas queries
-        filtros_adicionais = ""
-        params_filtros = []
-
-        if codfornecedor:
-            placeholders_fornecedor = ', '.join(['?'] * len(codfornecedor))
-            filtros_adicionais += f" AND codfornecedor IN ({placeholders_fornecedor})"
-            params_filtros.extend(codfornecedor)
-
-        if codtransacao:
-            placeholders_transacao = ', '.join(['?'] * len(codtransacao))
-            filtros_adicionais += f" AND codtransacao IN ({placeholders_transacao})"
-            params_filtros.extend(codtransacao)
-
-        # 1. FATURAMENTO: Filtrado por período de recebimento
-        query_pago = f"""
-            SELECT
-	            COALESCE(SUM(vlrpago), 0) AS pago
-            FROM vwcptit_bi
-            WHERE datamovto >= ? AND datamovto <= ?{filtros_adicionais}
-        """
-        params_pago = [data_inicio, data_fim] + params_filtros
-
-        # 2. A PAGAR: Filtrado por período de vencimento
-        query_a_pagar = f"""
-            SELECT
-	            COALESCE(SUM(vlrsaldo), 0) AS a_pagar
-            FROM vwcptit_bi
-            WHERE condicao_fatura = 'A Pagar'
-              AND datavencto >= ? AND datavencto <= ?{filtros_adicionais}
-        """
-        params_a_pagar = [data_inicio, data_fim] + params_filtros
-
-        # 3. EM ATRASO: SEM filtro de data (sempre atual)
-        query_em_atraso = f"""
-            SELECT COALESCE(SUM(vlrsaldo), 0) AS em_atraso
-            FROM vwcptit_bi
-            WHERE condicao_fatura = 'Em Atraso'{filtros_adicionais}
-        """
-        params_em_atraso = params_filtros
-
-        # Executar queries separadamente
-        cur.execute(query_pago, tuple(params_pago))
-        pago = cur.fetchone()[0] or 0.0
-
-        cur.execute(query_a_pagar, tuple(params_a_pagar))
-        a_pagar = cur.fetchone()[0] or 0.0
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
-        cur.execute(query_em_atraso, tuple(params_em_atraso))
-        em_atraso = cur.fetchone()[0] or 0.0
+        # Todas as medidas em uma única leitura da view
+        query, params = montar_query_big_numbers_contas_pagar(consulta)
+        await cur.execute(query, tuple(params))
+        pago, a_pagar, em_atraso = [valor or 0.0 for valor in await cur.fetchone()]
 
         # Retornar dados combinados
         dados = [
@@ -2085,98 +1542,65 @@ async def get_big_numbers_contas_pagar(
         return dados
 
 @router.post('/bi/contas_pagar_dia_mes_atual', tags=["BI"], response_model=ContasPagarDiaMesAtual, status_code=status.HTTP_200_OK)
+@cache_bi(ContasPagarDiaMesAtual, ttl=60)
 async def get_contas_pagar_dia_mes_atual(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
     """
     Consulta Grafico dia e mes atual de contas pagar usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-        query = """
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+        inicio, fim = limites_mes_atual()
+        params = [inicio, fim]
+        filtros_movto, _ = compilar_filtros(consulta, COLUNAS_CPTIT, params=params)
+        params.extend([inicio, fim])
+        filtros_vencto, _ = compilar_filtros(consulta, COLUNAS_CPTIT, params=params)
+
+        # Período comparado com datamovto/datavencto (com índice); o dia sai de somar_por_dia
+        query = f"""
                     SELECT
-                        dia,
+                        data,
                         SUM(vlrpago),
                         SUM(a_pagar)
                     FROM
                         (
                         SELECT
-                            dia_movto AS dia,
+                            datamovto AS data,
                             vlrpago,
-                            0 AS a_pagar,
-                            codfornecedor,
-                            codtransacao
+                            0 AS a_pagar
                         FROM
                             VWCPTIT_BI
                         WHERE
-                            ano_movto = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                            AND mes_numero_movto = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
+                            datamovto >= ? AND datamovto < ?{filtros_movto}
                     UNION ALL
                         SELECT
-                            dia_vencto AS dia,
+                            datavencto AS data,
                             0 AS vlrpago,
-                            vlrsaldo AS a_pagar,
-                            codfornecedor,
-                            codtransacao
+                            vlrsaldo AS a_pagar
                         FROM
                             VWCPTIT_BI
                         WHERE
-                            ano_vencto = EXTRACT(YEAR FROM CURRENT_TIMESTAMP)
-                            AND mes_numero_vencto = EXTRACT(MONTH FROM CURRENT_TIMESTAMP)
-                            AND condicao_fatura = 'A Pagar'
+                            datavencto >= ? AND datavencto < ?
+                            AND condicao_fatura = 'A Pagar'{filtros_vencto}
                     ) dados
-                    WHERE 1=1
                     GROUP BY
-                        dia
-                    ORDER BY
-                        dia
+                        data
         """
 
-        params = []
-
-        # Aplicar filtros no WHERE externo (após o UNION) - igual kpi_mes_ano
-        filtros_externos = ""
-        
-        # Normalizar filtros
-        codfornecedor = normalize_filter(consulta.codfornecedor)
-        codtransacao = normalize_filter(consulta.codtransacao)
-
-        # Aplicar filtros por filial
-        if codfornecedor:
-            placeholders_fornecedor = ', '.join(['?'] * len(codfornecedor))
-            filtros_externos += f" AND codfornecedor IN ({placeholders_fornecedor})"
-            params.extend(codfornecedor)
-
-        # Aplicar filtros por cliente
-        if codtransacao:
-            placeholders_codtransacao = ', '.join(['?'] * len(codtransacao))
-            filtros_externos += f" AND codtransacao IN ({placeholders_codtransacao})"
-            params.extend(codtransacao)
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE 1=1",
-            f"WHERE 1=1{filtros_externos}"
-        )
-
-        cur.execute(query, tuple(params))
+        await cur.execute(query, tuple(params))
 
         # Dicionário para armazenar os dados organizados por dia
         dados = {}
 
-        for row in cur.fetchall():
+        for row in somar_por_dia(await cur.fetchall()):
             dia = str(int(row[0])) if row[0] is not None else "0"
             pago = float(row[1]) if row[1] is not None else 0.0
             a_pagar = float(row[2]) if row[2] is not None else 0.0
@@ -2192,102 +1616,62 @@ async def get_contas_pagar_dia_mes_atual(
         
         return dados
 
+def montar_query_a_pagar_fornecedor(consulta: FiltrosBI):
+    """
+    Monta a consulta do saldo a pagar por fornecedor: títulos a pagar no período
+    de vencimento mais todos os títulos em atraso, em uma única leitura de
+    VWCPTIT_BI. Retorna (query, params).
+    """
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    params = [data_inicio, data_fim]
+
+    filtros_adicionais, _ = compilar_filtros(consulta, COLUNAS_CPTIT, params=params)
+
+    query = f"""
+        SELECT
+            codfornecedor,
+            fornecedor,
+            SUM(vlrsaldo)
+        FROM
+            VWCPTIT_BI
+        WHERE ((condicao_fatura = 'A Pagar' AND datavencto >= ? AND datavencto <= ?)
+            OR condicao_fatura = 'Em Atraso'){filtros_adicionais}
+        GROUP BY
+            codfornecedor,
+            fornecedor
+        ORDER BY
+            SUM(vlrsaldo) DESC
+    """
+    return query, params
+
 @router.post("/bi/a_pagar_fornecedor", tags=["BI"], response_model=APagarFornecedor, status_code=status.HTTP_200_OK)
+@cache_bi(APagarFornecedor)
 async def get_a_pagar_fornecedor(
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta a pagar fornecedor usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        # Construir filtros adicionais para aplicar nas queries
-        filtros_adicionais_a_pagar = ""
-        filtros_adicionais_em_atraso = ""
-        params_a_pagar = [data_inicio, data_fim]
-        params_em_atraso = []
-        
-        # Normalizar filtros
-        codfornecedor = normalize_filter(consulta.codfornecedor)
-        codtransacao = normalize_filter(consulta.codtransacao)
-
-        # Aplicar filtros por fornecedor
-        if codfornecedor:
-            placeholders_fornecedor = ', '.join(['?'] * len(codfornecedor))
-            filtros_adicionais_a_pagar += f" AND codfornecedor IN ({placeholders_fornecedor})"
-            filtros_adicionais_em_atraso += f" AND codfornecedor IN ({placeholders_fornecedor})"
-            params_a_pagar.extend(codfornecedor)
-            params_em_atraso.extend(codfornecedor)
-
-        # Aplicar filtros por transacao
-        if codtransacao:
-            placeholders_transacao = ', '.join(['?'] * len(codtransacao))
-            filtros_adicionais_a_pagar += f" AND codtransacao IN ({placeholders_transacao})"
-            filtros_adicionais_em_atraso += f" AND codtransacao IN ({placeholders_transacao})"
-            params_a_pagar.extend(codtransacao)
-            params_em_atraso.extend(codtransacao)
-
-        query= f"""
-               SELECT
-                    codfornecedor,
-                    fornecedor,
-                    SUM(vlrsaldo)
-                FROM
-                    (
-                    SELECT
-                        fornecedor,
-                        vlrsaldo,
-                        codfornecedor,
-                        codtransacao,
-                        datavencto
-                    FROM
-                        VWCPTIT_BI
-                    WHERE condicao_fatura = 'A Pagar' AND datavencto >= ? AND datavencto <= ?{filtros_adicionais_a_pagar}
-                UNION ALL
-                    SELECT
-                        fornecedor,
-                        vlrsaldo,
-                        codfornecedor,
-                        codtransacao,
-                        datavencto
-                    FROM
-                        VWCPTIT_BI
-                    WHERE condicao_fatura = 'Em Atraso'{filtros_adicionais_em_atraso}
-                            ) dados
-                GROUP BY
-                    codfornecedor,
-                    fornecedor
-                ORDER BY
-                    SUM(vlrsaldo) DESC
-        """
-
-        params = params_a_pagar + params_em_atraso
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
 
-
-        cur.execute(query, tuple(params))
+        query, params = montar_query_a_pagar_fornecedor(consulta)
+        await cur.execute(query, tuple(params))
 
                 # Dicionário para armazenar os dados organizados por cliente
         dados = {}
 
-        for row in cur.fetchall():
+        for row in await cur.fetchall():
             codfornecedor = str(row[0]) if row[0] is not None else None
             fornecedor = str(row[1]) if row[1] is not None else None
             a_pagar = float(row[2]) if row[2] is not None else 0.0
@@ -2303,96 +1687,104 @@ async def get_a_pagar_fornecedor(
         
         return dados
 
+# Ordenação estável da tabela de contas a pagar: as expressões do GROUP BY (expressão, decrescente, tipo, coluna
+# na linha), com o mesmo COALESCE do cursor (ver CHAVES_TABELA_A_RECEBER)
+CHAVES_TABELA_A_PAGAR = [
+    ("datavencto", True, date, 0),
+    ("COALESCE(fornecedor, '')", False, str, 1),
+    ("COALESCE(transacao, '')", False, str, 2),
+    ("COALESCE(conta, '')", False, str, 4),
+]
+
+def montar_query_tabela_a_pagar(consulta: FiltrosBI):
+    """Monta a consulta da tabela de contas a pagar. Retorna (query, params)."""
+    # ← AQUI usa os campos do schema
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+
+    params = []
+
+    params.extend([data_inicio, data_fim])
+
+    # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
+    filtros_externos, _ = compilar_filtros(consulta, COLUNAS_CPTIT, params=params)
+
+    # Paginação por keyset: continua após a última linha da página anterior
+    # (o predicado usa só colunas do GROUP BY, então pode filtrar antes do agrupamento)
+    limite, filtro_pagina, params_pagina = paginar(consulta, "tabela_a_pagar", CHAVES_TABELA_A_PAGAR)
+    filtros_externos += filtro_pagina
+    params.extend(params_pagina)
+
+    query = f"""
+        SELECT
+            datavencto,
+            MAX(fornecedor),
+            MAX(transacao),
+            SUM(vlrsaldo),
+            MAX(conta)
+        FROM
+            vwcptit_bi
+            WHERE datavencto >= ? AND datavencto <= ?{filtros_externos}
+        GROUP BY {agrupamento(CHAVES_TABELA_A_PAGAR)}
+        ORDER BY
+            datavencto DESC
+    """
+
+    # Uma linha além do limite indica se existe próxima página
+    if limite:
+        query = query[:query.index("ORDER BY")] + ordem_keyset(CHAVES_TABELA_A_PAGAR)
+        query = query.replace("SELECT", "SELECT FIRST ?", 1)
+        params.insert(0, limite + 1)
+
+    return query, params
+
+def linha_tabela_a_pagar(row) -> dict:
+    return {
+        "datavencto": str(row[0]) if row[0] is not None else None,
+        "fornecedor": str(row[1]) if row[1] is not None else None,
+        "transacao": str(row[2]) if row[2] is not None else None,
+        "a_pagar": float(row[3]) if row[3] is not None else 0.0,
+        "conta": str(row[4]) if row[4] is not None else None
+    }
+
 @router.post("/bi/tabela_a_pagar", tags=["BI"], response_model=List[TabelaAPagar], status_code=status.HTTP_200_OK)
 async def get_tabela_a_pagar(
+    request: Request,
+    response: Response,
     consulta: FiltrosBI = FiltrosBI(),
-    token: str = Depends(oauth2_scheme)
+    payload: dict = Depends(get_token_payload)
 ):
 
     """
     Consulta tabela de a pagar usando POST com schema de entrada.
     Permite consultas mais complexas no futuro.
     """
-    # Verifica o token
-    payload = decode_access_token(token)
     idempresa = payload.get("empresa")
 
     if not idempresa:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID da empresa não encontrado no token")
     
-    # Obtém os dados de conexão do Firebird
-    conn_data = await get_firebird_connection_data(idempresa)
-
-    # Usa o context manager para gerenciar a conexão automaticamente
-    with firebird_connection_manager(conn_data['ipbd'], conn_data['portabd'], conn_data['caminhobd']) as (con, cur):
-
-        # ← AQUI usa os campos do schema
-        data_fim = consulta.data_fim or date.today()
-        data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
-
-        query= """
-            SELECT
-                datavencto,
-                fornecedor,
-                transacao,
-                SUM(vlrsaldo),
-                conta
-            FROM
-                vwcptit_bi
-                WHERE datavencto >= ? AND datavencto <= ?
-            GROUP BY
-                datavencto,
-                fornecedor,
-                transacao,
-                conta
-            ORDER BY
-                datavencto DESC
-        """
-
-        params = []
-
-        # Aplicar filtros no WHERE externo (mesma lógica dos outros endpoints)
-        filtros_externos = ""
-        
-        params.extend([data_inicio, data_fim])
-        
-        # Normalizar filtros
-        codfornecedor = normalize_filter(consulta.codfornecedor)
-        codtransacao = normalize_filter(consulta.codtransacao)
-
-        # Aplicar filtros por filial
-        if codfornecedor:
-            placeholders_fornecedor = ', '.join(['?'] * len(codfornecedor))
-            filtros_externos += f" AND codfornecedor IN ({placeholders_fornecedor})"
-            params.extend(codfornecedor)
-
-        # Aplicar filtros por cliente
-        if codtransacao:
-            placeholders_transacao = ', '.join(['?'] * len(codtransacao))
-            filtros_externos += f" AND codtransacao IN ({placeholders_transacao})"
-            params.extend(codtransacao)
-
-
-
-        # Inserir filtros no WHERE externo
-        query = query.replace(
-            "WHERE datavencto >= ? AND datavencto <= ?",
-            f"WHERE datavencto >= ? AND datavencto <= ?{filtros_externos}"
-        )
-
-        cur.execute(query, tuple(params))
-                     # Combina os resultados
-        dados = [
-            {
-                "datavencto": str(row[0]) if row[0] is not None else None,
-                "fornecedor": str(row[1]) if row[1] is not None else None,
-                "transacao": str(row[2]) if row[2] is not None else None,
-                "a_pagar": float(row[3]) if row[3] is not None else 0.0,
-                "conta": str(row[4]) if row[4] is not None else None
-            }
-            for row in cur.fetchall()
-        ]
-              
+    query, params = montar_query_tabela_a_pagar(consulta)
+    limite = limite_pagina(consulta)
+    pagina = (limite, "tabela_a_pagar", CHAVES_TABELA_A_PAGAR) if limite else None
+
+    # Modo streaming (Accept: application/x-ndjson ou text/csv): envia as linhas em lotes
+    formato = formato_streaming(request)
+    if formato:
+        return await stream_consulta_empresa(idempresa, query, params, linha_tabela_a_pagar, TabelaAPagar, formato, pagina)
+
+    # Obtém a conexão Firebird da empresa, respeitando o limite de consultas simultâneas
+    async with firebird_empresa_connection_manager(idempresa) as (con, cur):
+        await cur.execute(query, tuple(params))
+        rows = await cur.fetchall()
+
+        # Consulta paginada: o cursor da próxima página vai no header da resposta
+        if pagina:
+            rows, proximo = fatiar_pagina(rows, *pagina)
+            if proximo:
+                response.headers[HEADER_PROXIMO_CURSOR] = proximo
+
+        dados = [linha_tabela_a_pagar(row) for row in rows]
 
         if not dados:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dado encontrado")
@@ -7,6 +7,7 @@ from app.models.empresaModel import tbempresa
 from app.schemas.empresaSchemas import EmpresaRetorno, EmpresaCadastro
 from fastapi.security import OAuth2PasswordBearer
 from app.auth.auth import decode_access_token
+from app.db.cacheempresas import invalidar_empresa, notificar_alteracao_empresa
 
 router = APIRouter()
 
@@ -96,7 +97,10 @@ async def put_empresa(codempresa: int, empresa: EmpresaCadastro, token: str = De
         raise HTTPException(status_code=404, detail="Empresa não encontrada")
     for var, value in empresa.dict().items():
         setattr(empresaatual, var, value)
+    # Avisa os workers para descartarem os dados de conexão em cache
+    await notificar_alteracao_empresa(db, codempresa)
     await db.commit()
+    invalidar_empresa(codempresa)
     return empresaatual
 
 @router.delete("/empresas/{codempresa}", tags=["Empresas"], status_code=status.HTTP_204_NO_CONTENT)
@@ -115,5 +119,7 @@ async def delete_empresa(codempresa: int, token: str = Depends(oauth2_scheme), d
         raise HTTPException(status_code=404, detail="Empresa não encontrada")
     else:
         await db.delete(empresa)
+        await notificar_alteracao_empresa(db, codempresa)
         await db.commit()
+        invalidar_empresa(codempresa)
         return None
\ No newline at end of file
@@ -3,12 +3,41 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.db.conexaopg import get_db
 from app.models.usurioModel import tbusuario
-from app.schemas.usuarioSchemas import UsuarioLogin, UsuarioLoginRet
-from app.auth.auth import verify_password, create_access_token
+from app.models.empresaModel import tbempresa
+from datetime import timedelta
+from app.schemas.usuarioSchemas import UsuarioLogin, UsuarioLoginRet, RefreshTokenBody
+from app.auth.senhas import verificar_senha
+from app.auth.auth import (
+    create_access_token,
+    create_refresh_token,
+    decode_refresh_token,
+    revogar_refresh_token,
+    REFRESH_ACCESS_TOKEN_EXPIRE_MINUTES,
+)
 
 
 router = APIRouter()
 
+# Valores de usuarioativo/ativa que indicam cadastro desativado (nulo conta como ativo,
+# como sempre foi no login)
+VALORES_INATIVO = {"N", "NAO", "NÃO", "I", "INATIVO", "INATIVA", "0", "F", "FALSE"}
+
+def cadastro_ativo(valor) -> bool:
+    if valor is None:
+        return True
+    return str(valor).strip().upper() not in VALORES_INATIVO
+
+def claims_usuario(user: tbusuario) -> dict:
+    """Claims do access/refresh token montadas a partir do cadastro do usuário"""
+    return {
+        "sub": str(user.codempresa),
+        "nomeusuario": user.nomeusuario,
+        "codusuario": str(user.codusuario),
+        "ativo": user.usuarioativo,
+        "empresa": str(user.codempresa),
+        "cpfUsuario": user.cpfusuario,
+        }
+
 @router.post("/login", tags=["Login"], response_model=UsuarioLoginRet, status_code=status.HTTP_202_ACCEPTED)
 async def login(request: Request ,usuario: UsuarioLogin, db: AsyncSession = Depends(get_db)):
 
@@ -17,16 +46,62 @@ async def login(request: Request ,usuario: UsuarioLogin, db: AsyncSession = Depe
     result = await db.execute(select(tbusuario).where(tbusuario.cpfusuario == usuario.cpfusuario))
     user = result.scalars().first()
 
-    if not user or not verify_password(usuario.senhausuario, user.senhausuario):
+    # bcrypt roda no pool de processos para não travar o event loop
+    senha_valida, novo_hash = (False, None)
+    if user:
+        senha_valida, novo_hash = await verificar_senha(usuario.senhausuario, user.senhausuario)
+
+    if not senha_valida:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuário ou senha incorretos")
 
+    # Hash gerado com parâmetros antigos (ex.: BCRYPT_ROUNDS aumentado): substitui pelo atual
+    if novo_hash:
+        try:
+            user.senhausuario = novo_hash
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"Erro ao atualizar o hash da senha do usuário {user.codusuario}: {e}")
+
     # Gera o token JWT
-    access_token = create_access_token(data={
-        "sub": str(user.codempresa),
-        "nomeusuario": user.nomeusuario,
-        "codusuario": str(user.codusuario),
-        "ativo": user.usuarioativo,
-        "empresa": str(user.codempresa),
-        "cpfUsuario": user.cpfusuario,
-        })
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    claims = claims_usuario(user)
+    access_token = create_access_token(data=claims)
+    refresh_token = create_refresh_token(data=claims)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@router.post("/refresh", tags=["Login"], response_model=UsuarioLoginRet)
+async def refresh(body: RefreshTokenBody, db: AsyncSession = Depends(get_db)):
+    # Renova os tokens sem bcrypt, mas confere se o usuário e a empresa continuam cadastrados e ativos
+    payload = await decode_refresh_token(body.refresh_token)
+    invalido = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuário ou empresa inativos")
+    try:
+        codusuario = int(payload.get("codusuario"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token inválido")
+
+    result = await db.execute(select(tbusuario).where(tbusuario.codusuario == codusuario))
+    user = result.scalars().first()
+    if not user or not cadastro_ativo(user.usuarioativo):
+        raise invalido
+    result = await db.execute(select(tbempresa.ativa).where(tbempresa.codempresa == user.codempresa))
+    empresa = result.first()
+    if not empresa or not cadastro_ativo(empresa.ativa):
+        raise invalido
+
+    # Rotação: o refresh token recebido só pode ser usado uma vez
+    if not await revogar_refresh_token(payload):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revogado")
+
+    claims = claims_usuario(user)
+    access_token = create_access_token(
+        data=claims,
+        expires_delta=timedelta(minutes=REFRESH_ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    refresh_token = create_refresh_token(data=claims)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@router.post("/logout", tags=["Login"], status_code=status.HTTP_204_NO_CONTENT)
+async def logout(body: RefreshTokenBody):
+    # Revoga o refresh token; os access tokens já emitidos valem até expirar
+    payload = await decode_refresh_token(body.refresh_token)
+    await revogar_refresh_token(payload)
\ No newline at end of file
@@ -5,7 +5,8 @@ from sqlalchemy.future import select
 from app.db.conexaopg import get_db
 from app.models.usurioModel import tbusuario
 from app.schemas.usuarioSchemas import UsuarioRetorno, UsuarioCadastro, UsuarioAtualizacao
-from app.auth.auth import get_password_hash, decode_access_token 
+from app.auth.senhas import gerar_hash_senha
+from app.auth.auth import decode_access_token 
 from fastapi.security import OAuth2PasswordBearer
 from app.utils.util import ValidaCPF
 
@@ -76,7 +77,7 @@ async def create_usuario(usuario: UsuarioCadastro, token: str = Depends(oauth2_s
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Usuário já cadastrado!")
 
     # Hash da senha antes de salvar
-    hashed_password = get_password_hash(usuario.senhausuario)
+    hashed_password = await gerar_hash_senha(usuario.senhausuario)
 
     # Criando novo usuário
     new_usuario = tbusuario(
@@ -121,7 +122,7 @@ async def update_usuario(cpfusuario: str, user_update: UsuarioAtualizacao, token
     for var, value in user_update.dict(exclude_unset=True).items():
         if var == "senhausuario":
             # Hash da senha antes de atualizar
-            value = get_password_hash(value)
+            value = await gerar_hash_senha(value)
         setattr(usuario, var, value)
 
     db.add(usuario)  # Adiciona o usuário atualizado ao banco de dados
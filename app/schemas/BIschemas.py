@@ -1,5 +1,5 @@
 from pydantic import BaseModel, RootModel, Field
-from typing import Optional, Dict, List, Union
+from typing import Optional, Dict, List, Union, Literal
 from datetime import date
 
 
@@ -22,14 +22,16 @@ class FiltrosBI(BaseModel):
     
     regiao: Optional[Union[List[str], str]] = Field(None, description="Nome(s) da região")
 
-<<<<<<< Updated upstream
     # Filtros cptit
     codfornecedor: Optional[Union[List[str], str]] = Field(None, description="Código(s) do fornecedor")
     codtransacao: Optional[Union[List[int], int]] = Field(None, description="Código(s) da transação")
-=======
-    class Config:
-        orm_mode = True  
->>>>>>> Stashed changes
+
+    # Período de comparação dos big numbers
+    comparacao: Optional[Literal["ano_anterior", "periodo_anterior", "mes_anterior"]] = Field(None, description="Período de comparação (padrão: ano_anterior)")
+
+    # Paginação por keyset das tabelas (opcional)
+    limite: Optional[int] = Field(None, ge=1, le=5000, description="Quantidade de linhas por página")
+    cursor: Optional[str] = Field(None, description="Cursor da próxima página (header X-Proximo-Cursor da resposta anterior)")
 
 # Schema para resposta (saída) 
 class BigNumbers(BaseModel):
@@ -196,3 +198,47 @@ class TabelaAPagar(BaseModel):
     transacao: str
     a_pagar: float
     conta: str
+
+class StatusFilaBI(BaseModel):
+    codempresa: str
+    max_consultas: int
+    max_fila: int
+    em_execucao: int
+    na_fila: int
+    admitidas: int
+    rejeitadas: int
+    timeouts: int
+    espera_media_ms: float
+    espera_max_ms: float
+    ultima_espera_ms: float
+
+class StatusPoolFirebird(BaseModel):
+    min: int
+    max: int
+    livres: int
+    em_uso: int
+    criadas: int
+    descartadas: int
+    checkouts: int
+    falhas_liveness: int
+    esperas: int
+    statements: int
+    statements_hits: int
+    statements_misses: int
+    prepare_medio_ms: float
+
+class StatusCacheBI(BaseModel):
+    itens: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    bypass: int
+    removidos: int
+    agrupadas: int
+    em_andamento: int
+
+class MonitorBI(BaseModel):
+    fila: Optional[StatusFilaBI] = None
+    pool: StatusPoolFirebird
+    cache: Optional[StatusCacheBI] = None
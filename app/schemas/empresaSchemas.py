@@ -12,6 +12,8 @@ class EmpresaRetorno(BaseModel):
     ipbd: str = None
     caminhobd: str = None
     ativa: str = None
+    maxconsultasbd: Optional[int] = None
+    maxfilabd: Optional[int] = None
     datadesativacao: date = None
     datacadastro: date = None
 
@@ -28,6 +30,8 @@ class EmpresaCadastro(BaseModel):
     ipbd: str 
     caminhobd: str = None
     ativa: str 
+    maxconsultasbd: Optional[int] = None
+    maxfilabd: Optional[int] = None
    
     class Config:
         orm_mode = True
@@ -37,6 +37,11 @@ class UsuarioAtualizacao(BaseModel):
 #Modelo de Body para Login de Usuarios
 class UsuarioLoginRet(BaseModel):
     access_token: str  
+    refresh_token: Optional[str] = None
+
+#modelo de Body para renovar o token ou encerrar a sessão
+class RefreshTokenBody(BaseModel):
+    refresh_token: str
 
 #modelo de Body para Login de Usuarios
 class UsuarioLogin(BaseModel):
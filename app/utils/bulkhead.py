@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Limites padrão por empresa (sobrescritos pelas colunas de tbempresas)
+BI_MAX_CONSULTAS = int(os.getenv("BI_MAX_CONSULTAS", "4"))
+BI_MAX_FILA = int(os.getenv("BI_MAX_FILA", "8"))
+BI_TIMEOUT_FILA = float(os.getenv("BI_TIMEOUT_FILA", "15"))  # segundos
+
+class TenantBulkhead:
+    """Limita as consultas Firebird simultâneas de uma empresa, com fila de espera limitada"""
+
+    def __init__(self, codempresa: str, max_consultas: int, max_fila: int):
+        self.codempresa = codempresa
+        self.max_consultas = max_consultas
+        self.max_fila = max_fila
+        self.em_execucao = 0
+        self.na_fila = 0
+        self._cond = asyncio.Condition()
+
+        # Estatísticas
+        self.admitidas = 0
+        self.rejeitadas = 0
+        self.timeouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.ultima_espera = 0.0
+
+    def ajustar_limites(self, max_consultas: int, max_fila: int):
+        """Atualiza os limites quando a configuração da empresa muda"""
+        aumentou = max_consultas > self.max_consultas
+        self.max_consultas = max_consultas
+        self.max_fila = max_fila
+        if aumentou:
+            asyncio.ensure_future(self._notificar_todos())
+
+    async def _notificar_todos(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def reservar(self, timeout: float = BI_TIMEOUT_FILA):
+        """Reserva uma vaga de execução; 429 com fila cheia, 503 se a espera estourar"""
+        inicio = time.monotonic()
+        async with self._cond:
+            if self.em_execucao >= self.max_consultas:
+                if self.na_fila >= self.max_fila:
+                    self.rejeitadas += 1
+                    raise HTTPException(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail="Limite de consultas simultâneas da empresa atingido",
+                        headers={"Retry-After": "1"},
+                    )
+                self.na_fila += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self.em_execucao < self.max_consultas),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Tempo esgotado aguardando vaga para consulta da empresa",
+                        headers={"Retry-After": "5"},
+                    )
+                finally:
+                    self.na_fila -= 1
+            self.em_execucao += 1
+
+        espera = time.monotonic() - inicio
+        self.admitidas += 1
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        self.ultima_espera = espera
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.em_execucao -= 1
+                self._cond.notify()
+
+    def stats(self) -> dict:
+        return {
+            "codempresa": self.codempresa,
+            "max_consultas": self.max_consultas,
+            "max_fila": self.max_fila,
+            "em_execucao": self.em_execucao,
+            "na_fila": self.na_fila,
+            "admitidas": self.admitidas,
+            "rejeitadas": self.rejeitadas,
+            "timeouts": self.timeouts,
+            "espera_media_ms": (self.espera_total / self.admitidas) * 1000 if self.admitidas else 0.0,
+            "espera_max_ms": self.espera_max * 1000,
+            "ultima_espera_ms": self.ultima_espera * 1000,
+        }
+
+
+# Bulkheads por empresa
+_bulkheads = {}
+
+def get_bulkhead(codempresa, max_consultas: int = None, max_fila: int = None) -> TenantBulkhead:
+    """Retorna o bulkhead da empresa, aplicando os limites configurados (ou os padrões)"""
+    codempresa = str(codempresa)
+    max_consultas = max_consultas or BI_MAX_CONSULTAS
+    max_fila = max_fila if max_fila is not None else BI_MAX_FILA
+
+    bulkhead = _bulkheads.get(codempresa)
+    if bulkhead is None:
+        bulkhead = TenantBulkhead(codempresa, max_consultas, max_fila)
+        _bulkheads[codempresa] = bulkhead
+    elif bulkhead.max_consultas != max_consultas or bulkhead.max_fila != max_fila:
+        bulkhead.ajustar_limites(max_consultas, max_fila)
+    return bulkhead
+
+def get_bulkhead_stats(codempresa=None) -> list:
+    """Estatísticas dos bulkheads (de uma empresa ou de todas)"""
+    if codempresa is not None:
+        bulkhead = _bulkheads.get(str(codempresa))
+        return [bulkhead.stats()] if bulkhead else []
+    return [bulkhead.stats() for bulkhead in _bulkheads.values()]
@@ -0,0 +1,213 @@
+import asyncio
+import functools
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache das respostas dos endpoints de BI (por processo)
+BI_CACHE_TTL = float(os.getenv("BI_CACHE_TTL", "300"))  # segundos, quando o endpoint não define o seu
+BI_CACHE_MAX_BYTES = int(os.getenv("BI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # orçamento total de memória
+BI_CACHE_ATIVO = os.getenv("BI_CACHE_ATIVO", "1") not in ("0", "false", "False")
+# Requisições idênticas simultâneas aguardam uma única consulta ao Firebird
+BI_AGRUPAR_CONSULTAS = os.getenv("BI_AGRUPAR_CONSULTAS", "1") not in ("0", "false", "False")
+
+# Header de resposta que indica se veio do cache (HIT), da consulta (MISS), se o cache foi
+# ignorado (BYPASS) ou se aguardou a consulta idêntica já em andamento (COALESCED)
+HEADER_CACHE = "X-Cache"
+
+# Campos do FiltrosBI que não alteram o resultado dos agregados
+CAMPOS_FORA_DA_CHAVE = {"limite", "cursor"}
+
+
+class CacheBI:
+    """Respostas JSON já serializadas, com validade por entrada, orçamento de bytes e remoção LRU"""
+
+    def __init__(self, max_bytes: int = BI_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._itens = OrderedDict()  # chave -> (expira_em, conteudo)
+
+        # Estatísticas
+        self.hits = 0
+        self.misses = 0
+        self.bypass = 0
+        self.removidos = 0
+        self.agrupadas = 0
+
+    def obter(self, chave):
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        expira_em, conteudo = item
+        if expira_em <= time.monotonic():
+            self._remover(chave)
+            return None
+        self._itens.move_to_end(chave)
+        return conteudo
+
+    def guardar(self, chave, conteudo: bytes, ttl: float):
+        tamanho = len(conteudo)
+        # Uma resposta maior que 1/8 do orçamento expulsaria boa parte do cache: não guarda
+        if tamanho > self.max_bytes // 8:
+            return
+        if chave in self._itens:
+            self._remover(chave)
+        self._itens[chave] = (time.monotonic() + ttl, conteudo)
+        self.bytes += tamanho
+        while self.bytes > self.max_bytes and self._itens:
+            self._remover(next(iter(self._itens)))
+            self.removidos += 1
+
+    def _remover(self, chave):
+        _, conteudo = self._itens.pop(chave)
+        self.bytes -= len(conteudo)
+
+    def invalidar_empresa(self, codempresa=None):
+        """Remove as respostas da empresa (ou todas, se não informada)"""
+        for chave in [chave for chave in self._itens if codempresa is None or chave[0] == str(codempresa)]:
+            self._remover(chave)
+
+    def stats(self) -> dict:
+        return {
+            "itens": len(self._itens),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypass": self.bypass,
+            "removidos": self.removidos,
+            "agrupadas": self.agrupadas,
+            "em_andamento": len(_em_andamento),
+        }
+
+cache_bi_respostas = CacheBI()
+
+_em_andamento = {}  # chave -> Future da consulta em andamento (resposta serializada)
+
+
+def chave_filtros(consulta, excluir=()) -> str:
+    """
+    Forma canônica dos filtros: sem campos nulos ou vazios, valor único igual a lista
+    de um elemento e listas sem repetição e ordenadas (o IN não depende da ordem).
+    """
+    if consulta is None:
+        return ""
+    filtros = {}
+    for campo, valor in consulta.model_dump(mode="json", exclude_none=True, exclude=CAMPOS_FORA_DA_CHAVE | set(excluir)).items():
+        if isinstance(valor, list):
+            valor = sorted(set(valor))
+            if not valor:
+                continue
+        else:
+            valor = [valor]
+        filtros[campo] = valor
+    return json.dumps(filtros, sort_keys=True, separators=(",", ":"))
+
+def _pede_sem_cache(request: Request) -> bool:
+    """Cache-Control: no-cache (ou no-store) força a consulta e atualiza o cache"""
+    diretivas = request.headers.get("cache-control", "").lower()
+    return "no-cache" in diretivas or "no-store" in diretivas
+
+async def _consulta_compartilhada(chave, consultar):
+    """
+    Executa `consultar()` uma única vez por chave entre as requisições simultâneas.
+    Retorna (conteudo, agrupada); todas recebem o mesmo resultado ou o mesmo erro.
+    """
+    carga = _em_andamento.get(chave)
+    agrupada = carga is not None
+    if agrupada:
+        cache_bi_respostas.agrupadas += 1
+    else:
+        carga = asyncio.ensure_future(consultar())
+        _em_andamento[chave] = carga
+        carga.add_done_callback(lambda _: _encerrar_consulta(chave, carga))
+    # shield: a desconexão de um cliente não cancela a consulta dos demais
+    return await asyncio.shield(carga), agrupada
+
+def _encerrar_consulta(chave, carga):
+    if _em_andamento.get(chave) is carga:
+        del _em_andamento[chave]
+    # Evita o aviso de exceção não lida quando todos os clientes desistiram
+    if not carga.cancelled():
+        carga.exception()
+
+def cache_bi(modelo, ttl: float = None):
+    """
+    Decorator dos endpoints de BI: guarda a resposta serializada por
+    (empresa, endpoint, filtros canônicos, data atual) durante `ttl` segundos.
+    Sem resposta em cache, requisições idênticas simultâneas aguardam a mesma consulta.
+    `modelo` é o response_model da rota, usado para serializar o resultado.
+    O endpoint precisa receber `payload` (e, se tiver filtros, `consulta`).
+    """
+    adaptador = TypeAdapter(modelo)
+    validade = BI_CACHE_TTL if ttl is None else ttl
+
+    def decorator(func):
+        assinatura = inspect.signature(func)
+        nome_request = next(
+            (nome for nome, parametro in assinatura.parameters.items() if parametro.annotation is Request),
+            None,
+        )
+        parametros = list(assinatura.parameters.values())
+        if nome_request is None:
+            # O FastAPI injeta o Request pelo tipo; o parâmetro extra não é repassado ao endpoint
+            nome_request = "_request_cache_bi"
+            parametros.append(inspect.Parameter(nome_request, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs[nome_request]
+            if nome_request == "_request_cache_bi":
+                del kwargs[nome_request]
+
+            if not BI_CACHE_ATIVO and not BI_AGRUPAR_CONSULTAS:
+                return await func(*args, **kwargs)
+
+            # A data atual entra na chave: sem data_fim os endpoints consultam até hoje
+            chave = (
+                str(kwargs["payload"].get("empresa")),
+                request.url.path,
+                chave_filtros(kwargs.get("consulta")),
+                date.today().isoformat(),
+            )
+
+            if not BI_CACHE_ATIVO:
+                situacao = "MISS"
+            elif _pede_sem_cache(request):
+                cache_bi_respostas.bypass += 1
+                situacao = "BYPASS"
+            else:
+                conteudo = cache_bi_respostas.obter(chave)
+                if conteudo is not None:
+                    cache_bi_respostas.hits += 1
+                    return Response(content=conteudo, media_type="application/json", headers={HEADER_CACHE: "HIT"})
+                cache_bi_respostas.misses += 1
+                situacao = "MISS"
+
+            async def consultar():
+                resultado = await func(*args, **kwargs)
+                conteudo = adaptador.dump_json(adaptador.validate_python(resultado))
+                if BI_CACHE_ATIVO:
+                    cache_bi_respostas.guardar(chave, conteudo, validade)
+                return conteudo
+
+            if not BI_AGRUPAR_CONSULTAS:
+                conteudo = await consultar()
+            else:
+                conteudo, agrupada = await _consulta_compartilhada(chave, consultar)
+                if agrupada:
+                    situacao = "COALESCED"
+            return Response(content=conteudo, media_type="application/json", headers={HEADER_CACHE: situacao})
+
+        wrapper.__signature__ = assinatura.replace(parameters=parametros)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,128 @@
+# Filtros do FiltrosBI nas consultas Firebird do BI. Cada visão tem o seu mapa campo -> coluna
+# (por exemplo, `dia` é dia_recbto em VWFACTRC_BI e dia_emissao em VWFRCTRC_BI) e o SQL gerado
+# tem forma canônica: campos na ordem do mapa, valores sem repetição e ordenados, listas do IN
+# completadas até o próximo tamanho de TAMANHOS_IN repetindo o último valor. Poucos textos SQL
+# distintos = statements preparados reaproveitados pelo Firebird.
+# Listas maiores que BI_LIMITE_IN_LIST não são expandidas no IN: os valores vão para a tabela
+# temporária TMP_BI_FILTRO (app/views/tmp_bi_filtro.sql) no execute e o filtro vira subconsulta.
+
+import hashlib
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tamanhos das listas do IN; acima do último, múltiplos dele
+TAMANHOS_IN = (1, 4, 16, 64)
+
+# Acima desta quantidade de valores distintos o filtro usa a TMP_BI_FILTRO (0 = sempre inline).
+# Desligado até a tabela existir nos bancos dos clientes; o ponto de corte sai do benchmark_in_list.py
+BI_LIMITE_IN_LIST = int(os.getenv("BI_LIMITE_IN_LIST", "0"))
+
+INSERT_LISTA_TEMPORARIA = "INSERT INTO TMP_BI_FILTRO (lista, valor_num, valor_txt) VALUES (?, ?, ?)"
+
+# Faturas recebidas (datas pela datarecbto)
+COLUNAS_FACTRC = {
+    "codfilial": "codfilial",
+    "codcliente": "codcliente",
+    "codcid": "codcid",
+    "regiao": "regiao",
+    "codpro": "codpro",
+    "ano": "ano_recbto",
+    "mes": "mes_numero",
+    "dia": "dia_recbto",
+}
+
+# Conhecimentos emitidos (datas pela dataemissao)
+COLUNAS_FRCTRC = {
+    "codfilial": "codfilial",
+    "codcliente": "codcliente",
+    "codcid": "codcid",
+    "regiao": "regiao",
+    "codpro": "codpro",
+    "ano": "ano_emissao",
+    "mes": "mes_numero",
+    "dia": "dia_emissao",
+}
+
+# Contas a receber e a pagar
+COLUNAS_CRTIT = {
+    "codfilial": "codfilial",
+    "codcliente": "codcliente",
+}
+COLUNAS_CPTIT = {
+    "codfornecedor": "codfornecedor",
+    "codtransacao": "codtransacao",
+}
+
+
+class ListaTemporaria:
+    """
+    Parâmetro de um filtro com lista grande. No execute, o cursor grava os valores na
+    TMP_BI_FILTRO (uma vez por transação) e passa o identificador da lista no lugar dele
+    """
+
+    def __init__(self, valores: list):
+        self.valores = valores
+        # Mesma lista (ex.: ramos do UNION ALL, comparação com o período anterior) = mesmo id
+        self.id = hashlib.md5(repr(valores).encode()).hexdigest()
+
+    @property
+    def coluna(self) -> str:
+        return "valor_txt" if isinstance(self.valores[0], str) else "valor_num"
+
+    def linhas(self) -> list:
+        """Registros do INSERT_LISTA_TEMPORARIA"""
+        if self.coluna == "valor_txt":
+            return [(self.id, None, valor) for valor in self.valores]
+        return [(self.id, valor, None) for valor in self.valores]
+
+
+def tamanho_in(quantidade: int) -> int:
+    """Tamanho da lista do IN para `quantidade` valores distintos"""
+    for tamanho in TAMANHOS_IN:
+        if quantidade <= tamanho:
+            return tamanho
+    maior = TAMANHOS_IN[-1]
+    return -(-quantidade // maior) * maior
+
+def valores_distintos(valor) -> list:
+    """Valores do filtro sem repetição e ordenados"""
+    if valor is None:
+        return []
+    return sorted(set(valor if isinstance(valor, list) else [valor]))
+
+def valores_in(valor) -> list:
+    """Valores do filtro sem repetição, ordenados e completados até o tamanho do IN"""
+    valores = valores_distintos(valor)
+    if not valores:
+        return []
+    return valores + [valores[-1]] * (tamanho_in(len(valores)) - len(valores))
+
+def clausula_in(coluna: str, valor, params: list) -> str:
+    """
+    ` AND coluna IN (?, ...)` com os valores acrescentados em `params` ("" sem valores).
+    Acima de BI_LIMITE_IN_LIST valores, subconsulta na TMP_BI_FILTRO com um ListaTemporaria
+    """
+    distintos = valores_distintos(valor)
+    if 0 < BI_LIMITE_IN_LIST < len(distintos):
+        lista = ListaTemporaria(distintos)
+        params.append(lista)
+        return f" AND {coluna} IN (SELECT {lista.coluna} FROM TMP_BI_FILTRO WHERE lista = ?)"
+    valores = valores_in(valor)
+    if not valores:
+        return ""
+    params.extend(valores)
+    return f" AND {coluna} IN ({', '.join(['?'] * len(valores))})"
+
+def compilar_filtros(consulta, colunas: dict, campos=None, params: list = None):
+    """
+    Filtros ` AND ... IN (...)` dos `campos` (padrão: todos os do mapa) para as `colunas`
+    da visão. Retorna (sql, params); os valores são acrescentados a `params` se informado.
+    """
+    params = [] if params is None else params
+    sql = ""
+    for campo, coluna in colunas.items():
+        if campos is None or campo in campos:
+            sql += clausula_in(coluna, getattr(consulta, campo), params)
+    return sql, params
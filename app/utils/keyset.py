@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+from datetime import date
+from fastapi import HTTPException, status
+
+# Tamanho de página usado quando só o cursor é informado
+BI_LIMITE_PADRAO = 50
+
+# Header com o cursor da próxima página (ausente na última página)
+HEADER_PROXIMO_CURSOR = "X-Proximo-Cursor"
+
+# Cada chave de ordenação é uma tupla (expressao_sql, descendente, tipo, indice_coluna):
+#   expressao_sql  expressão usada no ORDER BY e no predicado de busca
+#   descendente    True para ordem decrescente
+#   tipo           date, int ou str (como o valor é restaurado a partir do cursor)
+#   indice_coluna  posição do valor na linha retornada pela consulta
+
+def limite_pagina(consulta):
+    """Tamanho da página pedida, ou None quando a consulta não é paginada"""
+    if consulta.limite:
+        return consulta.limite
+    if consulta.cursor:
+        return BI_LIMITE_PADRAO
+    return None
+
+def codificar_cursor(endpoint: str, valores: list) -> str:
+    valores = [valor.isoformat() if isinstance(valor, date) else valor for valor in valores]
+    conteudo = json.dumps({"e": endpoint, "v": valores}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(conteudo.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str, endpoint: str, chaves: list) -> list:
+    """Restaura os valores da última linha da página anterior; 400 se o cursor for inválido"""
+    try:
+        conteudo = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        valores = conteudo["v"]
+        if conteudo["e"] != endpoint or len(valores) != len(chaves):
+            raise ValueError("cursor de outra consulta")
+        return [
+            date.fromisoformat(valor) if tipo is date else tipo(valor)
+            for valor, (_, _, tipo, _) in zip(valores, chaves)
+        ]
+    except (ValueError, TypeError, KeyError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginação inválido")
+
+def ordem_keyset(chaves: list) -> str:
+    """Cláusula ORDER BY estável correspondente às chaves"""
+    return "ORDER BY " + ", ".join(
+        f"{expressao} DESC" if descendente else expressao
+        for expressao, descendente, _, _ in chaves
+    )
+
+def agrupamento(chaves: list) -> str:
+    """Expressões do GROUP BY iguais às das chaves (a mesma linha agrupada é a mesma posição no cursor)"""
+    return ", ".join(expressao for expressao, _, _, _ in chaves)
+
+def predicado_keyset(chaves: list, valores: list):
+    """
+    Predicado de busca que posiciona a consulta logo após a última linha da página anterior.
+    O Firebird não tem comparação de linhas, então (a, b) > (x, y) é expandido em
+    a > x OR (a = x AND b > y). Retorna (" AND (...)", params).
+    """
+    termos = []
+    params = []
+    for i, (expressao, descendente, _, _) in enumerate(chaves):
+        iguais = [f"{anterior} = ?" for anterior, _, _, _ in chaves[:i]]
+        comparacao = f"{expressao} {'<' if descendente else '>'} ?"
+        termos.append("(" + " AND ".join(iguais + [comparacao]) + ")")
+        params.extend(valores[:i + 1])
+
+    # Limite redundante na primeira chave para que o índice dela possa ser usado
+    primeira, descendente, _, _ = chaves[0]
+    limite = f"{primeira} {'<=' if descendente else '>='} ?"
+    return f" AND {limite} AND ({' OR '.join(termos)})", [valores[0]] + params
+
+def paginar(consulta, endpoint: str, chaves: list):
+    """
+    Parâmetros da página pedida: (limite, filtro_busca, params_busca).
+    limite é None quando a consulta não é paginada; o filtro só existe a partir da 2ª página.
+    """
+    limite = limite_pagina(consulta)
+    if not limite or not consulta.cursor:
+        return limite, "", []
+    filtro, params = predicado_keyset(chaves, decodificar_cursor(consulta.cursor, endpoint, chaves))
+    return limite, filtro, params
+
+def valores_chave(row, chaves: list) -> list:
+    """Valores das chaves na linha (nulos viram '' como no COALESCE das expressões)"""
+    valores = []
+    for _, _, tipo, indice in chaves:
+        valor = row[indice]
+        if valor is None and tipo is str:
+            valor = ""
+        valores.append(valor)
+    return valores
+
+def fatiar_pagina(rows: list, limite: int, endpoint: str, chaves: list):
+    """
+    Recebe até limite + 1 linhas; devolve as linhas da página e o cursor da próxima
+    (None quando não há mais linhas).
+    """
+    if len(rows) <= limite:
+        return rows, None
+    rows = rows[:limite]
+    return rows, codificar_cursor(endpoint, valores_chave(rows[-1], chaves))
@@ -0,0 +1,81 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from dateutil.relativedelta import relativedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Meses anteriores ao atual que ainda são consultados ao vivo (lançamentos atrasados)
+BI_MESES_REABERTOS = int(os.getenv("BI_MESES_REABERTOS", "1"))
+# Validade (segundos) dos meses fechados guardados: correções anteriores aos meses reabertos
+# aparecem depois deste tempo ou com o NOTIFY de tbempresas_alterada da empresa; 0 = até o processo reiniciar
+BI_MESES_FECHADOS_TTL = float(os.getenv("BI_MESES_FECHADOS_TTL", "21600"))
+# Quantidade máxima de combinações (empresa, filtros) guardadas
+BI_MESES_FECHADOS_MAX = int(os.getenv("BI_MESES_FECHADOS_MAX", "1000"))
+
+def corte_meses_fechados(hoje: date = None) -> date:
+    """Primeiro dia do mês mais antigo ainda consultado ao vivo; os meses anteriores estão fechados"""
+    hoje = hoje or date.today()
+    return hoje.replace(day=1) - relativedelta(months=BI_MESES_REABERTOS)
+
+def mes_da_linha(row):
+    """(ano, mes_numero) da linha agregada, ou None se a linha não tiver mês definido"""
+    if row[0] is None or row[1] is None:
+        return None
+    return int(row[0]), int(row[1])
+
+
+class MesesFechados:
+    """
+    Agregados mensais já fechados por (empresa, filtros), guardados em memória.
+    Cada entrada lembra até onde os meses estão fechados (corte); a consulta ao vivo
+    só precisa ler a partir dele.
+    """
+
+    def __init__(self, max_entradas: int = BI_MESES_FECHADOS_MAX, ttl: float = BI_MESES_FECHADOS_TTL):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # chave -> (criado_em, corte, {(ano, mes): row})
+
+    def obter(self, chave, corte: date):
+        """
+        Retorna (meses_fechados, desde): as linhas guardadas dos meses anteriores a `desde`
+        e a data a partir da qual é preciso consultar ao vivo (None = janela inteira).
+        """
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            return {}, None
+        criado_em, corte_guardado, meses = entrada
+        if self.ttl and criado_em + self.ttl <= time.monotonic():
+            del self._entradas[chave]
+            return {}, None
+        self._entradas.move_to_end(chave)
+        desde = min(corte_guardado, corte)
+        limite = (desde.year, desde.month)
+        return {mes: row for mes, row in meses.items() if mes < limite}, desde
+
+    def guardar(self, chave, corte: date, fechados: dict, rows, inicio_janela: date):
+        """Junta aos meses já fechados as linhas consultadas de meses anteriores ao corte"""
+        limite = (corte.year, corte.month)
+        inicio = (inicio_janela.year, inicio_janela.month)
+        meses = {mes: row for mes, row in fechados.items() if mes >= inicio}
+        for row in rows:
+            mes = mes_da_linha(row)
+            if mes is not None and inicio <= mes < limite:
+                meses[mes] = row
+
+        entrada = self._entradas.get(chave)
+        criado_em = entrada[0] if entrada else time.monotonic()
+        self._entradas[chave] = (criado_em, corte, meses)
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def invalidar_empresa(self, codempresa=None):
+        """Descarta os meses guardados da empresa (ou de todas, se não informada)"""
+        for chave in [chave for chave in self._entradas if codempresa is None or chave[0] == str(codempresa)]:
+            del self._entradas[chave]
+
+meses_fechados_kpi = MesesFechados()
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import os
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Quantidade de linhas lidas do cursor a cada fetchmany no modo streaming
+BI_STREAM_LOTE = int(os.getenv("BI_STREAM_LOTE", "500"))
+
+MEDIA_NDJSON = "application/x-ndjson"
+MEDIA_CSV = "text/csv"
+FORMATOS_STREAMING = (MEDIA_NDJSON, MEDIA_CSV)
+
+def formato_streaming(request: Request):
+    """Retorna o formato de streaming pedido no header Accept (ou None para JSON normal)"""
+    aceita = request.headers.get("accept", "")
+    for item in aceita.split(","):
+        tipo = item.split(";")[0].strip().lower()
+        if tipo in FORMATOS_STREAMING:
+            return tipo
+    return None
+
+def _serializar_lote(linhas, formato: str, colunas: list) -> str:
+    if formato == MEDIA_NDJSON:
+        return "".join(json.dumps(linha, ensure_ascii=False) + "\n" for linha in linhas)
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=colunas, lineterminator="\n")
+    writer.writerows(linhas)
+    return buffer.getvalue()
+
+def resposta_streaming(pilha, cur, converter, formato: str, colunas: list,
+                       lote: int = BI_STREAM_LOTE, linhas: list = None,
+                       headers: dict = None) -> StreamingResponse:
+    """
+    Envia as linhas do cursor (já executado) em lotes de `fetchmany`, convertidas por
+    `converter(row)` em dicts. `pilha` (AsyncExitStack) mantém a conexão aberta até o
+    fim do envio e é fechada ao término, na desconexão do cliente ou em caso de erro.
+    Se `linhas` for informado (página já lida), envia só essas linhas.
+    """
+    async def gerar():
+        try:
+            if formato == MEDIA_CSV:
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator="\n").writerow(colunas)
+                yield buffer.getvalue()
+
+            if linhas is not None:
+                for inicio in range(0, len(linhas), lote):
+                    yield _serializar_lote([converter(row) for row in linhas[inicio:inicio + lote]], formato, colunas)
+                return
+
+            while True:
+                rows = await cur.fetchmany(lote)
+                if not rows:
+                    break
+                yield _serializar_lote([converter(row) for row in rows], formato, colunas)
+        except Exception as e:
+            # A resposta já começou: encerra a conexão com rollback e interrompe o envio
+            await pilha.__aexit__(type(e), e, e.__traceback__)
+            raise
+
+    # Executado pelo StreamingResponse após o envio completo ou a desconexão do cliente
+    return StreamingResponse(
+        gerar(),
+        media_type=formato,
+        headers=headers,
+        background=BackgroundTask(pilha.aclose),
+    )
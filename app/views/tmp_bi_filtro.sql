@@ -0,0 +1,8 @@
+CREATE GLOBAL TEMPORARY TABLE TMP_BI_FILTRO (
+	lista VARCHAR(32) NOT NULL,
+	valor_num BIGINT,
+	valor_txt VARCHAR(60)
+) ON COMMIT DELETE ROWS;
+
+CREATE INDEX IDX_TMP_BI_FILTRO_NUM ON TMP_BI_FILTRO (lista, valor_num);
+CREATE INDEX IDX_TMP_BI_FILTRO_TXT ON TMP_BI_FILTRO (lista, valor_txt);
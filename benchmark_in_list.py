@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos filtros com listas grandes: IN (?, ...) expandido x tabela temporária TMP_BI_FILTRO
+Executa a consulta do kpi_filial filtrando por N clientes nos dois modos, em um banco real, e
+mostra a partir de quantos valores a TMP_BI_FILTRO fica mais rápida (valor para BI_LIMITE_IN_LIST)
+
+Uso: python benchmark_in_list.py HOST PORTA CAMINHO_DO_BANCO [--repeticoes 5] [--dias 365]
+"""
+
+import argparse
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+# O BIRouter cria o engine do Postgres na importação
+for chave, valor in {"PG_USER": "bi", "PG_PASSWORD": "bi", "PG_HOST": "localhost",
+                     "PG_PORT": "5432", "PG_DATABASE": "bi"}.items():
+    os.environ.setdefault(chave, valor)
+
+import app.utils.filtrosbi as filtrosbi
+from app.db.conexaofb import get_firebird_connection, _carregar_listas
+from app.schemas.BIschemas import FiltrosBI
+from app.routers.BIRouter import montar_query_kpi_dimensao
+
+QUANTIDADES = (4, 16, 64, 128, 256, 512, 1024)
+
+# (limite aplicado ao montar a consulta, nome do modo)
+MODOS = ((0, "IN expandido"), (1, "TMP_BI_FILTRO"))
+
+def clientes(cursor, quantidade: int) -> list:
+    cursor.execute(f"SELECT FIRST {quantidade} DISTINCT codcliente FROM VWFACTRC_BI")
+    return [row[0] for row in cursor.fetchall()]
+
+def medir(conn, cursor, query: str, params: list, repeticoes: int):
+    """(prepare em ms, mediana da execução em ms); cada repetição é uma transação, como um request"""
+    inicio = time.perf_counter()
+    stmt = cursor.prepare(query)
+    prepare = (time.perf_counter() - inicio) * 1000
+    tempos = []
+    try:
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            cursor.execute(stmt, _carregar_listas(cursor, params, set()))
+            cursor.fetchall()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            conn.commit()
+    finally:
+        cursor.close()
+        stmt.free()
+    return prepare, statistics.median(tempos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("porta", type=int)
+    parser.add_argument("banco")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--dias", type=int, default=365, help="período consultado")
+    args = parser.parse_args()
+
+    hoje = date.today()
+    conn = get_firebird_connection(args.host, args.porta, args.banco)
+    cursor = conn.cursor()
+    corte = None
+    try:
+        print(f"{'valores':>8} | {'modo':<14} | {'prepare ms':>10} | {'execução ms':>11}")
+        print("-" * 54)
+        for quantidade in QUANTIDADES:
+            valores = clientes(cursor, quantidade)
+            if len(valores) < quantidade:
+                print(f"Só há {len(valores)} clientes na VWFACTRC_BI; parando em {quantidade}")
+                break
+            consulta = FiltrosBI(codcliente=valores)
+            execucao = {}
+            for limite, modo in MODOS:
+                filtrosbi.BI_LIMITE_IN_LIST = limite
+                query, params = montar_query_kpi_dimensao(consulta, "filial", hoje - timedelta(days=args.dias), hoje)
+                prepare, execucao[modo] = medir(conn, cursor, query, params, args.repeticoes)
+                print(f"{quantidade:>8} | {modo:<14} | {prepare:>10.1f} | {execucao[modo]:>11.1f}")
+            if corte is None and execucao["TMP_BI_FILTRO"] < execucao["IN expandido"]:
+                corte = quantidade
+    finally:
+        cursor.close()
+        conn.close()
+
+    print("\n" + "=" * 54)
+    if corte is None:
+        print("O IN expandido foi mais rápido em todas as quantidades: BI_LIMITE_IN_LIST=0")
+    else:
+        print(f"TMP_BI_FILTRO mais rápida a partir de {corte} valores: BI_LIMITE_IN_LIST={corte - 1}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Planos de execução das consultas Firebird dos kpi_filial, kpi_regiao, kpi_cidade e kpi_mes_ano
+Prepara (sem executar) as consultas montadas pelo BIRouter em um banco real e mostra o plano
+de cada uma, indicando os ramos do UNION ALL que leem as tabelas sem índice (NATURAL)
+
+Uso: python plano_consultas_kpi.py HOST PORTA CAMINHO_DO_BANCO [--detalhado]
+"""
+
+import argparse
+import os
+import re
+from datetime import date, timedelta
+
+# O BIRouter cria o engine do Postgres na importação
+for chave, valor in {"PG_USER": "bi", "PG_PASSWORD": "bi", "PG_HOST": "localhost",
+                     "PG_PORT": "5432", "PG_DATABASE": "bi"}.items():
+    os.environ.setdefault(chave, valor)
+
+from app.db.conexaofb import get_firebird_connection, plano_consulta
+from app.schemas.BIschemas import FiltrosBI
+from app.routers.BIRouter import montar_query_kpi_dimensao, montar_query_kpi_mes_ano
+from app.utils.mesesfechados import corte_meses_fechados
+
+HOJE = date.today()
+
+# Mesmos filtros de um dashboard típico: período de 30 dias, uma filial e uma região
+FILTROS = FiltrosBI(codfilial=[1], regiao=["SUL"])
+
+def consultas():
+    inicio = HOJE - timedelta(days=30)
+    for dimensao in ("filial", "regiao", "cidade"):
+        yield f"kpi_{dimensao}", montar_query_kpi_dimensao(FILTROS, dimensao, inicio, HOJE)[0]
+    yield "kpi_mes_ano", montar_query_kpi_mes_ano(FILTROS)[0]
+    yield "kpi_mes_ano (meses abertos)", montar_query_kpi_mes_ano(FILTROS, corte_meses_fechados(HOJE))[0]
+
+def leituras_naturais(plano: str) -> list:
+    """Tabelas lidas por varredura completa no plano clássico"""
+    return re.findall(r"(\w+) NATURAL", plano or "")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("porta", type=int)
+    parser.add_argument("banco")
+    parser.add_argument("--detalhado", action="store_true", help="plano no formato explicado")
+    args = parser.parse_args()
+
+    conn = get_firebird_connection(args.host, args.porta, args.banco)
+    cursor = conn.cursor()
+    sem_indice = 0
+    try:
+        for nome, query in consultas():
+            print("=" * 60)
+            print(nome)
+            print("=" * 60)
+            plano = plano_consulta(cursor, query)
+            print(plano_consulta(cursor, query, detalhado=True) if args.detalhado else plano)
+            naturais = leituras_naturais(plano)
+            if naturais:
+                sem_indice += 1
+                print(f"⚠️  Leitura sem índice: {', '.join(naturais)}")
+            else:
+                print("✅ Todas as leituras usam índice")
+    finally:
+        cursor.close()
+        conn.close()
+
+    print("\n" + "=" * 60)
+    print(f"Consultas com leitura sem índice: {sem_indice}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Teste de regressão das consultas de contas a receber / a pagar do BI
+Compara as consultas antigas (uma por medida / UNION ALL da mesma view) com as
+consultas em leitura única do BIRouter, sobre os mesmos dados em um SQLite em memória
+"""
+
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+# O BIRouter cria o engine do Postgres na importação
+for chave, valor in {"PG_USER": "bi", "PG_PASSWORD": "bi", "PG_HOST": "localhost",
+                     "PG_PORT": "5432", "PG_DATABASE": "bi"}.items():
+    os.environ.setdefault(chave, valor)
+
+from app.schemas.BIschemas import FiltrosBI
+from app.routers.BIRouter import (
+    montar_query_big_numbers_contas_receber,
+    montar_query_a_receber_cliente,
+    montar_query_big_numbers_contas_pagar,
+    montar_query_a_pagar_fornecedor,
+)
+
+HOJE = date.today()
+
+# Consultas antigas, mantidas aqui apenas como referência do resultado esperado
+QUERY_FATURAMENTO_ANTIGA = """
+    SELECT COALESCE(SUM(vlrrecbto), 0) AS faturamento
+    FROM VWFACTRC_BI
+    WHERE datarecbto >= ? AND datarecbto <= ?{filtros}
+"""
+QUERY_A_RECEBER_ANTIGA = """
+    SELECT COALESCE(SUM(vlrsaldo), 0) AS a_receber
+    FROM VWFACTRC_BI
+    WHERE condicao_fatura = 'A Receber'
+      AND datavencto >= ? AND datavencto <= ?{filtros}
+"""
+QUERY_EM_ATRASO_RECEBER_ANTIGA = """
+    SELECT COALESCE(SUM(vlrsaldo), 0) AS em_atraso
+    FROM VWFACTRC_BI
+    WHERE condicao_fatura = 'Em Atraso'{filtros}
+"""
+QUERY_PRAZO_MEDIO_ANTIGA = """
+    SELECT COALESCE(AVG(dias_recebimento), 0) AS prazo_medio
+    FROM VWFACTRC_BI
+    WHERE datarecbto >= ? AND datarecbto <= ?
+      AND dias_recebimento IS NOT NULL{filtros}
+"""
+QUERY_A_RECEBER_CLIENTE_ANTIGA = """
+    SELECT codcliente, cliente, SUM(vlrsaldo)
+    FROM (
+        SELECT cliente, vlrsaldo, codfilial, codcliente, datavencto
+        FROM VWFACTRC_BI
+        WHERE condicao_fatura = 'A Receber' AND datavencto >= ? AND datavencto <= ?{filtros}
+    UNION ALL
+        SELECT cliente, vlrsaldo, codfilial, codcliente, datavencto
+        FROM VWFACTRC_BI
+        WHERE condicao_fatura = 'Em Atraso'{filtros}
+    ) dados
+    GROUP BY codcliente, cliente
+    ORDER BY SUM(vlrsaldo) DESC
+"""
+QUERY_PAGO_ANTIGA = """
+    SELECT COALESCE(SUM(vlrpago), 0) AS pago
+    FROM vwcptit_bi
+    WHERE datamovto >= ? AND datamovto <= ?{filtros}
+"""
+QUERY_A_PAGAR_ANTIGA = """
+    SELECT COALESCE(SUM(vlrsaldo), 0) AS a_pagar
+    FROM vwcptit_bi
+    WHERE condicao_fatura = 'A Pagar'
+      AND datavencto >= ? AND datavencto <= ?{filtros}
+"""
+QUERY_EM_ATRASO_PAGAR_ANTIGA = """
+    SELECT COALESCE(SUM(vlrsaldo), 0) AS em_atraso
+    FROM vwcptit_bi
+    WHERE condicao_fatura = 'Em Atraso'{filtros}
+"""
+QUERY_A_PAGAR_FORNECEDOR_ANTIGA = """
+    SELECT codfornecedor, fornecedor, SUM(vlrsaldo)
+    FROM (
+        SELECT fornecedor, vlrsaldo, codfornecedor, codtransacao, datavencto
+        FROM VWCPTIT_BI
+        WHERE condicao_fatura = 'A Pagar' AND datavencto >= ? AND datavencto <= ?{filtros}
+    UNION ALL
+        SELECT fornecedor, vlrsaldo, codfornecedor, codtransacao, datavencto
+        FROM VWCPTIT_BI
+        WHERE condicao_fatura = 'Em Atraso'{filtros}
+    ) dados
+    GROUP BY codfornecedor, fornecedor
+    ORDER BY SUM(vlrsaldo) DESC
+"""
+
+# Combinações de filtros verificadas
+CONSULTAS = [
+    FiltrosBI(),
+    FiltrosBI(data_inicio=HOJE - timedelta(days=365), data_fim=HOJE),
+    FiltrosBI(data_inicio=HOJE - timedelta(days=90), data_fim=HOJE, codfilial=[1, 2]),
+    FiltrosBI(data_inicio=HOJE - timedelta(days=200), data_fim=HOJE - timedelta(days=20), codcliente=["3", "5"]),
+    FiltrosBI(data_inicio=HOJE - timedelta(days=400), data_fim=HOJE, codfornecedor=["f1", "f4"]),
+    FiltrosBI(data_inicio=HOJE - timedelta(days=120), data_fim=HOJE, codfornecedor=["f2"], codtransacao=[0, 3]),
+]
+
+
+def _data_aleatoria():
+    return HOJE - timedelta(days=random.randint(-40, 800))
+
+def criar_banco():
+    """Cria as views do BI no SQLite com dados aleatórios (semente fixa)"""
+    random.seed(7)
+    banco = sqlite3.connect(":memory:")
+    banco.execute("""
+        CREATE TABLE vwfactrc_bi (codfilial, codcliente, cliente, datavencto, datarecbto,
+                                  dias_recebimento, vlrrecbto, vlrsaldo, condicao_fatura)
+    """)
+    banco.execute("""
+        CREATE TABLE vwcptit_bi (codfornecedor, fornecedor, codtransacao, datamovto, datavencto,
+                                 vlrpago, vlrsaldo, condicao_fatura)
+    """)
+    for i in range(1000):
+        recebimento = _data_aleatoria() if random.random() < 0.8 else None
+        saldo = random.choice([0, round(random.random() * 100, 2)])
+        condicao = "Recebida" if saldo == 0 else random.choice(["A Receber", "Em Atraso"])
+        banco.execute("INSERT INTO vwfactrc_bi VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+            i % 3, str(i % 7), f"cliente {i % 7}", _data_aleatoria().isoformat(),
+            recebimento.isoformat() if recebimento else None,
+            random.randint(0, 60) if recebimento and random.random() < 0.9 else None,
+            round(random.random() * 1000, 2), saldo, condicao,
+        ))
+
+        saldo = random.choice([0, round(random.random() * 100, 2)])
+        condicao = "Pago" if saldo == 0 else random.choice(["A Pagar", "Em Atraso"])
+        banco.execute("INSERT INTO vwcptit_bi VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            f"f{i % 6}", f"fornecedor {i % 6}", i % 4, _data_aleatoria().isoformat(),
+            _data_aleatoria().isoformat(), round(random.random() * 500, 2), saldo, condicao,
+        ))
+    return banco
+
+def _params(params):
+    return tuple(p.isoformat() if isinstance(p, date) else p for p in params)
+
+def _filtros(consulta, campos):
+    """Monta o filtro IN antigo para os campos (nome, valores) informados"""
+    filtros = ""
+    params = []
+    for campo in campos:
+        valores = getattr(consulta, campo)
+        if valores:
+            filtros += f" AND {campo} IN ({', '.join(['?'] * len(valores))})"
+            params.extend(valores)
+    return filtros, params
+
+def _periodo(consulta):
+    data_fim = consulta.data_fim or date.today()
+    data_inicio = consulta.data_inicio or (data_fim - timedelta(days=30))
+    return [data_inicio, data_fim]
+
+def _valor(banco, query, params):
+    return banco.execute(query, _params(params)).fetchone()[0] or 0.0
+
+def _aproximado(a, b):
+    return abs(float(a) - float(b)) < 1e-6
+
+def test_big_numbers_contas_receber():
+    banco = criar_banco()
+    for consulta in CONSULTAS:
+        filtros, params_filtros = _filtros(consulta, ["codfilial", "codcliente"])
+        periodo = _periodo(consulta)
+        esperado = [
+            _valor(banco, QUERY_FATURAMENTO_ANTIGA.format(filtros=filtros), periodo + params_filtros),
+            _valor(banco, QUERY_A_RECEBER_ANTIGA.format(filtros=filtros), periodo + params_filtros),
+            _valor(banco, QUERY_EM_ATRASO_RECEBER_ANTIGA.format(filtros=filtros), params_filtros),
+            _valor(banco, QUERY_PRAZO_MEDIO_ANTIGA.format(filtros=filtros), periodo + params_filtros),
+        ]
+
+        query, params = montar_query_big_numbers_contas_receber(consulta)
+        obtido = [valor or 0.0 for valor in banco.execute(query, _params(params)).fetchone()]
+
+        assert all(_aproximado(a, b) for a, b in zip(esperado, obtido)), (consulta, esperado, obtido)
+
+def test_big_numbers_contas_pagar():
+    banco = criar_banco()
+    for consulta in CONSULTAS:
+        filtros, params_filtros = _filtros(consulta, ["codfornecedor", "codtransacao"])
+        periodo = _periodo(consulta)
+        esperado = [
+            _valor(banco, QUERY_PAGO_ANTIGA.format(filtros=filtros), periodo + params_filtros),
+            _valor(banco, QUERY_A_PAGAR_ANTIGA.format(filtros=filtros), periodo + params_filtros),
+            _valor(banco, QUERY_EM_ATRASO_PAGAR_ANTIGA.format(filtros=filtros), params_filtros),
+        ]
+
+        query, params = montar_query_big_numbers_contas_pagar(consulta)
+        obtido = [valor or 0.0 for valor in banco.execute(query, _params(params)).fetchone()]
+
+        assert all(_aproximado(a, b) for a, b in zip(esperado, obtido)), (consulta, esperado, obtido)
+
+def _comparar_agrupado(banco, query_antiga, campos, montar):
+    for consulta in CONSULTAS:
+        filtros, params_filtros = _filtros(consulta, campos)
+        params_antigos = _periodo(consulta) + params_filtros + params_filtros
+        esperado = banco.execute(query_antiga.format(filtros=filtros), _params(params_antigos)).fetchall()
+
+        query, params = montar(consulta)
+        obtido = banco.execute(query, _params(params)).fetchall()
+
+        assert len(esperado) == len(obtido), (consulta, esperado, obtido)
+        esperado = {(linha[0], linha[1]): linha[2] for linha in esperado}
+        obtido = {(linha[0], linha[1]): linha[2] for linha in obtido}
+        assert esperado.keys() == obtido.keys(), (consulta, esperado, obtido)
+        assert all(_aproximado(esperado[chave], obtido[chave]) for chave in esperado), (consulta, esperado, obtido)
+
+def test_a_receber_cliente():
+    _comparar_agrupado(criar_banco(), QUERY_A_RECEBER_CLIENTE_ANTIGA,
+                       ["codfilial", "codcliente"], montar_query_a_receber_cliente)
+
+def test_a_pagar_fornecedor():
+    _comparar_agrupado(criar_banco(), QUERY_A_PAGAR_FORNECEDOR_ANTIGA,
+                       ["codfornecedor", "codtransacao"], montar_query_a_pagar_fornecedor)
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("REGRESSÃO CONTAS A RECEBER / A PAGAR (consultas antigas x novas)")
+    print("=" * 60)
+    for teste in (test_big_numbers_contas_receber, test_big_numbers_contas_pagar,
+                  test_a_receber_cliente, test_a_pagar_fornecedor):
+        teste()
+        print(f"✅ {teste.__name__}")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Teste dos filtros do FiltrosBI nas consultas Firebird (app/utils/filtrosbi.py)
+Verifica o tamanho das listas do IN, a forma canônica dos valores e o SQL/params gerados,
+inclusive a troca pela TMP_BI_FILTRO acima do BI_LIMITE_IN_LIST
+"""
+
+from app.schemas.BIschemas import FiltrosBI
+import app.utils.filtrosbi as filtrosbi
+from app.utils.filtrosbi import (
+    COLUNAS_FACTRC,
+    COLUNAS_FRCTRC,
+    COLUNAS_CPTIT,
+    ListaTemporaria,
+    tamanho_in,
+    valores_in,
+    compilar_filtros,
+)
+
+
+def test_tamanho_in():
+    esperado = {1: 1, 2: 4, 4: 4, 5: 16, 16: 16, 17: 64, 64: 64, 65: 128, 128: 128, 129: 192}
+    for quantidade, tamanho in esperado.items():
+        assert tamanho_in(quantidade) == tamanho, (quantidade, tamanho_in(quantidade))
+
+def test_valores_in():
+    assert valores_in(None) == []
+    assert valores_in([]) == []
+    assert valores_in(5) == [5]
+    assert valores_in("Sul") == ["Sul"]
+    # Sem repetição, ordenados e completados com o último valor
+    assert valores_in([3, 1, 3, 2]) == [1, 2, 3, 3]
+    assert valores_in([str(i) for i in range(5)]) == ["0", "1", "2", "3", "4"] + ["4"] * 11
+
+def test_compilar_filtros_sem_filtros():
+    assert compilar_filtros(FiltrosBI(), COLUNAS_FACTRC) == ("", [])
+
+def test_compilar_filtros_ordem_e_colunas():
+    consulta = FiltrosBI(regiao="Sul", codfilial=[2, 1, 2], ano=2025, dia=5)
+    sql, params = compilar_filtros(consulta, COLUNAS_FRCTRC)
+    # Campos na ordem do mapa, com as colunas da visão
+    assert sql == (
+        " AND codfilial IN (?, ?, ?, ?)"
+        " AND regiao IN (?)"
+        " AND ano_emissao IN (?)"
+        " AND dia_emissao IN (?)"
+    ), sql
+    assert params == [1, 2, 2, 2, "Sul", 2025, 5], params
+
+def test_compilar_filtros_campos_e_params():
+    consulta = FiltrosBI(codfilial=[1], codcliente=["9", "3"], codcid=[4])
+    params = ["inicio", "fim"]
+    sql, retorno = compilar_filtros(consulta, COLUNAS_FACTRC, ("codfilial", "codcliente"), params=params)
+    assert retorno is params
+    assert sql == " AND codfilial IN (?) AND codcliente IN (?, ?, ?, ?)", sql
+    assert params == ["inicio", "fim", 1, "3", "9", "9", "9"], params
+
+def test_compilar_filtros_mesmo_sql_para_listas_equivalentes():
+    a = compilar_filtros(FiltrosBI(codfornecedor=["b", "a"], codtransacao=[1]), COLUNAS_CPTIT)
+    b = compilar_filtros(FiltrosBI(codfornecedor=["a", "b", "a"], codtransacao=1), COLUNAS_CPTIT)
+    assert a == b, (a, b)
+
+def test_compilar_filtros_lista_temporaria():
+    limite = filtrosbi.BI_LIMITE_IN_LIST
+    filtrosbi.BI_LIMITE_IN_LIST = 3
+    try:
+        consulta = FiltrosBI(codcliente=[str(i) for i in range(5)], codpro=[7, 7, 8])
+        sql, params = compilar_filtros(consulta, COLUNAS_FACTRC)
+    finally:
+        filtrosbi.BI_LIMITE_IN_LIST = limite
+
+    assert sql == (
+        " AND codcliente IN (SELECT valor_txt FROM TMP_BI_FILTRO WHERE lista = ?)"
+        " AND codpro IN (?, ?, ?, ?)"
+    ), sql
+    lista = params[0]
+    assert isinstance(lista, ListaTemporaria)
+    assert lista.valores == ["0", "1", "2", "3", "4"]
+    assert lista.linhas()[0] == (lista.id, None, "0")
+    assert params[1:] == [7, 8, 8, 8], params
+    # A mesma lista gera o mesmo identificador
+    assert ListaTemporaria(["0", "1", "2", "3", "4"]).id == lista.id
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("FILTROS DO BI (IN canônico e TMP_BI_FILTRO)")
+    print("=" * 60)
+    for teste in (test_tamanho_in, test_valores_in, test_compilar_filtros_sem_filtros,
+                  test_compilar_filtros_ordem_e_colunas, test_compilar_filtros_campos_e_params,
+                  test_compilar_filtros_mesmo_sql_para_listas_equivalentes,
+                  test_compilar_filtros_lista_temporaria):
+        teste()
+        print(f"✅ {teste.__name__}")